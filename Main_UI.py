@@ -16,10 +16,14 @@ import re
 import io
 import subprocess
 import ftplib
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as ExcelImage
 from Modules.Capture_UI import CameraApp
 from Modules.Show_video import CameraDisplay
+from Modules.Inspection_engine import InspectionEngine
+from Modules.Live_session import LiveSession
+from Modules.Live_pipeline import LivePipeline
+from Modules.Stopping_policy import create_stopping_policy
+from Modules.Result_writer import ResultWriter
+from Modules.Station import InspectionStation
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -319,6 +323,9 @@ def handle_clear(canvas, serial_entry, app):
             raise ValueError(f"Failed to save board image as {save_board_path}")
         logger.info(f"Board image saved as {save_board_path}")
 
+        # Extract the reference board ORB features in the background so inspections only extract them from the frame
+        app.inspection_engine.prefetch_reference_features(save_board_path)
+
         # Process each ROI individually (ROI and JSON indices synced, independent of board)
         for i, roi in enumerate(app.roi_list):
             # Assign unique index for this ROI (synchronize JSON and image indices only)
@@ -660,6 +667,15 @@ class MainApplication:
         # Initialize the camera display from module
         self.camera_display = CameraDisplay(self.root, self.canvas, self.screen_height, self.screen_width)
 
+        # Initialize the headless inspection engine (CUDA when available, CPU otherwise)
+        self.inspection_engine = InspectionEngine()
+
+        # Background DB insert / PNG save / Excel export of finished boards; message boxes go back to the Tk thread
+        self.result_writer = ResultWriter(notify=self.notify_from_worker)
+
+        # Pipelined station mode: board N+1 is captured while board N is inspected and saved (on its own engine)
+        self.station = InspectionStation(self.capture, self.result_writer, on_event=self.on_station_event)
+
         # Initialize ImageWatcher with correct folder path
         folder_path = "/home/nvidia/SHARPEYE_DATA/Captured_images"
         self.watcher = ImageWatcher(self, folder_path, self.canvas, self, update_interval=0.1)
@@ -728,6 +744,10 @@ class MainApplication:
         self.compare_btn_inspect = ctk.CTkButton(self.top_frame, text="INSPECT", font=("Arial", 12, "bold"), command=self.match_and_annotate, image=icon_image_compare, compound="left")
         self.compare_btn_inspect.pack_forget()
 
+        # Station mode: CAPTURE queues the board for capture, inspection and saving, INSPECT is not needed
+        self.station_mode = ctk.CTkSwitch(self.top_frame, text="STATION MODE", font=("Arial", 12, "bold"))
+        self.station_mode.pack_forget()
+
         icon_path_save = "/home/nvidia/SHARPEYE_DATA/Assets/save.png"
         icon_image_save = ctk.CTkImage(Image.open(icon_path_save), size=(20, 20))
         self.clear_btn = ctk.CTkButton(self.top_frame, text="SAVE", width=120, font=("Arial", 12, "bold"), command=lambda: handle_clear(self.canvas, self.serial_entry, self), image=icon_image_save, compound="left")
@@ -767,6 +787,11 @@ class MainApplication:
 
 
     # get the USB camera device
+    def notify_from_worker(self, kind, title, message):
+        """Show a message box for a background thread: Tk widgets are only touched from the main loop"""
+        show = {"info": messagebox.showinfo, "warning": messagebox.showwarning, "error": messagebox.showerror}[kind]
+        self.root.after(0, show, title, message)
+
     def get_camera_usb_device(self):
         try:
             result = subprocess.run(["lsusb"], capture_output=True, text=True)
@@ -851,6 +876,7 @@ class MainApplication:
             self.compare_btn_inspect.pack(side="left", padx=5, pady=15)
             self.re_inspect_btn.pack(side="left", padx=5, pady=15)
             self.clear_serial.pack(side="left", padx=5, pady=15)
+            self.station_mode.pack(side="left", padx=5, pady=15)
             self.serial_entry.focus_set()
 
             """pack forget for profile capture"""
@@ -877,6 +903,7 @@ class MainApplication:
             self.compare_btn_inspect.pack_forget()
             self.re_inspect_btn.pack_forget()
             self.clear_serial.pack_forget()
+            self.station_mode.pack_forget()
             self.dropdown_mb_position_inspect.pack_forget()
             self.dropdown_mb_position_profile_NG.pack_forget()
             self.clear_btn_NG.pack_forget()
@@ -899,6 +926,7 @@ class MainApplication:
             self.compare_btn_inspect.pack_forget()
             self.re_inspect_btn.pack_forget()
             self.clear_serial.pack_forget()
+            self.station_mode.pack_forget()
             self.dropdown_mb_position_inspect.pack_forget()
             self.dropdown_mb_position_inspect.set("---Select MB Position---")
 
@@ -911,6 +939,7 @@ class MainApplication:
             self.compare_btn_inspect.pack_forget()
             self.re_inspect_btn.pack_forget()
             self.clear_serial.pack_forget()
+            self.station_mode.pack_forget()
             self.clear_serial_profile.pack_forget()
             self.dropdown_mb_position_inspect.pack_forget()
             self.dropdown_mb_position_profile.pack_forget()
@@ -937,7 +966,7 @@ class MainApplication:
         MB_position = selected_value
         logger.info(f"Selected MB Position for profiling {MB_position}")
 
-    def check_serial_exists(self, serial_number):
+    def check_serial_exists(self, serial_number, prefetch=True):
         # Configure SQL Server connection details
         server = '192.168.1.152,1433\\SQLEXPRESS'
         database = 'SharpeyeWeb'
@@ -972,6 +1001,9 @@ class MainApplication:
                 self.part_number = result[2] if result[2] is not None else "N/A"
                 logger.info(f"Serial number '{serial_number}' exists in database. TP: {self.tp}, P/N: {self.part_number}")
                 print(f"Serial number: {serial_number}, TP: {self.tp}, P/N: {self.part_number}")
+                # Load the recipes of every MB position while the operator gets ready to inspect
+                if prefetch:
+                    self.inspection_engine.prefetch(self.tp, self.part_number)
                 return False
             else:
                 # Serial number does not exist
@@ -1078,436 +1110,113 @@ class MainApplication:
     def match_and_annotate(self):
         global MB_position
 
-        """Perform template matching for all ROI images and annotate live video feed with rectangles using template match location and JSON width/height (CUDA-accelerated)"""
-        base_roi_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data"
-        base_roi_ng_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data_NG"
-        base_json_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data"
-        base_json_ng_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data_NG"
-
-        # confidence threshold for trial
-        confidence_threshold = 0.75  # for trial
-
-        # Database config
-        driver = '{ODBC Driver 18 for SQL Server}'
-        server = '192.168.1.152,1433\\SQLEXPRESS'
-        database = 'SharpeyeWeb'
-        username = "CBE_QAS"
-        password = "cre100"
-        trust_certificate = 'Yes'
-        connection_timeout = '30'
-
-        # Validate inputs
-        for var_name, var_value in [("self.tp", self.tp), ("self.part_number", self.part_number), ("MB_position", MB_position)]:
-            if not isinstance(var_value, str):
-                logger.error(f"{var_name} is not a string: {var_value} (type: {type(var_value)})")
-                raise ValueError(f"{var_name} must be a string, got {type(var_value)}: {var_value}")
-
-        # Construct specific folder paths based on TP and P/N for GOOD and NG folders
-        roi_folders = [
-            (os.path.join(base_roi_folder, "GOOD", f"{self.part_number}_{self.tp}", MB_position),), 
-            (os.path.join(base_roi_ng_folder, "NG", f"{self.part_number}_{self.tp}", MB_position),)
-        ]
-        json_folders = [
-            (os.path.join(base_json_folder, "GOOD", f"{self.part_number}_{self.tp}", MB_position),),
-            (os.path.join(base_json_ng_folder, "NG", f"{self.part_number}_{self.tp}", MB_position),)
-        ]
-        folder_types = ["GOOD", "NG"]  # Corresponding folder types
-
-        # Debug: Log folder lists and MB_position
+        """Perform template matching for all ROI images and annotate live video feed with rectangles using template match location and JSON width/height (CUDA-accelerated when available)"""
+        # Load the recipe (GOOD and NG ROI templates, annotations and reference boards)
         logger.info(f"MB_position: {MB_position}")
-        logger.info(f"roi_folders: {roi_folders}")
-        logger.info(f"json_folders: {json_folders}")
-        for i, (roi_folder_tuple, json_folder_tuple) in enumerate(zip(roi_folders, json_folders)):
-            logger.info(f"roi_folders[{i}]: {roi_folder_tuple}, type: {type(roi_folder_tuple)}, len: {len(roi_folder_tuple)}")
-            logger.info(f"json_folders[{i}]: {json_folder_tuple}, type: {type(json_folder_tuple)}, len: {len(json_folder_tuple)}")
-
-        # Initialize VideoCapture using GStreamer pipeline if not already done
-        if not hasattr(self, 'cap') or self.cap is None:
-            if not self.capture.initialize_camera():
-                logger.error("Failed to initialize capture with GStreamer pipeline")
-                raise ValueError("Failed to initialize capture with GStreamer pipeline")
+        try:
+            recipe = self.inspection_engine.load_recipe(self.tp, self.part_number, MB_position)
+        except FileNotFoundError as e:
+            messagebox.showerror("Error", f"{e}")
+            raise
+
+        # Frames come from the video display's grabber thread (GStreamer pipeline), opened here if not already running
+        grabber = self.camera_display.ensure_capture()
+        if grabber is None:
+            logger.error("Failed to initialize capture with GStreamer pipeline")
+            raise ValueError("Failed to initialize capture with GStreamer pipeline")
 
         # Get initial frame for dimensions
-        ret, frame = self.cap.read()
-        if not ret:
+        frame, frame_sequence = grabber.read(timeout=2.0)
+        if frame is None:
+            self.camera_display.release_capture()
             logger.error("Could not read initial frame")
             raise ValueError("Could not read initial frame")
         img_height, img_width = frame.shape[:2]
         logger.info(f"Live frame dimensions: {img_width}x{img_height}")
 
-        # Get the GOOD ROI folder for reference images
-        good_roi_folder = f"/home/nvidia/SHARPEYE_DATA/Profiling_data/GOOD/{self.tp}_{self.part_number}/{MB_position}/Board_image"
-
-        # One-time auto-alignment setup (compute reference and homography once using initial frame)
-        reference_img = None
-        homography_matrix = None
-        initial_frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gpu_initial = cv2.cuda_GpuMat()
-        gpu_initial.upload(frame)
-        gpu_initial_gray = cv2.cuda.cvtColor(gpu_initial, cv2.COLOR_BGR2GRAY)
-
-        if os.path.exists(good_roi_folder):
-            png_files = [f for f in os.listdir(good_roi_folder) if f.lower().endswith('.png')]
-            logger.info(f"Found {len(png_files)} potential reference images in {good_roi_folder}")
-
-            orb_gpu = cv2.cuda.ORB_create(maxFeatures=5000)
-            kp2_gpu, des2_gpu = orb_gpu.detectAndCompute(gpu_initial_gray, None)
-
-            if des2_gpu is not None:
-                des2 = des2_gpu.download()
-                best_reference_path = None
-                best_score = -1
-                for png_file in png_files:
-                    candidate_path = os.path.join(good_roi_folder, png_file)
-                    candidate_img = cv2.imread(candidate_path)
-                    if candidate_img is None:
-                        continue
-
-                    candidate_gray = cv2.cvtColor(candidate_img, cv2.COLOR_BGR2GRAY)
-                    cand_height, cand_width = candidate_gray.shape
-                    if cand_width > img_width or cand_height > img_height:
-                        logger.info(f"Skipping candidate {png_file} as it is larger than frame")
-                        continue
-
-                    gpu_candidate = cv2.cuda_GpuMat()
-                    gpu_candidate.upload(candidate_img)
-                    gpu_candidate_gray = cv2.cuda.cvtColor(gpu_candidate, cv2.COLOR_BGR2GRAY)
-
-                    kp1_gpu, des1_gpu = orb_gpu.detectAndCompute(gpu_candidate_gray, None)
-                    if des1_gpu is None:
-                        gpu_candidate.release()
-                        continue
-                    des1 = des1_gpu.download()
-
-                    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                    matches = bf.match(des1, des2)
-                    matches = sorted(matches, key=lambda x: x.distance)
-                    good_matches = [m for m in matches[:50] if m.distance < 50]
-                    score = len(good_matches)
-
-                    logger.info(f"Candidate {png_file}: {score} good matches")
-
-                    if score > best_score:
-                        best_score = score
-                        best_reference_path = candidate_path
-
-                    gpu_candidate.release()
-
-                if best_reference_path is not None:
-                    logger.info(f"Selected best reference image: {os.path.basename(best_reference_path)} with {best_score} good matches")
-                    reference_img = cv2.imread(best_reference_path)
-
-        # Compute homography once if reference found
-        if reference_img is not None:
-            try:
-                gpu_reference = cv2.cuda_GpuMat()
-                gpu_reference.upload(reference_img)
-                gpu_reference_gray = cv2.cuda.cvtColor(gpu_reference, cv2.COLOR_BGR2GRAY)
-
-                orb_gpu = cv2.cuda.ORB_create(maxFeatures=5000)
-                kp1_gpu, des1_gpu = orb_gpu.detectAndCompute(gpu_reference_gray, None)
-                kp2_gpu, des2_gpu = orb_gpu.detectAndCompute(gpu_initial_gray, None)
-
-                if des1_gpu is not None and des2_gpu is not None:
-                    des1 = des1_gpu.download()
-                    des2 = des2_gpu.download()
-                    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                    matches = bf.match(des1, des2)
-                    matches = sorted(matches, key=lambda x: x.distance)
-                    good_matches = [m for m in matches[:50] if m.distance < 50]
-
-                    if len(good_matches) > 10:
-                        src_pts = np.float32([kp1_gpu[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                        dst_pts = np.float32([kp2_gpu[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                        homography_matrix, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
-                        if homography_matrix is not None:
-                            logger.info("Auto-alignment homography computed successfully")
-                        else:
-                            logger.warning("Homography computation failed")
-                    else:
-                        logger.warning(f"Insufficient good matches for alignment ({len(good_matches)})")
-                else:
-                    logger.warning("Failed to compute descriptors for alignment")
-            except Exception as e:
-                logger.warning(f"Auto-alignment setup failed: {e}")
-            finally:
-                if 'gpu_reference' in locals():
-                    gpu_reference.release()
-                if 'gpu_reference_gray' in locals():
-                    gpu_reference_gray.release()
-                if 'orb_gpu' in locals():
-                    del orb_gpu
-
-        gpu_initial.release()
-        gpu_initial_gray.release()
-
-        # Pre-load all ROI images and annotations to GPU for efficiency
-        all_rois_gpu = {}  # roi_filename -> (gpu_roi_gray, folder_type, matched_annotation)
-        all_annotations = []
-        expected_rois = set()  # Track all expected ROIs for completion check
-
-        # Process both GOOD and NG folders
-        for i, ((roi_folder,), (json_folder,)) in enumerate(zip(roi_folders, json_folders)):
-            folder_type = folder_types[i]
-
-            logger.info(f"Accessing ROI folder ({folder_type}): {roi_folder}")
-            logger.info(f"Accessing JSON folder ({folder_type}): {json_folder}")
-
-            if not os.path.exists(roi_folder) or not os.path.exists(json_folder):
-                if folder_type == "NG":
-                    logger.warning(f"Folder(s) (NG) not found, skipping NG processing")
-                    continue
-                else:
-                    logger.error(f"Folder(s) ({folder_type}) not found")
-                    messagebox.showerror("Error", f"Profiling folder(s) ({folder_type}) not found")
-                    raise FileNotFoundError(f"Folder(s) ({folder_type}) not found")
-
-            json_files = [f for f in os.listdir(json_folder) if f.lower().endswith('.json')]
-            if not json_files:
-                if folder_type == "NG":
-                    logger.warning(f"No JSON files found in {json_folder} (NG)")
-                    continue
-                else:
-                    logger.error(f"No JSON files found in {json_folder}")
-                    raise FileNotFoundError(f"No JSON files found in {json_folder}")
-
-            for json_file in json_files:
-                json_path = os.path.join(json_folder, json_file)
-                try:
-                    with open(json_path, 'r') as f:
-                        annotations = json.load(f)
-                        all_annotations.extend(annotations)
-                except Exception as e:
-                    logger.error(f"Failed to load JSON {json_path}: {e}")
-
-            # Pre-load ROIs to GPU and track expected
-            for roi_filename in os.listdir(roi_folder):
-                if roi_filename.lower().endswith('.png'):
-                    expected_rois.add(roi_filename)
-                    roi_path = os.path.join(roi_folder, roi_filename)
-                    roi_img = cv2.imread(roi_path, cv2.IMREAD_UNCHANGED)
-                    if roi_img is None:
-                        continue
-
-                    matched_annotation = None
-                    for anno in all_annotations:
-                        if anno.get('ROI_image_index') == roi_filename:
-                            matched_annotation = anno
-                            break
-
-                    if not matched_annotation:
-                        logger.warning(f"No annotation found for ROI: {roi_filename} ({folder_type})")
-                        continue
-
-                    try:
-                        roi_gray_cpu = cv2.cvtColor(roi_img, cv2.COLOR_BGR2GRAY)
-                        roi_height, roi_width = roi_gray_cpu.shape
-                        logger.info(f"ROI image {roi_filename} ({folder_type}) dimensions: {roi_width}x{roi_height}")
-
-                        if roi_width > img_width or roi_height > img_height:
-                            logger.warning(f"ROI {roi_filename} ({folder_type}) is larger than frame, skipping")
-                            continue
-
-                        gpu_roi_gray = cv2.cuda_GpuMat()
-                        gpu_roi_gray.upload(roi_gray_cpu)
-
-                        all_rois_gpu[roi_filename] = (gpu_roi_gray, folder_type, matched_annotation)
-                    except Exception as e:
-                        logger.warning(f"Failed to prepare ROI {roi_filename} ({folder_type}) for GPU: {e}")
-
-        logger.info(f"Pre-loaded {len(all_rois_gpu)} ROI-annotation pairs. Expected ROIs: {len(expected_rois)}")
-
-        # List to store unique successful detections (accumulate over session)
-        detection_results = []
-        detected_rois = set()  # Track detected ROIs to check completion
+        # Confirmed ROIs leave the matching set; completion counts only the ROIs actually loaded
+        session = LiveSession(self.inspection_engine)
+        logger.info(f"Pre-loaded {len(recipe)} ROI-annotation pairs. Expected ROIs: {len(session.locations)} "
+                    f"({len(recipe.expected_rois)} ROI images)")
 
         # Live viewing loop
         frame_count = 0
-        process_every_n_frames = 5  # Adjust for performance (higher = less frequent processing)
         live_window_name = "Live Annotated View"
         cv2.namedWindow(live_window_name, cv2.WINDOW_NORMAL)
 
-        # Auto-save condition: Save when all expected ROIs detected or after max_frames
-        max_frames = 300  # e.g., ~10s at 30fps; adjust as needed
-        consecutive_no_new = 0
-        no_new_threshold = 30  # Frames without new detections before auto-save
-
-        logger.info("Starting live viewing. Auto-saving when all detections loaded or max frames reached. Press 'q' to quit early.")
-        while frame_count < max_frames:
-            ret, frame = self.cap.read()
-            if not ret:
-                logger.warning("Failed to grab frame")
-                break
-
-            frame_count += 1
-            annotated_frame = frame.copy()
-            current_gray_cpu = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2GRAY)
-            gpu_current = cv2.cuda_GpuMat()
-            gpu_current.upload(annotated_frame)
-            gpu_current_gray = cv2.cuda.cvtColor(gpu_current, cv2.COLOR_BGR2GRAY)
-
-            # Apply homography if available (align frame on GPU)
-            if homography_matrix is not None:
-                try:
-                    aligned_gpu = cv2.cuda.warpPerspective(gpu_current, homography_matrix, (img_width, img_height))
-                    gpu_current_gray = cv2.cuda.cvtColor(aligned_gpu, cv2.COLOR_BGR2GRAY)
-                    annotated_frame = aligned_gpu.download()
-                    current_gray_cpu = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2GRAY)
-                except Exception as e:
-                    logger.warning(f"Frame alignment failed: {e}")
-
-            # Process matching only every N frames
-            if frame_count % process_every_n_frames == 0:
-                new_detections_this_frame = 0
-                for roi_filename, (gpu_roi_gray, folder_type, matched_annotation) in all_rois_gpu.items():
-                    try:
-                        # CUDA template matching
-                        gpu_result = cv2.cuda.matchTemplate(gpu_current_gray, gpu_roi_gray, cv2.TM_CCOEFF_NORMED)
-                        result = gpu_result.download()
-
-                        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-                        logger.debug(f"Frame {frame_count} - ROI {roi_filename} ({folder_type}): confidence={max_val:.2f}")
-
-                        if max_val >= confidence_threshold:
-                            x, y = max_loc
-                            width = int(matched_annotation['width'])
-                            height = int(matched_annotation['height'])
-                            top_left = (x, y)
-                            bottom_right = (x + width, y + height)
-
-                            if 0 <= x < img_width and 0 <= y < img_height and x + width <= img_width and y + height <= img_height:
-                                color = (0, 255, 0) if folder_type == "GOOD" else (0, 0, 255)
-                                cv2.rectangle(annotated_frame, top_left, bottom_right, color, 2)
-
-                                label = matched_annotation.get('serial_number', '')
-                                cv2.putText(annotated_frame, f"({folder_type}) {label}", (x, y - 10),
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-                                # Accumulate unique detections
-                                if roi_filename not in detected_rois:
-                                    detected_rois.add(roi_filename)
-                                    detection_results.append((label, self.tp, self.part_number, roi_filename, folder_type, MB_position))
-                                    new_detections_this_frame += 1
-                                    logger.info(f"New detection: {roi_filename} ({folder_type}) at frame {frame_count}")
-
-                    except Exception as e:
-                        logger.warning(f"Template matching failed for {roi_filename}: {e}")
-
-                if new_detections_this_frame == 0:
-                    consecutive_no_new += 1
-                else:
-                    consecutive_no_new = 0
-
-            # Display live frame
-            cv2.imshow(live_window_name, annotated_frame)
-
-            # Check auto-save conditions
-            all_detected = len(detected_rois) >= len(expected_rois)
-            if all_detected or consecutive_no_new >= no_new_threshold or frame_count >= max_frames:
-                logger.info(f"Auto-save triggered: All detected ({all_detected}), no new for {consecutive_no_new} frames, or max frames {frame_count}")
-                break
-
-            # Exit on 'q'
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                logger.info("Quit pressed, saving results.")
-                break
+        # Auto-save condition: the recipe's stopping policy (all ROI locations detected, stable scores, frame / time budget)
+        stopping_policy = create_stopping_policy(recipe.settings)
 
-            # Release per-frame GPU mats
-            gpu_current.release()
-            gpu_current_gray.release()
+        # Alignment, matching and drawing run on their own threads; this loop only feeds frames and displays results
+        live = LivePipeline(self.inspection_engine, session, stopping_policy).start()
+        annotated_frame = None
 
+        logger.info("Starting live viewing. Auto-saving when the stopping policy ends the session. Press 'q' to quit early.")
+        try:
+            while True:
+                frame_count += 1
+
+                # Always the newest frame: frames that arrive while the stages are busy are dropped, not queued
+                live.submit(frame, frame_sequence)
+
+                annotated_frame = self.show_live_results(live, annotated_frame)
+
+                # Display live frame
+                if annotated_frame is not None:
+                    cv2.imshow(live_window_name, annotated_frame)
+
+                # Check auto-save conditions
+                if live.stop_reason:
+                    logger.info(f"Auto-save triggered at frame {frame_count}: {live.stop_reason}")
+                    break
+
+                # Exit on 'q'
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    logger.info("Quit pressed, saving results.")
+                    break
+
+                next_frame, frame_sequence = grabber.read(after=frame_sequence)
+                if next_frame is None:
+                    logger.warning("Failed to grab frame")
+                    break
+                frame = next_frame
+        finally:
+            # Frames still waiting are dropped, the ones already matched are drawn; the grabber only keeps
+            # running for the video display
+            live.close()
+            self.camera_display.release_capture()
+
+        # Collect the views of the frames drawn while closing
+        annotated_frame = self.show_live_results(live, annotated_frame)
+        if annotated_frame is None and session.detections:
+            annotated_frame = live.final_view(frame)
         cv2.destroyAllWindows()
-        # Do not release self.cap here; keep it open for other uses. If needed, add self.cap.release() and self.cap = None
+        logger.info(f"Live session: {session.stats()}")
+        logger.info(f"Live pipeline: {live.stats()}")
+        logger.info(f"Frame grabber: {grabber.stats()}")
+
+        # Unique successful detections accumulated over the session
+        detection_results = [(detection["label"], self.tp, self.part_number, detection["name"], detection["folder_type"], MB_position)
+                             for detection in session.detections]
 
-        # Save automatically once detections are loaded
+        # Saved in the background (DB insert, PNG, Excel), so the next board can be inspected right away
         if detection_results:
             logger.info(f"Live session ended. Saving {len(detection_results)} detections.")
-
-            datetime_saved = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-
-            # Save to DB
-            try:
-                conn = pyodbc.connect(
-                    f'DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password};TrustServerCertificate={trust_certificate};Connection timeout={connection_timeout};'
-                )
-                cursor = conn.cursor()
-                for label, tp_val, part_number, roi_filename, detection_status, mb_pos in detection_results:
-                    cursor.execute("""
-                        INSERT INTO TBL_PER_LOC (Serial_number, Model, Part_number, Item_detected, Status, MB_position, Date_saved)        
-                        VALUES (?, ?, ?, ?, ?, ?, ?)                
-                    """, (label, tp_val, part_number, roi_filename, detection_status, mb_pos, datetime_saved))
-                conn.commit()
-                cursor.close()
-                conn.close()
-                messagebox.showinfo("Info", "Saved Data Successfully!")
-                logger.info(f"Saved {len(detection_results)} detection results to DB.")
-            except Exception as e:
-                logger.error(f"Failed to save to DB: {e}")
-
-            # Save last annotated frame as PNG
-            output_result_path = "/home/nvidia/SHARPEYE_DATA/Result_images"
-            os.makedirs(output_result_path, exist_ok=True)
-            timestamp_save_result = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-            output_path = f"{output_result_path}/{self.tp}_{self.part_number}_{timestamp_save_result}.png"
-            cv2.imwrite(output_path, annotated_frame)
-            logger.info(f"Saved final annotated frame to {output_path}")
-
-            # Save to Excel
-            output_result_path_excel = "/home/nvidia/SHARPEYE_DATA/Excel_data"
-            os.makedirs(output_result_path_excel, exist_ok=True)
-            try:
-                from openpyxl import Workbook
-                from openpyxl.drawing.image import Image as ExcelImage
-                from PIL import Image as PILImage
-
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "Detection Results"
-                headers = ["Serial_number", "Model", "Part_number", "Item_detected", "Status", "MB_position", "Date_saved"]
-                ws.append(headers)
-                for col in range(1, 8):
-                    ws.column_dimensions[chr(64 + col)].width = 30
-
-                # Resize last annotated image for Excel
-                temp_img_path = f"{output_result_path}/temp_annotated.png"
-                pil_img = PILImage.open(output_path)
-                target_size = (100, 100)
-                pil_img.thumbnail(target_size, PILImage.LANCZOS)
-                pil_img.save(temp_img_path, format="PNG")
-
-                for idx, (label, tp_val, part_number, roi_filename, detection_status, mb_pos) in enumerate(detection_results, start=2):
-                    ws.cell(row=idx, column=1).value = label
-                    ws.cell(row=idx, column=2).value = tp_val
-                    ws.cell(row=idx, column=3).value = part_number
-                    ws.cell(row=idx, column=4).value = roi_filename
-                    ws.cell(row=idx, column=5).value = detection_status
-                    ws.cell(row=idx, column=6).value = mb_pos
-                    ws.cell(row=idx, column=7).value = datetime_saved
-
-                    img_excel = ExcelImage(temp_img_path)
-                    ws.add_image(img_excel, f"H{idx}")
-                    ws.row_dimensions[idx].height = 80
-
-                timestamp_excel = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-                excel_path = f"{output_result_path_excel}/{self.tp}_{self.part_number}_Results_{timestamp_excel}.xlsx"
-                wb.save(excel_path)
-                wb.close()
-                os.remove(temp_img_path)
-                logger.info(f"Saved to Excel: {excel_path}")
-
-                # Optional FTP upload (uncomment if needed)
-                # def save_to_ftp(...): ...  # Paste the function here if using
-                # save_to_ftp(excel_path, "192.168.1.152", "share", "share", "/josh/Excel_data_SE")
-            except Exception as e:
-                logger.error(f"Failed to save to Excel: {e}")
+            self.result_writer.submit({
+                "tp": self.tp,
+                "part_number": self.part_number,
+                "detections": detection_results,
+                "view": annotated_frame,
+                "datetime_saved": datetime.now().strftime("%Y-%m-%d_%H:%M:%S"),
+            })
+            logger.info(f"Result pipeline: {self.result_writer.stats()}")
         else:
             logger.info("No detections in live session.")
 
         # Release remaining GPU resources
-        for gpu_roi in all_rois_gpu.values():
-            gpu_roi[0].release()
+        self.inspection_engine.release()
 
-        # Optional: Display the final annotated image if needed
+        # Optional: Display the final annotated image if needed (the PNG is written by the result pipeline)
         # self.display_annotated_image(output_path)
 
 
@@ -1612,12 +1321,50 @@ class MainApplication:
                 logger.info("MB Position is missing when capturing.")
             return
 
+        if self.station_mode.get():
+            self.capture_board(serial_number, position_mb_inspect)
+            return
+
         self.hide_video()
         time.sleep(0.5)
         self.capture.capture_photo()
         self.display_image()
         self.unbind_mouse_events()
 
+    def show_live_results(self, live, annotated_frame):
+        """Log the new detections of the drawn live frames, returns the newest annotated view"""
+        for item in live.results():
+            for detection in item["new"]:
+                logger.info(f"New detection: {detection['name']} ({detection['folder_type']}) at frame {item['sequence']}")
+            annotated_frame = item["view"]
+        return annotated_frame
+
+    def capture_board(self, serial_number, position_mb_inspect):
+        """Station mode: queue the board and free the serial entry for the next one while it is inspected"""
+        # Resolve TP / P/N for this very serial, so the board carries its own and not the previous board's;
+        # the station's engine prefetches the recipe itself, the UI's engine does not need it
+        if self.check_serial_exists(serial_number, prefetch=False):
+            return
+        if not self.station.submit(serial_number, self.tp, self.part_number, position_mb_inspect):
+            messagebox.showinfo("Info", f"Board {self.station.capturing} is still being captured.")
+            return
+        self.hide_video()
+        # The watcher shows every new photo by itself once running
+        if not self.watcher.running:
+            self.display_image()
+        self.unbind_mouse_events()
+        self.serial_entry.delete(0, "end")
+        self.serial_entry.focus_set()
+
+    def on_station_event(self, board, event):
+        """Station progress from the worker threads; message boxes are handed to the Tk thread"""
+        if event == "captured":
+            logger.info(f"Board {board['serial']} captured, the next board can be placed")
+        elif event == "failed":
+            self.notify_from_worker("error", "Error", f"Board {board['serial']}: {board['error']}")
+        elif event == "inspected":
+            logger.info(f"Station: {self.station.stats()}")
+
     def display_image(self):
         self.clear_canvas()
         self.watcher.start()
@@ -1662,6 +1409,9 @@ class MainApplication:
         if messagebox.askyesno("Exit", "Are you sure you want to exit the application?"):
             print("Performing clean up before closing the application.")
             self.watcher.stop()
+            self.station.close()
+            self.result_writer.close()
+            self.inspection_engine.close()
             self.root.destroy()
         else:
             print("Exit aborted.")
@@ -20,6 +20,7 @@ from openpyxl import Workbook
 from openpyxl.drawing.image import Image as ExcelImage
 from Modules.Capture_UI import CameraApp
 from Modules.Show_video import CameraDisplay
+from Modules.Inspection_engine import InspectionEngine
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,6 +29,10 @@ logger = logging.getLogger(__name__)
 MB_position = None # for inspection
 img_cv = None # make the revised image in global
 
+"""Inspection engine settings for CPU stations"""
+MATCH_WORKERS = max(1, (os.cpu_count() or 1) // 2) # processes matching ROIs in parallel
+CV_THREADS_PER_WORKER = 2 # OpenCV threads per matching process (workers x threads ~ cores)
+
 """Global function to access the TP and PART NUMBER"""
 def global_function_tp_pn(main_app):
     if main_app.tp and main_app.part_number:
@@ -318,6 +323,9 @@ def handle_clear(canvas, serial_entry, app):
             raise ValueError(f"Failed to save board image as {save_board_path}")
         logger.info(f"Board image saved as {save_board_path}")
 
+        # Extract the reference board ORB features in the background so inspections only extract them from the frame
+        app.inspection_engine.prefetch_reference_features(save_board_path)
+
         # Process each ROI individually (ROI and JSON indices synced, independent of board)
         for i, roi in enumerate(app.roi_list):
             # Assign unique index for this ROI (synchronize JSON and image indices only)
@@ -659,6 +667,9 @@ class MainApplication:
         # Initialize the camera display from module
         self.camera_display = CameraDisplay(self.root, self.canvas, self.screen_height, self.screen_width)
 
+        # Initialize the headless inspection engine (CUDA when available, CPU otherwise)
+        self.inspection_engine = InspectionEngine(match_workers=MATCH_WORKERS, cv_threads_per_worker=CV_THREADS_PER_WORKER)
+
         # Initialize ImageWatcher with correct folder path
         folder_path = "/home/nvidia/SHARPEYE_DATA/Captured_images"
         self.watcher = ImageWatcher(self, folder_path, self.canvas, self, update_interval=0.1)
@@ -971,6 +982,8 @@ class MainApplication:
                 self.part_number = result[2] if result[2] is not None else "N/A"
                 logger.info(f"Serial number '{serial_number}' exists in database. TP: {self.tp}, P/N: {self.part_number}")
                 print(f"Serial number: {serial_number}, TP: {self.tp}, P/N: {self.part_number}")
+                # Load the recipes of every MB position while the operator gets ready to inspect
+                self.inspection_engine.prefetch(self.tp, self.part_number)
                 return False
             else:
                 # Serial number does not exist
@@ -1078,15 +1091,8 @@ class MainApplication:
         global MB_position
 
         """Perform template matching for all ROI images and annotate captured image with rectangles using template match location and JSON width/height"""
-        base_roi_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data"
-        base_roi_ng_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data_NG"
-        base_json_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data"
-        base_json_ng_folder = "/home/nvidia/SHARPEYE_DATA/Profiling_data_NG"
         captured_image_path = f"/home/nvidia/SHARPEYE_DATA/Resize_images/resized_{self.tp}_{self.part_number}.png"
 
-        # confidence threshold for trial
-        confidence_threshold = 0.75  # for trial
-
         # Database config
         driver = '{ODBC Driver 18 for SQL Server}'
         server = '192.168.1.152,1433\\SQLEXPRESS'
@@ -1096,30 +1102,13 @@ class MainApplication:
         trust_certificate = 'Yes'
         connection_timeout = '30'
 
-        # Validate inputs
-        for var_name, var_value in [("self.tp", self.tp), ("self.part_number", self.part_number), ("MB_position", MB_position)]:
-            if not isinstance(var_value, str):
-                logger.error(f"{var_name} is not a string: {var_value} (type: {type(var_value)})")
-                raise ValueError(f"{var_name} must be a string, got {type(var_value)}: {var_value}")
-
-        # Construct specific folder paths based on TP and P/N for GOOD and NG folders
-        roi_folders = [
-            (os.path.join(base_roi_folder, "GOOD", f"{self.part_number}_{self.tp}", MB_position),), 
-            (os.path.join(base_roi_ng_folder, "NG", f"{self.part_number}_{self.tp}", MB_position),)
-        ]
-        json_folders = [
-            (os.path.join(base_json_folder, "GOOD", f"{self.part_number}_{self.tp}", MB_position),),
-            (os.path.join(base_json_ng_folder, "NG", f"{self.part_number}_{self.tp}", MB_position),)
-        ]
-        folder_types = ["GOOD", "NG"]  # Corresponding folder types
-
-        # Debug: Log folder lists and MB_position
+        # Load the recipe (GOOD and NG ROI templates, annotations and reference boards)
         logger.info(f"MB_position: {MB_position}")
-        logger.info(f"roi_folders: {roi_folders}")
-        logger.info(f"json_folders: {json_folders}")
-        for i, (roi_folder_tuple, json_folder_tuple) in enumerate(zip(roi_folders, json_folders)):
-            logger.info(f"roi_folders[{i}]: {roi_folder_tuple}, type: {type(roi_folder_tuple)}, len: {len(roi_folder_tuple)}")
-            logger.info(f"json_folders[{i}]: {json_folder_tuple}, type: {type(json_folder_tuple)}, len: {len(json_folder_tuple)}")
+        try:
+            self.inspection_engine.load_recipe(self.tp, self.part_number, MB_position)
+        except FileNotFoundError as e:
+            messagebox.showerror("Error", f"{e}")
+            raise
 
         # Load the captured image
         logger.info(f"Loading captured image: {captured_image_path}")
@@ -1132,251 +1121,35 @@ class MainApplication:
         img_height, img_width = captured_img.shape[:2]
         logger.info(f"Captured image dimensions: {img_width}x{img_height}")
 
-        # Get the GOOD ROI folder for reference images
-        good_roi_folder = f"/home/nvidia/SHARPEYE_DATA/Profiling_data/GOOD/{self.tp}_{self.part_number}/{MB_position}/Board_image"
-
-        # Convert captured image to grayscale for alignment matching
-        captured_gray = cv2.cvtColor(captured_img, cv2.COLOR_BGR2GRAY)
-
-        # Load all potential reference images (.png) from the GOOD folder and select the best one for alignment
-        if os.path.exists(good_roi_folder):
-            png_files = [f for f in os.listdir(good_roi_folder) if f.lower().endswith('.png')]
-            logger.info(f"Found {len(png_files)} potential reference images in {good_roi_folder}")
-
-            orb = cv2.ORB_create()
-            kp2, des2 = orb.detectAndCompute(captured_gray, None)
-
-            if des2 is None:
-                logger.warning("Failed to compute descriptors for captured image")
-            else:
-                best_reference_path = None
-                best_score = -1
-                for png_file in png_files:
-                    candidate_path = os.path.join(good_roi_folder, png_file)
-                    candidate_img = cv2.imread(candidate_path)
-                    if candidate_img is None:
-                        continue
-
-                    candidate_gray = cv2.cvtColor(candidate_img, cv2.COLOR_BGR2GRAY)
-
-                    # Skip if candidate is larger than captured (assuming reference should be comparable or smaller)
-                    cand_height, cand_width = candidate_gray.shape
-                    if cand_width > img_width or cand_height > img_height:
-                        logger.info(f"Skipping candidate {png_file} as it is larger than captured image")
-                        continue
-
-                    # Compute ORB features for candidate
-                    kp1, des1 = orb.detectAndCompute(candidate_gray, None)
-                    if des1 is None:
-                        continue
-
-                    # Match features
-                    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                    matches = bf.match(des1, des2)
-                    matches = sorted(matches, key=lambda x: x.distance)
-
-                    # Score based on number of good matches (top 50, threshold distance < 50)
-                    good_matches = [m for m in matches[:50] if m.distance < 50]
-                    score = len(good_matches)
-
-                    logger.info(f"Candidate {png_file}: {score} good matches")
-
-                    if score > best_score:
-                        best_score = score
-                        best_reference_path = candidate_path
-
-                if best_reference_path is not None:
-                    logger.info(f"Selected best reference image: {os.path.basename(best_reference_path)} with {best_score} good matches")
-                    reference_img = cv2.imread(best_reference_path)
-                else:
-                    logger.warning("No suitable reference image found, skipping auto-alignment")
-                    reference_img = None
-        else:
-            logger.warning(f"GOOD ROI folder not found: {good_roi_folder}, skipping auto-alignment")
-            reference_img = None
-
-        # Perform auto-alignment if a reference image was selected
-        if reference_img is not None:
-            try:
-                reference_gray = cv2.cvtColor(reference_img, cv2.COLOR_BGR2GRAY)
-
-                orb = cv2.ORB_create()
-                kp1, des1 = orb.detectAndCompute(reference_gray, None)
-                kp2, des2 = orb.detectAndCompute(captured_gray, None)
-
-                if des1 is None or des2 is None:
-                    raise ValueError("Failed to compute descriptors for alignment")
-
-                bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                matches = bf.match(des1, des2)
-                matches = sorted(matches, key=lambda x: x.distance)
-
-                good_matches = [m for m in matches[:50] if m.distance < 50]  # Use top 50 with distance threshold
-
-                if len(good_matches) > 10:
-                    src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                    dst_pts = np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-
-                    # Compute homography to warp captured to reference coordinates
-                    H, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
-
-                    if H is not None:
-                        # Warp the captured image and grayscale
-                        aligned_img = cv2.warpPerspective(captured_img, H, (img_width, img_height))
-                        captured_gray = cv2.cvtColor(aligned_img, cv2.COLOR_BGR2GRAY)
-                        captured_img = aligned_img  # Update for annotation
-                        logger.info("Auto-alignment successful using selected reference")
-                    else:
-                        logger.warning("Homography computation failed, using unaligned image")
-                else:
-                    logger.warning(f"Insufficient good matches for alignment ({len(good_matches)}), using unaligned image")
-            except Exception as e:
-                logger.warning(f"Auto-alignment failed: {e}, using unaligned image")
-        else:
-            logger.info("No reference image selected, proceeding without auto-alignment")
+        # Auto-align against the best reference board and match every ROI
+        inspection = self.inspection_engine.inspect(captured_img)
+        captured_img = inspection.aligned_frame.copy()
 
         # List to store successful detections
         detection_results = []
 
-        # Process both GOOD and NG folders
-        for i, ((roi_folder,), (json_folder,)) in enumerate(zip(roi_folders, json_folders)):
-            folder_type = folder_types[i]  # Get folder type from the list
+        for detection in inspection.detected:
+            roi_filename = detection["name"]
+            folder_type = detection["folder_type"]
+            detection_status = folder_type  # GOOD or NG based on folder
 
-            # Log the folders being accessed
-            logger.info(f"Accessing ROI folder ({folder_type}): {roi_folder}")
-            logger.info(f"Accessing JSON folder ({folder_type}): {json_folder}")
+            # Draw rectangle using template match location and JSON width/height
+            x, y = detection["x"], detection["y"]
+            top_left = (x, y)
+            bottom_right = (x + detection["width"], y + detection["height"])
 
-            # Check if folders exist
-            if not os.path.exists(roi_folder):
-                if folder_type == "NG":
-                    logger.warning(f"ROI folder (NG) not found at {roi_folder}, skipping NG processing")
-                    continue
-                else:
-                    logger.error(f"ROI folder ({folder_type}) not found at {roi_folder}")
-                    messagebox.showerror("Error", f"Profiling image folder ({folder_type}) not found {roi_folder}")
-                    raise FileNotFoundError(f"ROI folder ({folder_type}) not found at {roi_folder}")
-            if not os.path.exists(json_folder):
-                if folder_type == "NG":
-                    logger.warning(f"JSON folder (NG) not found at {json_folder}, skipping NG processing")
-                    continue
-                else:
-                    logger.error(f"JSON folder ({folder_type}) not found at {json_folder}")
-                    messagebox.showerror("Error", f"Profiling data folder ({folder_type}) not found {json_folder}")
-                    raise FileNotFoundError(f"JSON folder ({folder_type}) not found at {json_folder}")
-
-            # Find all JSON files in the json_folder
-            json_files = [f for f in os.listdir(json_folder) if f.lower().endswith('.json')]
-            if not json_files:
-                if folder_type == "NG":
-                    logger.warning(f"No JSON files found in {json_folder} (NG), skipping NG processing")
-                    continue
-                else:
-                    logger.error(f"No JSON files found in {json_folder} ({folder_type})")
-                    raise FileNotFoundError(f"No JSON files found in {json_folder} ({folder_type})")
-
-            # Load all JSON files
-            all_annotations = []
-            for json_file in json_files:
-                json_path = os.path.join(json_folder, json_file)
-                logger.info(f"Loading JSON file ({folder_type}): {json_path}")
-                try:
-                    with open(json_path, 'r') as f:
-                        annotations = json.load(f)
-                        all_annotations.extend(annotations)
-                    logger.info(f"Loaded {len(annotations)} annotations from {json_path} ({folder_type})")
-                except Exception as e:
-                    logger.error(f"Failed to load JSON file {json_path} ({folder_type}): {e}")
-                    continue
-
-            # Iterate over each ROI image in the specific TP/PN folder
-            for roi_filename in os.listdir(roi_folder):
-                if roi_filename.lower().endswith('.png'):
-                    roi_path = os.path.join(roi_folder, roi_filename)
-                    logger.info(f"Loading ROI image ({folder_type}): {roi_path}")
-                    roi_img = cv2.imread(roi_path, cv2.IMREAD_UNCHANGED)
-                    if roi_img is None:
-                        logger.warning(f"Could not load ROI image ({folder_type}): {roi_path}")
-                        continue
-
-                    # Convert ROI image to grayscale
-                    try:
-                        roi_gray = cv2.cvtColor(roi_img, cv2.COLOR_BGR2GRAY)
-                    except Exception as e:
-                        logger.warning(f"Failed to convert ROI image {roi_filename} ({folder_type}) to grayscale: {e}")
-                        continue
-
-                    # Log ROI image dimensions
-                    roi_height, roi_width = roi_gray.shape
-                    logger.info(f"ROI image {roi_filename} ({folder_type}) dimensions: {roi_width}x{roi_height}")
+            # Use different colors for GOOD and NG
+            color = (0, 255, 0) if folder_type == "GOOD" else (0, 0, 255)  # Green for GOOD, Red for NG
+            cv2.rectangle(captured_img, top_left, bottom_right, color, 2)
+            logger.info(f"Drew rectangle for ROI {roi_filename} ({folder_type}) at {top_left} to {bottom_right} (confidence={detection['score']:.2f})")
 
-                    # Check if ROI is smaller than captured image
-                    if roi_width > img_width or roi_height > img_height:
-                        logger.warning(f"ROI {roi_filename} ({folder_type}) is larger than captured image, skipping template matching")
-                        continue
+            # Add serial_number as label
+            label = detection["label"]
+            cv2.putText(captured_img, f"({folder_type})", (x, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
-                    # Perform template matching
-                    try:
-                        result = cv2.matchTemplate(captured_gray, roi_gray, cv2.TM_CCOEFF_NORMED)
-                    except Exception as e:
-                        messagebox.showwarning("Warning", f"Template matching failed for ROI {roi_filename} ({folder_type}): {e}")
-                        logger.warning(f"Template matching failed for ROI {roi_filename} ({folder_type}): {e}")
-                        continue
-
-                    # Find best match
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-                    logger.info(f"Best match for ROI {roi_filename} ({folder_type}): confidence={max_val:.2f} at location={max_loc}")
-
-                    # Skip if below threshold
-                    if max_val < confidence_threshold:
-                        # messagebox.showwarning("Warning", f"Detection confidence is {max_val} below {confidence_threshold} ({folder_type})")
-                        logger.info(f"Best match for ROI {roi_filename} ({folder_type}) below threshold {confidence_threshold}")
-                        continue
-
-                    # Determine the status of the result image
-                    detection_status = folder_type  # GOOD or NG based on folder
-
-                    # Find matching annotation
-                    matched_annotation = None
-                    for anno in all_annotations:
-                        if anno.get('ROI_image_index') == roi_filename:
-                            matched_annotation = anno
-                            break
-
-                    if not matched_annotation:
-                        logger.warning(f"No annotation found for ROI: {roi_filename} ({folder_type})")
-                        continue
-
-                    logger.info(f"Processing annotation for ROI: {roi_filename} ({folder_type})")
-                    logger.debug(f"Annotation coords ({folder_type}): x={matched_annotation['x']}, y={matched_annotation['y']}, "
-                                f"image_x={matched_annotation['image_x']}, image_y={matched_annotation['image_y']}, "
-                                f"width={matched_annotation['width']}, height={matched_annotation['height']}")
-
-                    # Draw rectangle using template match location and JSON width/height
-                    x, y = max_loc  # Use template match location
-                    width = int(matched_annotation['width'])
-                    height = int(matched_annotation['height'])
-                    top_left = (x, y)
-                    bottom_right = (x + width, y + height)
-
-                    # Verify rectangle coordinates are within image bounds
-                    if x < 0 or y < 0 or x + width > img_width or y + height > img_height:
-                        logger.warning(f"Rectangle for ROI {roi_filename} ({folder_type}) out of bounds: {top_left} to {bottom_right}")
-                        continue
-
-                    # Use different colors for GOOD and NG
-                    color = (0, 255, 0) if folder_type == "GOOD" else (0, 0, 255)  # Green for GOOD, Red for NG
-                    cv2.rectangle(captured_img, top_left, bottom_right, color, 2)
-                    logger.info(f"Drew rectangle for ROI {roi_filename} ({folder_type}) at {top_left} to {bottom_right}")
-
-                    # Add serial_number as label if present
-                    if 'serial_number' in matched_annotation:
-                        label = matched_annotation['serial_number']
-                        cv2.putText(captured_img, f"({folder_type})", (x, y - 10),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                        logger.info(f"Added label '{label}' for ROI {roi_filename} ({folder_type})")
-
-                    # Store detection results data
-                    detection_results.append((label, self.tp, self.part_number, roi_filename, detection_status, MB_position))
+            # Store detection results data
+            detection_results.append((label, self.tp, self.part_number, roi_filename, detection_status, MB_position))
 
 
         # connect to SQL server and save all data
@@ -1691,6 +1464,7 @@ class MainApplication:
         if messagebox.askyesno("Exit", "Are you sure you want to exit the application?"):
             print("Performing clean up before closing the application.")
             self.watcher.stop()
+            self.inspection_engine.close()
             self.root.destroy()
         else:
             print("Exit aborted.")
@@ -0,0 +1,79 @@
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""Fewest cross-checked ORB matches accepted for a homography fit"""
+MIN_ALIGNMENT_MATCHES = 10
+
+
+def scale_homography(homography, scale):
+    """Express a homography between full-resolution images in the coordinates of images resized by `scale`"""
+    scaling = np.diag([scale, scale, 1.0])
+    return scaling @ homography @ np.linalg.inv(scaling)
+
+
+def resize_for_alignment(gray, scale):
+    if scale == 1.0:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def homography_from_matches(reference_points, frame_points, matches):
+    """RANSAC homography mapping frame coordinates onto reference coordinates, or None"""
+    if len(matches) <= MIN_ALIGNMENT_MATCHES:
+        logger.warning(f"Insufficient good matches for alignment ({len(matches)})")
+        return None
+    src_pts = np.float32([reference_points[m.queryIdx] for m in matches]).reshape(-1, 1, 2)
+    dst_pts = np.float32([frame_points[m.trainIdx] for m in matches]).reshape(-1, 1, 2)
+    homography, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
+    return homography
+
+
+def refine_homography(frame_gray, reference_gray, homography, iterations=30, epsilon=1e-4):
+    """Full-resolution ECC refinement of a frame-to-reference homography, returns the input on failure
+
+    ECC estimates the warp taking reference coordinates into the frame, the inverse of ours.
+    """
+    warp = np.linalg.inv(homography).astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, epsilon)
+    try:
+        score, warp = cv2.findTransformECC(reference_gray, frame_gray, warp, cv2.MOTION_HOMOGRAPHY, criteria, None, 5)
+    except cv2.error as e:
+        logger.warning(f"ECC refinement did not converge: {e}")
+        return homography
+    logger.debug(f"ECC refinement score {score:.3f}")
+    return np.linalg.inv(warp.astype(np.float64))
+
+
+def corner_error(homography, reference_homography, shape):
+    """Mean distance (pixels) between the frame corners mapped by two homographies"""
+    height, width = shape[:2]
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+    mapped = cv2.perspectiveTransform(corners, homography)
+    expected = cv2.perspectiveTransform(corners, reference_homography)
+    return float(np.linalg.norm(mapped - expected, axis=2).mean())
+
+
+def rectangle_corners(x0, y0, x1, y1):
+    return np.float32([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+
+
+def warp_window(frame, frame_corners, window_size):
+    """Warp only the frame region under a quadrilateral into an upright window of window_size (width, height)
+
+    frame_corners are the window corners mapped into the frame (clockwise from top-left). Four corners
+    define the homography exactly, so the result equals the same window cut from a fully warped frame.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    x0 = max(0, int(np.floor(frame_corners[:, 0].min())) - 1)
+    y0 = max(0, int(np.floor(frame_corners[:, 1].min())) - 1)
+    x1 = min(frame_w, int(np.ceil(frame_corners[:, 0].max())) + 2)
+    y1 = min(frame_h, int(np.ceil(frame_corners[:, 1].max())) + 2)
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    width, height = window_size
+    transform = cv2.getPerspectiveTransform(np.float32(frame_corners - (x0, y0)), rectangle_corners(0, 0, width, height))
+    return cv2.warpPerspective(frame[y0:y1, x0:x1], transform, (width, height))
@@ -67,10 +67,19 @@ class CameraApp:
         Thread(target=self._capture_photo_thread).start()
 
     def _capture_photo_thread(self):
+        # Directory where image will be saved
+        output_dir = "/home/nvidia/SHARPEYE_DATA/Captured_images"
+
+        # Generate output filename with timestamp
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.capture_to(os.path.join(output_dir, f"photo_{timestamp}.jpg"))
+
+    def capture_to(self, output_file):
+        """Capture a photo into output_file on the calling thread, returns the file path or None on failure"""
         usb_device = self.get_camera_usb_device()
         if not usb_device:
             logger.error("No Canon camera USB device found")
-            return
+            return None
 
         try:
             # Attempt to unmount the USB device
@@ -84,18 +93,13 @@ class CameraApp:
             else:
                 logger.info(f"Successfully unmounted {usb_device}")
 
-            # Directory where image will be saved
-            output_dir = "/home/nvidia/SHARPEYE_DATA/Captured_images"
+            output_dir = os.path.dirname(output_file)
             os.makedirs(output_dir, exist_ok=True)
 
             # Check if the directory is writable
             if not os.access(output_dir, os.W_OK):
                 logger.error(f"No write permission for directory: {output_dir}")
-                return
-
-            # Generate output filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = os.path.join(output_dir, f"photo_{timestamp}.jpg")
+                return None
 
             # Prepare gphoto2 command
             cmd = ["gphoto2", "--capture-image-and-download", f"--filename={output_file}"]
@@ -119,7 +123,7 @@ class CameraApp:
                 logger.info(f"Photo captured and saved to {output_file}")
             else:
                 logger.error(f"Capture failed: {capture_result.stderr}")
-                return
+                return None
 
             # Attempt to remount the USB device
             mount_result = subprocess.run(
@@ -131,6 +135,8 @@ class CameraApp:
                 logger.warning(f"Failed to remount {usb_device}: {mount_result.stderr}")
             else:
                 logger.info(f"Successfully remounted {usb_device}")
+            return output_file
 
         except Exception as e:
-            logger.error(f"Capture error: {str(e)}")
\ No newline at end of file
+            logger.error(f"Capture error: {str(e)}")
+            return None
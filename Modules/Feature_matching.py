@@ -0,0 +1,82 @@
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""Descriptor matchers selectable with the "feature_matcher" recipe setting"""
+FEATURE_MATCHERS = ["bf_crosscheck", "knn_bf", "lsh"]
+
+FLANN_INDEX_LSH = 6
+LSH_INDEX_PARAMS = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+LSH_SEARCH_PARAMS = dict(checks=50)
+
+
+def match_descriptors(query_descriptors, train_descriptors, max_matches=50, max_distance=50):
+    """Cross-checked brute-force Hamming matching, keeping the best matches under a distance threshold"""
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = sorted(bf.match(query_descriptors, train_descriptors), key=lambda x: x.distance)
+    return [m for m in matches[:max_matches] if m.distance < max_distance]
+
+
+def best_matches(matches, max_matches):
+    """The max_matches shortest matches, best first, with a partial selection instead of a full sort"""
+    if len(matches) > max_matches:
+        distances = np.fromiter((m.distance for m in matches), dtype=np.float32, count=len(matches))
+        keep = np.argpartition(distances, max_matches - 1)[:max_matches]
+        matches = [matches[i] for i in keep]
+    return sorted(matches, key=lambda m: m.distance)
+
+
+def ratio_test(knn_matches, ratio, max_distance):
+    """Lowe's ratio test: keep a match only if it is clearly better than the second nearest neighbour"""
+    good = []
+    for pair in knn_matches:
+        if not pair:
+            continue
+        best = pair[0]
+        if best.distance >= max_distance:
+            continue
+        if len(pair) < 2 or best.distance < ratio * pair[1].distance:
+            good.append(best)
+    return good
+
+
+class FeatureMatcher:
+    """Matches reference descriptors against one frame's descriptors
+
+    set_frame() is called once per frame so an index over the frame descriptors (LSH) is built once
+    and queried with every candidate reference board.
+
+    - bf_crosscheck: BFMatcher with cross check, the original behaviour
+    - knn_bf: brute-force 2-NN + ratio test
+    - lsh: FLANN LSH index on the frame descriptors, 2-NN + ratio test
+    """
+    def __init__(self, method="bf_crosscheck", ratio=0.8, max_matches=50, max_distance=50):
+        if method not in FEATURE_MATCHERS:
+            raise ValueError(f"Unknown feature matcher {method!r}, expected one of {FEATURE_MATCHERS}")
+        self.method = method
+        self.ratio = ratio
+        self.max_matches = max_matches
+        self.max_distance = max_distance
+        self._frame_descriptors = None
+        self._matcher = None
+
+    def set_frame(self, frame_descriptors):
+        self._frame_descriptors = frame_descriptors
+        if self.method == "lsh":
+            self._matcher = cv2.FlannBasedMatcher(LSH_INDEX_PARAMS, LSH_SEARCH_PARAMS)
+            self._matcher.add([frame_descriptors])
+            self._matcher.train()
+        elif self.method == "knn_bf":
+            self._matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def match(self, reference_descriptors):
+        """Good matches with queryIdx into the reference and trainIdx into the frame, best first"""
+        if self.method == "bf_crosscheck":
+            return match_descriptors(reference_descriptors, self._frame_descriptors, self.max_matches, self.max_distance)
+        if self.method == "lsh":
+            knn_matches = self._matcher.knnMatch(reference_descriptors, k=2)
+        else:
+            knn_matches = self._matcher.knnMatch(reference_descriptors, self._frame_descriptors, k=2)
+        return best_matches(ratio_test(knn_matches, self.ratio, self.max_distance), self.max_matches)
@@ -0,0 +1,115 @@
+import logging
+from collections import OrderedDict
+import cv2
+import numpy as np
+from Modules.Template_matching import FrameStatistics, normalize_ccoeff, zero_mean_template
+
+logger = logging.getLogger(__name__)
+
+
+def fft_shape_for(frame_shape):
+    """Smallest fast DFT size that holds the frame (valid correlation never wraps around)"""
+    height, width = frame_shape[:2]
+    return cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width)
+
+
+class FftBatchMatcher:
+    """TM_CCOEFF_NORMED for a whole batch of templates sharing one frame FFT
+
+    Every template is made zero-mean and zero-padded to the frame's FFT size, so the numerator of
+    TM_CCOEFF_NORMED is a plain cross-correlation: one complex multiply and one inverse FFT per
+    template against the frame spectrum computed once. The window statistics of the denominator
+    only depend on the template size, so templates are grouped into size buckets and each bucket
+    reuses the same window statistics from the frame's integral images.
+    """
+    def __init__(self, templates, batch_size=8, spectrum_cache_bytes=256 * 1024 * 1024):
+        self.batch_size = batch_size
+        self.spectrum_cache_bytes = spectrum_cache_bytes
+        self.templates = []
+        self.norms = []
+        for template in templates:
+            zero_mean, norm = zero_mean_template(template)
+            self.templates.append(zero_mean)
+            self.norms.append(norm)
+
+        # Size buckets: template size -> indices of the templates of that size
+        self.buckets = OrderedDict()
+        for index, template in enumerate(self.templates):
+            self.buckets.setdefault(template.shape, []).append(index)
+
+        self._spectra = OrderedDict()  # (index, fft_shape) -> conjugated template spectrum
+        self._spectra_bytes = 0
+        self._frame = None
+        self._frame_spectrum = None
+        self._fft_shape = None
+        self._statistics = None
+
+    def __len__(self):
+        return len(self.templates)
+
+    # ******************* Per-frame data ************************ #
+
+    def set_frame(self, frame_gray, statistics=None):
+        """Compute the frame spectrum once for every template matched against this frame"""
+        self._frame = frame_gray.astype(np.float32)
+        self._fft_shape = fft_shape_for(frame_gray.shape)
+        # The templates are zero-mean, so removing the frame mean leaves the numerator unchanged
+        # while keeping the float32 spectrum accurate on low-contrast windows
+        self._frame_spectrum = np.fft.rfft2(self._frame - np.float32(self._frame.mean()), s=self._fft_shape)
+        self._statistics = statistics if statistics is not None else FrameStatistics(frame_gray)
+
+    def window_denominator(self, template_shape):
+        """sqrt(sum(I^2) - sum(I)^2 / N) over every valid window of the given template size"""
+        return self._statistics.denominator(template_shape)
+
+    # ******************* Template spectra ************************ #
+
+    def _template_spectrum(self, index):
+        key = (index, self._fft_shape)
+        spectrum = self._spectra.get(key)
+        if spectrum is not None:
+            self._spectra.move_to_end(key)
+            return spectrum
+
+        spectrum = np.conj(np.fft.rfft2(self.templates[index], s=self._fft_shape))
+        if spectrum.nbytes <= self.spectrum_cache_bytes:
+            self._spectra[key] = spectrum
+            self._spectra_bytes += spectrum.nbytes
+            while self._spectra_bytes > self.spectrum_cache_bytes:
+                _, evicted = self._spectra.popitem(last=False)
+                self._spectra_bytes -= evicted.nbytes
+        return spectrum
+
+    # ******************* Matching ************************ #
+
+    def correlation_maps(self, indices):
+        """Yield (index, TM_CCOEFF_NORMED map) for the given templates, batched per size bucket"""
+        if self._frame_spectrum is None:
+            raise ValueError("set_frame must be called before matching")
+
+        wanted = set(indices)
+        frame_h, frame_w = self._frame.shape
+        for template_shape, bucket in self.buckets.items():
+            bucket = [index for index in bucket if index in wanted]
+            template_h, template_w = template_shape
+            if not bucket or template_h > frame_h or template_w > frame_w:
+                continue
+
+            denominator = self.window_denominator(template_shape)
+            valid_h, valid_w = denominator.shape
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size]
+                spectra = np.stack([self._template_spectrum(index) for index in batch])
+                numerators = np.fft.irfft2(spectra * self._frame_spectrum, s=self._fft_shape)[:, :valid_h, :valid_w]
+                for index, numerator in zip(batch, numerators):
+                    yield index, normalize_ccoeff(numerator.astype(np.float32), denominator, self.norms[index])
+
+    def match(self, indices=None):
+        """Return {index: (score, (x, y))} of the best match of each template"""
+        if indices is None:
+            indices = range(len(self.templates))
+        results = {}
+        for index, scores in self.correlation_maps(indices):
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(scores)
+            results[index] = (max_val, max_loc)
+        return results
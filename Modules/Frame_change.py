@@ -0,0 +1,62 @@
+import time
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""Size (width, height) of the thumbnail frames are compared on; one cell covers ~24x24 pixels of a 1920x1440 frame"""
+CHANGE_THUMBNAIL_SIZE = (80, 60)
+
+
+class FrameChangeDetector:
+    """Tells whether a live frame differs from the last frame the scene changed on
+
+    Frames are area-downsampled to a small grayscale thumbnail (a block mean per cell, which also
+    averages out sensor noise) and compared with the thumbnail of the reference frame. The largest
+    cell difference is used rather than the mean, so a hand covering a single label counts as a
+    change. The reference is only replaced when a change is detected, so slow drift accumulates
+    against it instead of slipping under the threshold frame by frame.
+    """
+    def __init__(self, threshold=12.0, size=CHANGE_THUMBNAIL_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self._reference = None
+        self.checks = 0
+        self.changes = 0
+        self.seconds = 0.0
+        self.last_difference = None
+
+    def thumbnail(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    def changed(self, frame):
+        """True when the frame differs from the reference by more than the threshold in any cell"""
+        start = time.perf_counter()
+        thumbnail = self.thumbnail(frame)
+        if self._reference is None or self._reference.shape != thumbnail.shape:
+            changed = True
+            self.last_difference = None
+        else:
+            self.last_difference = float(np.abs(thumbnail - self._reference).max())
+            changed = self.last_difference > self.threshold
+        if changed:
+            self._reference = thumbnail
+            self.changes += 1
+        self.checks += 1
+        self.seconds += time.perf_counter() - start
+        return changed
+
+    def reset(self):
+        self._reference = None
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "changes": self.changes,
+            "unchanged_ratio": 1.0 - self.changes / self.checks if self.checks else 0.0,
+            "ms_per_check": self.seconds * 1000 / self.checks if self.checks else 0.0,
+        }
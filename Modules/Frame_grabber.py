@@ -0,0 +1,140 @@
+import time
+import logging
+import threading
+import cv2
+
+logger = logging.getLogger(__name__)
+
+"""Consecutive failed reads after which the capture is considered lost"""
+MAX_CONSECUTIVE_FAILURES = 30
+
+
+class FrameGrabber:
+    """Capture thread that owns a VideoCapture and keeps only the newest frame
+
+    Reading on the consumer's thread lets GStreamer queue frames while matching or drawing runs, so
+    the live view falls further behind the camera. Here a daemon thread reads continuously and
+    publishes each frame into a single slot by swapping a reference: cap.read() returns a new array
+    every time, so nothing is copied and a published frame is never written again. Consumers
+    (display, matching, recording) treat frames as read-only and copy before drawing on them.
+
+    A frame replaced before any consumer took it counts as dropped; the age of a frame is the time
+    between its capture and its delivery to a consumer.
+    """
+    def __init__(self, source, api_preference=cv2.CAP_GSTREAMER, name="frame-grabber"):
+        self.source = source
+        self.api_preference = api_preference
+        self.name = name
+        self._cap = None
+        self._thread = None
+        self._running = False
+        self._condition = threading.Condition()
+        self._frame = None
+        self._sequence = 0  # number of the frame in the slot, 0 = none yet
+        self._timestamp = 0.0
+        self._delivered_sequence = 0  # newest frame handed to any consumer
+        self.grabbed = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_age = 0.0
+        self._age_total = 0.0
+        self._started = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """Open the capture and start the grabbing thread, returns False when the device cannot be opened"""
+        if self._running:
+            return True
+        self._cap = cv2.VideoCapture(self.source, self.api_preference)
+        if not self._cap.isOpened():
+            self._cap.release()
+            self._cap = None
+            return False
+        self._running = True
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info("Frame grabber started")
+        return True
+
+    def stop(self):
+        """Stop the grabbing thread and release the capture"""
+        if not self._running:
+            return
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+        self._thread = None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+        logger.info(f"Frame grabber stopped: {self.stats()}")
+
+    def _run(self):
+        while self._running:
+            ret, frame = self._cap.read()
+            if not ret:
+                self.failures += 1
+                if self.failures == 1:
+                    logger.warning("Frame grabber: failed to grab frame")
+                if self.failures >= MAX_CONSECUTIVE_FAILURES:
+                    logger.error("Frame grabber: capture lost")
+                    self._running = False
+                    with self._condition:
+                        self._condition.notify_all()
+                    break
+                time.sleep(0.01)
+                continue
+            self.failures = 0
+            timestamp = time.perf_counter()
+            with self._condition:
+                if self._sequence > self._delivered_sequence:
+                    self.dropped += 1  # the previous frame was never taken
+                self._frame = frame
+                self._sequence += 1
+                self._timestamp = timestamp
+                self.grabbed += 1
+                self._condition.notify_all()
+
+    def read(self, after=0, timeout=1.0):
+        """Newest frame newer than sequence number `after`, waiting up to timeout seconds for it
+
+        Returns (frame, sequence); frame is None when no such frame arrived in time or the grabber
+        stopped. Pass the previous sequence to never get the same frame twice.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._condition:
+            while self._sequence <= after:
+                remaining = deadline - time.perf_counter()
+                if not self._running or remaining <= 0:
+                    return None, after
+                self._condition.wait(remaining)
+            frame, sequence = self._frame, self._sequence
+            self.last_age = time.perf_counter() - self._timestamp
+            if sequence > self._delivered_sequence:
+                self._delivered_sequence = sequence
+                self.delivered += 1
+                self._age_total += self.last_age
+        return frame, sequence
+
+    def latest(self):
+        """Newest frame and its sequence number without waiting, (None, 0) before the first frame"""
+        return self.read(after=-1, timeout=0.0) if self._sequence else (None, 0)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "grabbed": self.grabbed,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "drop_ratio": self.dropped / self.grabbed if self.grabbed else 0.0,
+            "capture_fps": self.grabbed / elapsed if elapsed else 0.0,
+            "last_age_ms": self.last_age * 1000,
+            "mean_age_ms": self._age_total * 1000 / self.delivered if self.delivered else 0.0,
+        }
@@ -0,0 +1,159 @@
+import os
+import json
+import socket
+import logging
+import time
+import threading
+import cv2
+import numpy as np
+from Modules.Alignment import scale_homography
+
+logger = logging.getLogger(__name__)
+
+"""Homographies of each station are kept in <data_root>/Homography_cache/<station>.json"""
+HOMOGRAPHY_CACHE_FOLDER = "Homography_cache"
+
+"""Minimum seconds between two writes of the cache file while homographies keep changing"""
+HOMOGRAPHY_SAVE_INTERVAL = 30.0
+
+
+def alignment_score(frame_gray, homography, reference_small, scale):
+    """ECC correlation between the reference board and the frame warped by the homography, at low resolution"""
+    frame_small = cv2.resize(frame_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    reference_h, reference_w = reference_small.shape
+    warped = cv2.warpPerspective(frame_small, scale_homography(homography, scale), (reference_w, reference_h))
+    return cv2.computeECC(reference_small, warped)
+
+
+class HomographyCache:
+    """Last good frame-to-reference homography of each recipe on one station
+
+    Boards sit in a fixed jig, so the transform barely changes between inspections. A cached
+    homography is accepted when the frame warped with it still correlates with its reference board
+    (alignment_score at low resolution); only then is the feature alignment skipped.
+
+    New homographies only mark the cache dirty; the file is written at most every save_interval
+    seconds, and by flush() on a recipe change or when the engine closes.
+    """
+    def __init__(self, data_root, station=None, scale=0.25, save_interval=HOMOGRAPHY_SAVE_INTERVAL):
+        self.station = station or socket.gethostname()
+        self.scale = scale
+        self.save_interval = save_interval
+        self.path = os.path.join(data_root, HOMOGRAPHY_CACHE_FOLDER, f"{self.station}.json")
+        self._entries = {}  # (tp, part_number, position) -> {"homography", "reference", "reference_small"}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._full_alignment_seconds = None  # running mean of the full alignment time
+        self._load()
+
+    # ******************* Persistence ************************ #
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            for key, entry in stored.items():
+                tp, part_number, position = key.split("|")
+                self._entries[(tp, part_number, position)] = {
+                    "homography": np.array(entry["homography"], dtype=np.float64),
+                    "reference": entry["reference"],
+                    "reference_small": None,
+                }
+            logger.info(f"Loaded {len(self._entries)} cached homographies from {self.path}")
+        except Exception as e:
+            logger.error(f"Failed to load homography cache {self.path}: {e}")
+
+    def flush(self):
+        """Write the cache file if homographies changed since the last write"""
+        with self._lock:
+            if not self._dirty:
+                return
+            stored = {"|".join(key): {"homography": entry["homography"].tolist(), "reference": entry["reference"]}
+                      for key, entry in self._entries.items()}
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(stored, f, indent=4)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save homography cache {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _changed(self):
+        """Mark the cache dirty (lock held), returns True when the throttled write is due"""
+        self._dirty = True
+        return time.monotonic() - self._last_save >= self.save_interval
+
+    # ******************* Lookup ************************ #
+
+    def lookup(self, key, frame_gray, board_images, threshold):
+        """Return the cached homography if it still aligns this frame with its reference board, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry["reference"] not in board_images:
+            return None
+
+        if entry["reference_small"] is None:
+            reference = cv2.imread(entry["reference"], cv2.IMREAD_GRAYSCALE)
+            if reference is None:
+                return None
+            entry["reference_small"] = cv2.resize(reference, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+        try:
+            score = alignment_score(frame_gray, entry["homography"], entry["reference_small"], self.scale)
+        except cv2.error as e:
+            logger.warning(f"Cached homography check failed: {e}")
+            return None
+        if score < threshold:
+            logger.info(f"Cached homography rejected (ECC {score:.3f} < {threshold})")
+            return None
+        logger.info(f"Cached homography accepted (ECC {score:.3f})")
+        return entry["homography"]
+
+    def store(self, key, homography, reference_path):
+        with self._lock:
+            self._entries[key] = {"homography": homography, "reference": reference_path, "reference_small": None}
+            due = self._changed()
+        if due:
+            self.flush()
+
+    def invalidate(self, key):
+        with self._lock:
+            due = self._entries.pop(key, None) is not None and self._changed()
+        if due:
+            self.flush()
+
+    # ******************* Statistics ************************ #
+
+    def record_hit(self, seconds):
+        self.hits += 1
+        if self._full_alignment_seconds is not None:
+            self.saved_seconds += max(0.0, self._full_alignment_seconds - seconds)
+
+    def record_miss(self, seconds):
+        """Count a full alignment; `seconds` includes the failed check, if any"""
+        self.misses += 1
+        if self._full_alignment_seconds is None:
+            self._full_alignment_seconds = seconds
+        else:
+            self._full_alignment_seconds += (seconds - self._full_alignment_seconds) / self.misses
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "station": self.station,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,88 @@
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class HomographyTracker:
+    """Keeps a live frame-to-reference homography up to date with sparse optical flow
+
+    Corners picked in the raw camera frame are mapped through its known homography and pinned to
+    those reference coordinates once; each new raw frame they are tracked with pyramidal Lucas-Kanade
+    and the homography is refitted from the tracked frame positions to the fixed reference positions,
+    so errors do not accumulate frame to frame.
+    update() returns None when too few points survive or the fit has too few inliers, which is the
+    caller's cue to run full feature alignment and start() again.
+    """
+    def __init__(self, max_points=300, min_points=40, min_inlier_ratio=0.6, reseed_ratio=0.5,
+                 ransac_threshold=3.0, window_size=21, pyramid_levels=3):
+        self.max_points = max_points
+        self.min_points = min_points
+        self.min_inlier_ratio = min_inlier_ratio
+        self.reseed_ratio = reseed_ratio
+        self.ransac_threshold = ransac_threshold
+        self.lk_params = dict(winSize=(window_size, window_size), maxLevel=pyramid_levels,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        self.homography = None
+        self.quality = 0.0  # inlier ratio of the last update
+        self._previous_gray = None
+        self._frame_points = None
+        self._reference_points = None
+
+    @property
+    def active(self):
+        return self.homography is not None
+
+    def start(self, frame_gray, homography):
+        """Seed the tracker from a frame whose homography is known"""
+        self.homography = homography
+        self._previous_gray = frame_gray
+        points = cv2.goodFeaturesToTrack(frame_gray, self.max_points, 0.01, 10)
+        if points is None or len(points) < self.min_points:
+            logger.info("Not enough corners to track the homography")
+            self.reset()
+            return False
+        self._frame_points = points.astype(np.float32)
+        self._reference_points = cv2.perspectiveTransform(self._frame_points, homography)
+        self.quality = 1.0
+        return True
+
+    def reset(self):
+        self.homography = None
+        self.quality = 0.0
+        self._previous_gray = None
+        self._frame_points = None
+        self._reference_points = None
+
+    def update(self, frame_gray):
+        """Return the homography of the new frame, or None when tracking is lost"""
+        if not self.active:
+            return None
+
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self._previous_gray, frame_gray, self._frame_points, None, **self.lk_params)
+        tracked = status.ravel() == 1
+        if tracked.sum() < self.min_points:
+            logger.info(f"Homography tracking lost: {tracked.sum()} points tracked")
+            self.reset()
+            return None
+
+        frame_points = points[tracked]
+        reference_points = self._reference_points[tracked]
+        homography, mask = cv2.findHomography(frame_points, reference_points, cv2.RANSAC, self.ransac_threshold)
+        inliers = mask.ravel() == 1 if mask is not None else np.zeros(len(frame_points), bool)
+        self.quality = inliers.sum() / len(self._frame_points)
+        if homography is None or inliers.sum() < self.min_points or self.quality < self.min_inlier_ratio:
+            logger.info(f"Homography tracking lost: {inliers.sum()} inliers ({self.quality:.0%})")
+            self.reset()
+            return None
+
+        self.homography = homography
+        self._previous_gray = frame_gray
+        self._frame_points = frame_points[inliers]
+        self._reference_points = reference_points[inliers]
+
+        # Replenish the point set from the current estimate before it thins out
+        if len(self._frame_points) < self.reseed_ratio * self.max_points:
+            self.start(frame_gray, homography)
+        return homography
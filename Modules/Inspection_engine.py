@@ -0,0 +1,793 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from Modules.Template_matching import (build_pyramid, pyramid_levels_for, pyramid_match, local_match,
+                                       FrameStatistics, shared_statistics_match, zero_mean_template)
+from Modules.Fft_matching import FftBatchMatcher
+from Modules.Match_pool import MatchPool
+from Modules.Reference_features import ReferenceFeatures, load_reference_features, save_reference_features
+from Modules.Reference_index import ReferenceIndex, board_thumbnail
+from Modules.Homography_cache import HomographyCache
+from Modules.Homography_tracker import HomographyTracker
+from Modules.Feature_matching import FeatureMatcher
+from Modules.Alignment import (homography_from_matches, refine_homography, resize_for_alignment, scale_homography,
+                               rectangle_corners, warp_window)
+from Modules.Recipe_store import (SHARPEYE_DATA, MB_POSITIONS, RECIPE_CACHE_BYTES, RecipeCache, recipe_folder, to_gray,
+                                  link_ng_rois)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+"""Default settings shared with the UI"""
+CONFIDENCE_THRESHOLD = 0.75
+"""ORB features per image of each backend: the CPU keeps OpenCV's default, since brute-force matching cost grows with the square"""
+CPU_ORB_FEATURES = 500
+CUDA_ORB_FEATURES = 5000
+
+
+def cuda_available():
+    """Return True when OpenCV is built with CUDA and a CUDA device is present"""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+
+# ***************************************************** BACKENDS ************************************************************* #
+
+class CpuBackend:
+    """Template matching and feature extraction on the CPU"""
+    name = "cpu"
+
+    def __init__(self, orb_features=CPU_ORB_FEATURES, num_threads=None):
+        # Make sure the optimized (SIMD / IPP) code paths are used and let OpenCV spread work over the cores
+        cv2.setUseOptimized(True)
+        if num_threads is not None:
+            cv2.setNumThreads(num_threads)
+        self.orb_features = orb_features
+        self.orb = cv2.ORB_create(nfeatures=orb_features)
+
+    def upload(self, gray):
+        return gray
+
+    def release(self, prepared):
+        pass
+
+    def match_template(self, frame_prepared, template_prepared):
+        return cv2.matchTemplate(frame_prepared, template_prepared, cv2.TM_CCOEFF_NORMED)
+
+    def detect_and_compute(self, gray):
+        """Return keypoint coordinates as an (N, 2) float32 array and uint8 descriptors"""
+        keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+        points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+        return points, descriptors
+
+    def warp(self, image, homography, size):
+        return cv2.warpPerspective(image, homography, size)
+
+
+class CudaBackend:
+    """Template matching and feature extraction on the GPU (Jetson)"""
+    name = "cuda"
+
+    def __init__(self, orb_features=CUDA_ORB_FEATURES):
+        self.orb_features = orb_features
+        self.orb = cv2.cuda.ORB_create(nfeatures=orb_features)
+        self.template_matcher = cv2.cuda.createTemplateMatching(cv2.CV_8UC1, cv2.TM_CCOEFF_NORMED)
+
+    def upload(self, gray):
+        gpu_mat = cv2.cuda_GpuMat()
+        gpu_mat.upload(gray)
+        return gpu_mat
+
+    def release(self, prepared):
+        prepared.release()
+
+    def match_template(self, frame_prepared, template_prepared):
+        return self.template_matcher.match(frame_prepared, template_prepared).download()
+
+    def detect_and_compute(self, gray):
+        """Return keypoint coordinates as an (N, 2) float32 array and uint8 descriptors"""
+        gpu_gray = self.upload(gray)
+        try:
+            keypoints, descriptors_gpu = self.orb.detectAndCompute(gpu_gray, None)
+        finally:
+            gpu_gray.release()
+        points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+        descriptors = descriptors_gpu.download() if descriptors_gpu is not None and not descriptors_gpu.empty() else None
+        return points, descriptors
+
+    def warp(self, image, homography, size):
+        gpu_image = cv2.cuda_GpuMat()
+        gpu_image.upload(image)
+        try:
+            return cv2.cuda.warpPerspective(gpu_image, homography, size).download()
+        finally:
+            gpu_image.release()
+
+
+def create_backend(use_cuda=None, orb_features=None, num_threads=None):
+    """Pick the CUDA backend when available (or requested) and fall back to the CPU backend
+
+    orb_features=None uses the default of whichever backend is picked.
+    """
+    if use_cuda is None:
+        use_cuda = cuda_available()
+    if use_cuda:
+        try:
+            backend = CudaBackend(orb_features=orb_features or CUDA_ORB_FEATURES)
+            logger.info("Inspection engine using CUDA backend")
+            return backend
+        except (AttributeError, cv2.error) as e:
+            logger.warning(f"CUDA backend unavailable ({e}), falling back to CPU")
+    logger.info(f"Inspection engine using CPU backend (threads: {cv2.getNumThreads() if num_threads is None else num_threads})")
+    return CpuBackend(orb_features=orb_features or CPU_ORB_FEATURES, num_threads=num_threads)
+
+
+# ***************************************************** ENGINE ************************************************************* #
+
+class FrameContext:
+    """Per-frame data shared by every ROI of one match pass, built on first use"""
+    def __init__(self, gray, backend, settings):
+        self.gray = gray
+        self.backend = backend
+        self.settings = settings
+        self._prepared = None
+        self._pyramid = None
+        self._fft_matcher = None
+        self._fft_results = {}
+        self._statistics = None
+        self._frame_float = None
+
+    @property
+    def prepared(self):
+        if self._prepared is None:
+            self._prepared = self.backend.upload(self.gray)
+        return self._prepared
+
+    @property
+    def pyramid(self):
+        if self._pyramid is None:
+            self._pyramid = build_pyramid(self.gray, self.settings["pyramid_levels"])
+        return self._pyramid
+
+    @property
+    def statistics(self):
+        """Integral-image window statistics shared by every template size of this frame"""
+        if self._statistics is None:
+            self._statistics = FrameStatistics(self.gray)
+        return self._statistics
+
+    @property
+    def frame_float(self):
+        if self._frame_float is None:
+            self._frame_float = self.gray.astype(np.float32)
+        return self._frame_float
+
+    def fft_match(self, matcher, indices):
+        """Batched FFT matching of the given ROIs, sharing one frame spectrum for the whole frame"""
+        if self._fft_matcher is not matcher:
+            matcher.set_frame(self.gray, self.statistics)
+            self._fft_matcher = matcher
+        missing = [index for index in indices if index not in self._fft_results]
+        if missing:
+            self._fft_results.update(matcher.match(missing))
+        return {index: self._fft_results[index] for index in indices}
+
+    def release(self):
+        if self._prepared is not None:
+            self.backend.release(self._prepared)
+            self._prepared = None
+
+class InspectionResult:
+    """Outcome of one inspection: the aligned frame, the homography used and one detection per ROI"""
+    def __init__(self, aligned_frame, homography, detections, timings):
+        self.aligned_frame = aligned_frame
+        self.homography = homography
+        self.detections = detections
+        self.timings = timings
+
+    @property
+    def detected(self):
+        return [d for d in self.detections if d["detected"]]
+
+
+class InspectionEngine:
+    """Headless ROI inspection: recipe loading, board alignment and template matching"""
+    def __init__(self, data_root=SHARPEYE_DATA, confidence_threshold=CONFIDENCE_THRESHOLD,
+                 use_cuda=None, orb_features=None, num_threads=None,
+                 match_workers=0, cv_threads_per_worker=1, recipe_cache_bytes=RECIPE_CACHE_BYTES, station=None):
+        self.data_root = data_root
+        self.confidence_threshold = confidence_threshold
+        self.backend = create_backend(use_cuda=use_cuda, orb_features=orb_features, num_threads=num_threads)
+        self.orb_features = self.backend.orb_features  # the count .orb files are extracted and validated with
+
+        # Process pool for CPU full-frame matching (0 = match in this process)
+        self.match_pool = None
+        if match_workers and self.backend.name == "cpu":
+            self.match_pool = MatchPool(workers=match_workers, cv_threads_per_worker=cv_threads_per_worker)
+
+        self.recipe_cache = RecipeCache(max_bytes=recipe_cache_bytes, data_root=data_root)
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recipe-prefetch")
+        self._prefetches = {}  # (tp, part_number, position) -> Future of the prepared recipe
+        self._backend_lock = threading.Lock()  # feature detectors are not shared across threads safely
+        self.homography_cache = HomographyCache(data_root, station=station)
+        self.tracker = HomographyTracker()
+        self._live_homography = None  # latest live-view homography
+        self._realign_wait = 0  # live frames left before retrying realignment
+
+        self.recipe = None
+        self._prepared_templates = []
+        self._fft_matcher = None
+        self._shared_statistics_rois = set()
+
+    # ******************* Recipe ************************ #
+
+    def load_recipe(self, tp, part_number, position):
+        """Load a recipe (from the recipe cache or its compiled pack) and prepare its templates for the active backend"""
+        future = self._prefetches.pop((tp, part_number, position), None)
+        if future is not None:
+            # Usually already done; a failed prefetch is retried below so the error reaches the caller
+            start = time.perf_counter()
+            try:
+                future.result()
+                logger.info(f"Waited {(time.perf_counter() - start) * 1000:.1f} ms for the recipe prefetch")
+            except Exception as e:
+                logger.warning(f"Recipe prefetch failed, loading synchronously: {e}")
+        recipe = self.recipe_cache.get(tp, part_number, position)
+        self.set_recipe(recipe)
+        stats = self.recipe_cache.stats()
+        logger.info(f"Recipe cache: {stats['entries']} recipes, {stats['bytes'] / 2**20:.1f} MiB, "
+                    f"{stats['hits']} hits / {stats['misses']} misses")
+        return recipe
+
+    def set_recipe(self, recipe):
+        self.release()
+        self.homography_cache.flush()
+        self.tracker.reset()
+        self._live_homography = None
+        self._realign_wait = 0
+        self.prepare_recipe(recipe)
+        self.recipe = recipe
+        self._prepared_templates = [self.backend.upload(roi["template"]) for roi in recipe.rois]
+        if self.match_pool is not None:
+            self.match_pool.set_templates([roi["template"] for roi in recipe.rois])
+
+        if recipe.settings["match_mode"] == "full":
+            self._shared_statistics_rois = self._shared_statistics_indices(recipe)
+        elif recipe.settings["match_mode"] == "fft":
+            self._fft_matcher = FftBatchMatcher([roi["template"] for roi in recipe.rois],
+                                                batch_size=recipe.settings["fft_batch_size"])
+
+    def prepare_recipe(self, recipe):
+        """Attach the data derived from the templates to the recipe ROIs, once per recipe (cached with it)"""
+        if recipe.settings["cascade"] and recipe.cascade_links is None:
+            recipe.cascade_links = link_ng_rois(recipe)
+            logger.info(f"Cascade: {len(recipe.cascade_links)} NG templates linked to a GOOD location")
+
+        # Template pyramids only depend on the recipe, build them once
+        if recipe.settings["match_mode"] == "pyramid":
+            for roi in recipe.rois:
+                if "pyramid" not in roi:
+                    levels = pyramid_levels_for(roi["template"].shape, recipe.settings["pyramid_levels"])
+                    roi["pyramid"] = build_pyramid(roi["template"], levels)
+        elif recipe.settings["match_mode"] == "full":
+            for index in self._shared_statistics_indices(recipe):
+                roi = recipe.rois[index]
+                if "zero_mean" not in roi:
+                    roi["zero_mean"], roi["norm"] = zero_mean_template(roi["template"])
+
+    def _shared_statistics_indices(self, recipe):
+        """ROIs matched with the shared frame statistics: CPU only, and only in buckets of several same-sized templates"""
+        if not (recipe.settings["shared_statistics"] and self.backend.name == "cpu"):
+            return set()
+        bucket_sizes = {}
+        for roi in recipe.rois:
+            bucket_sizes[roi["template"].shape] = bucket_sizes.get(roi["template"].shape, 0) + 1
+        return {index for index, roi in enumerate(recipe.rois)
+                if bucket_sizes[roi["template"].shape] >= recipe.settings["shared_statistics_min_bucket"]}
+
+    # ******************* Prefetch ************************ #
+
+    def prefetch(self, tp, part_number, positions=MB_POSITIONS):
+        """Load and prepare the recipe of every MB position in the background, returns {position: Future}
+
+        Called as soon as a serial number resolves its TP / P/N; load_recipe then only waits on the future.
+        """
+        futures = {}
+        for position in positions:
+            key = (tp, part_number, position)
+            future = self._prefetches.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._prefetch_executor.submit(self._prefetch_recipe, tp, part_number, position)
+                self._prefetches[key] = future
+            futures[position] = future
+        return futures
+
+    def _prefetch_recipe(self, tp, part_number, position):
+        if not os.path.exists(recipe_folder(self.data_root, "GOOD", tp, part_number, position)):
+            logger.info(f"No profile for {tp}_{part_number}/{position}, nothing to prefetch")
+            return None
+        start = time.perf_counter()
+        recipe = self.recipe_cache.get(tp, part_number, position)
+        self.prepare_recipe(recipe)
+        self.reference_index(recipe)
+        self.recipe_cache.put(recipe)  # re-measure with the derived data
+        logger.info(f"Prefetched recipe {tp}_{part_number}/{position} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return recipe
+
+    def release(self):
+        """Free the backend copies of the current recipe templates"""
+        for prepared in self._prepared_templates:
+            self.backend.release(prepared)
+        self._prepared_templates = []
+        self._fft_matcher = None
+        self._shared_statistics_rois = set()
+
+    def close(self):
+        """Release the recipe, save the homography cache and stop the prefetch thread and the match pool"""
+        self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        self._prefetches = {}
+        self.release()
+        self.homography_cache.flush()
+        if self.match_pool is not None:
+            self.match_pool.close()
+            self.match_pool = None
+
+    # ******************* Alignment ************************ #
+
+    def detect_and_compute(self, gray):
+        with self._backend_lock:
+            return self.backend.detect_and_compute(gray)
+
+    def reference_features(self, recipe, scale=None):
+        """ORB features of every reference board of a recipe at an alignment scale, read from their .orb files
+        and kept on the recipe"""
+        scale = recipe.settings["alignment_scale"] if scale is None else scale
+        features = recipe.reference_features.setdefault(scale, {})
+        for candidate_path in recipe.board_images:
+            if candidate_path in features:
+                continue
+            stored = load_reference_features(candidate_path, self.orb_features, scale)
+            features[candidate_path] = stored if stored is not None else self.cache_reference_features(candidate_path, scale)
+        return features
+
+    def cache_reference_features(self, image_path, scale=1.0):
+        """Extract the ORB features and thumbnail of a saved board image and persist them next to it"""
+        candidate_img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if candidate_img is None:
+            logger.warning(f"Could not read reference board {image_path}")
+            return None
+        candidate_img = resize_for_alignment(candidate_img, scale)
+        points, descriptors = self.detect_and_compute(candidate_img)
+        features = ReferenceFeatures(candidate_img.shape, points, descriptors, board_thumbnail(candidate_img))
+        try:
+            save_reference_features(image_path, features, self.orb_features, scale)
+        except OSError as e:
+            logger.warning(f"Could not save reference features for {image_path}: {e}")
+        return features
+
+    def prefetch_reference_features(self, image_path, scale=1.0):
+        """cache_reference_features in the background prefetch thread, returns its Future"""
+        return self._prefetch_executor.submit(self.cache_reference_features, image_path, scale)
+
+    def reference_index(self, recipe):
+        """Thumbnail index of the recipe reference boards, built once and kept on the recipe"""
+        if recipe.reference_index is None:
+            start = time.perf_counter()
+            features = self.reference_features(recipe)
+            paths = [path for path in recipe.board_images if features.get(path) is not None]
+            recipe.reference_index = ReferenceIndex([features[path].thumbnail for path in paths], keys=paths)
+            logger.info(f"Built reference index of {len(paths)} boards in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return recipe.reference_index
+
+    def select_reference(self, frame_gray, frame_points=None, frame_descriptors=None, scale=1.0):
+        """Pick the reference board with the most good ORB matches against the frame (both resized by `scale`)"""
+        if frame_descriptors is None:
+            frame_points, frame_descriptors = self.detect_and_compute(frame_gray)
+        if frame_descriptors is None:
+            logger.warning("Failed to compute descriptors for frame")
+            return None
+
+        settings = self.recipe.settings
+        matcher = FeatureMatcher(settings["feature_matcher"], ratio=settings["feature_ratio"])
+        matcher.set_frame(frame_descriptors)
+
+        # Only the boards that look most like the frame go through ORB matching
+        features = self.reference_features(self.recipe, scale)
+        candidate_paths = self.reference_index(self.recipe).shortlist(frame_gray, self.recipe.settings["reference_shortlist"])
+
+        img_height, img_width = frame_gray.shape[:2]
+        best = None
+        best_score = -1
+        for candidate_path in candidate_paths:
+            candidate_shape, points, descriptors, _ = features[candidate_path]
+            if descriptors is None:
+                continue
+
+            cand_height, cand_width = candidate_shape
+            if cand_width > img_width or cand_height > img_height:
+                logger.info(f"Skipping candidate {os.path.basename(candidate_path)} as it is larger than frame")
+                continue
+
+            good_matches = matcher.match(descriptors)
+            score = len(good_matches)
+            logger.info(f"Candidate {os.path.basename(candidate_path)}: {score} good matches")
+
+            if score > best_score:
+                best_score = score
+                best = (candidate_path, points, descriptors, good_matches)
+
+        if best is not None:
+            logger.info(f"Selected best reference image: {os.path.basename(best[0])} with {best_score} good matches")
+        return best
+
+    def compute_homography(self, frame, use_cache=True):
+        """Return the homography that warps the frame onto the best reference board, or None
+
+        The last homography of this recipe on this station is tried first; feature alignment only runs
+        when it no longer lines the frame up with its reference board.
+        """
+        if self.recipe is None or not self.recipe.board_images:
+            logger.info("No reference image available, proceeding without auto-alignment")
+            return None
+
+        start = time.perf_counter()
+        frame_gray = to_gray(frame)
+        key = (self.recipe.tp, self.recipe.part_number, self.recipe.position)
+        if use_cache:
+            homography = self.homography_cache.lookup(key, frame_gray, self.recipe.board_images,
+                                                      self.recipe.settings["homography_check_threshold"])
+            if homography is not None:
+                self.homography_cache.record_hit(time.perf_counter() - start)
+                self._log_homography_cache()
+                return homography
+
+        homography, reference_path = self._feature_homography(frame_gray)
+        if homography is not None:
+            self.homography_cache.store(key, homography, reference_path)
+        if use_cache:
+            self.homography_cache.record_miss(time.perf_counter() - start)
+            self._log_homography_cache()
+        return homography
+
+    def _log_homography_cache(self):
+        stats = self.homography_cache.stats()
+        logger.info(f"Homography cache: {stats['hit_rate']:.0%} hit rate ({stats['hits']} hits / {stats['misses']} misses), "
+                    f"{stats['saved_seconds']:.2f} s saved")
+
+    def _feature_homography(self, frame_gray):
+        """ORB alignment against the best reference board, returns (homography or None, reference path)
+
+        With alignment_scale < 1 features are detected and matched on downscaled images and the
+        homography is rescaled to full resolution, optionally refined there with ECC.
+        """
+        settings = self.recipe.settings
+        scale = settings["alignment_scale"]
+        frame_small = resize_for_alignment(frame_gray, scale)
+        frame_points, frame_descriptors = self.detect_and_compute(frame_small)
+        best = self.select_reference(frame_small, frame_points, frame_descriptors, scale)
+        if best is None:
+            logger.warning("No suitable reference image found, skipping auto-alignment")
+            return None, None
+
+        # Reuse the reference features and matches computed during selection
+        reference_path, reference_points, _, good_matches = best
+        homography = homography_from_matches(reference_points, frame_points, good_matches)
+        if homography is None:
+            logger.warning("Homography computation failed")
+            return None, reference_path
+
+        if scale != 1.0:
+            homography = scale_homography(homography, 1.0 / scale)
+        if settings["alignment_refine"]:
+            reference_gray = cv2.imread(reference_path, cv2.IMREAD_GRAYSCALE)
+            if reference_gray is not None:
+                homography = refine_homography(frame_gray, reference_gray, homography,
+                                               settings["alignment_refine_iterations"])
+        logger.info(f"Auto-alignment homography computed successfully (scale {scale})")
+        return homography, reference_path
+
+    def track_homography(self, frame):
+        """Homography of a live frame: tracked from the previous frame, full realignment only when tracking is lost
+
+        With homography_tracking disabled the first homography is kept for the whole session.
+        """
+        settings = self.recipe.settings
+        if not settings["homography_tracking"] and self._live_homography is not None:
+            return self._live_homography
+
+        frame_gray = to_gray(frame)
+        if self.tracker.active:
+            homography = self.tracker.update(frame_gray)
+            if homography is not None:
+                self._live_homography = homography
+                return homography
+
+        # Lost (or first frame): realign, but do not run ORB on every frame while the board is out of view
+        if self._realign_wait > 0:
+            self._realign_wait -= 1
+            return self._live_homography
+        homography = self.compute_homography(frame)
+        if homography is None:
+            self._realign_wait = settings["realign_interval"]
+            return self._live_homography
+        self._live_homography = homography
+        if not self.tracker.start(frame_gray, homography):
+            self._realign_wait = settings["realign_interval"]
+        logger.info("Live homography (re)initialized")
+        return homography
+
+    def align(self, frame, homography):
+        """Warp the frame onto the reference board coordinates"""
+        if homography is None:
+            return frame
+        img_height, img_width = frame.shape[:2]
+        try:
+            return self.backend.warp(frame, homography, (img_width, img_height))
+        except cv2.error as e:
+            logger.warning(f"Frame alignment failed: {e}")
+            return frame
+
+    # ******************* Matching ************************ #
+
+    def match(self, frame, indices=None):
+        """Match the ROI templates of the recipe (all of them, or only `indices`) against an (aligned) frame"""
+        if self.recipe is None:
+            raise ValueError("No recipe loaded")
+
+        settings = self.recipe.settings
+        frame_gray = to_gray(frame)
+        img_height, img_width = frame_gray.shape[:2]
+        context = FrameContext(frame_gray, self.backend, settings)
+        if indices is None:
+            indices = range(len(self.recipe.rois))
+
+        # Visit templates grouped by size so same-sized ROIs reuse the same window statistics
+        candidates = []
+        for index in sorted(indices, key=lambda i: self.recipe.rois[i]["template"].shape):
+            roi = self.recipe.rois[index]
+            roi_height, roi_width = roi["template"].shape
+            if roi_width > img_width or roi_height > img_height:
+                logger.warning(f"ROI {roi['name']} ({roi['folder_type']}) is larger than frame, skipping")
+                continue
+            candidates.append(index)
+
+        # Cascade: NG templates linked to a GOOD location wait for the GOOD result
+        links = self.recipe.cascade_links if settings["cascade"] else {}
+        try:
+            found = self._match_candidates([index for index in candidates if index not in links], frame_gray, context)
+            for index in candidates:
+                if index in links:
+                    found.update(self._cascade_match(index, links[index], found, frame_gray))
+        finally:
+            context.release()
+
+        return [self._detection(index, max_val, max_loc, img_width, img_height)
+                for index, (max_val, max_loc) in sorted(found.items())]
+
+    def _match_candidates(self, candidates, frame_gray, context):
+        """Search the given ROIs (local search first when enabled), returns {index: (score, (x, y))}"""
+        settings = context.settings
+        found = {}
+        pending = candidates
+        if settings["local_search"]:
+            # Try the profiled position first, only ROIs below threshold go to the full-frame search
+            pending = []
+            for index in candidates:
+                roi = self.recipe.rois[index]
+                max_val, max_loc = local_match(frame_gray, roi["template"], roi["annotation"], settings["search_margin"])
+                if max_val >= self.confidence_threshold:
+                    found[index] = (max_val, max_loc)
+                else:
+                    logger.debug(f"Local search for {roi['name']} peaked at {max_val:.2f}, falling back to full-frame search")
+                    pending.append(index)
+        found.update(self._search(pending, context))
+        return found
+
+    def _cascade_match(self, ng_index, good_index, found, frame_gray):
+        """Evaluate a linked NG template inside its profiled window, only when its GOOD template failed there"""
+        good = found.get(good_index)
+        if good is not None and good[0] >= self.confidence_threshold:
+            return {}
+        roi = self.recipe.rois[ng_index]
+        try:
+            return {ng_index: local_match(frame_gray, roi["template"], roi["annotation"], self.recipe.settings["search_margin"])}
+        except cv2.error as e:
+            logger.warning(f"Template matching failed for {roi['name']}: {e}")
+            return {}
+
+    def match_frame(self, frame, homography, aligned_frame=None, indices=None):
+        """Match the ROIs (all, or only `indices`) of an unaligned frame, either on the warped frame or on locally warped ROI windows
+
+        With warp_mode "patches" the frame is never warped: each ROI search window (profiled position plus
+        search_margin) is mapped into the frame with the inverse homography and only that patch is warped,
+        so the work scales with the ROI area instead of the frame area. Detection corners are then in
+        frame coordinates; in "frame" mode they are in the coordinates of the aligned frame.
+        """
+        if homography is None or self.recipe.settings["warp_mode"] != "patches":
+            return self.match(aligned_frame if aligned_frame is not None else self.align(frame, homography), indices)
+        return self.match_patches(frame, homography, indices)
+
+    def view_frame(self, frame, homography):
+        """Frame the detections of match_frame are drawn on: the aligned frame, or the raw frame in patch mode"""
+        if homography is not None and self.recipe.settings["warp_mode"] == "patches":
+            return frame.copy()
+        aligned_frame = self.align(frame, homography)
+        return aligned_frame.copy() if aligned_frame is frame else aligned_frame
+
+    def view_corners(self, detection, homography):
+        """Corners of a detection's box in the view_frame of another frame, given that frame's homography
+
+        Detections keep their box in reference coordinates (x, y, width, height), so a box found on an
+        earlier frame can be redrawn on a later one after the board moved.
+        """
+        x, y = detection["x"], detection["y"]
+        corners = rectangle_corners(x, y, x + detection["width"], y + detection["height"])
+        if homography is not None and self.recipe.settings["warp_mode"] == "patches":
+            corners = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), np.linalg.inv(homography)).reshape(4, 2)
+        return [(int(round(cx)), int(round(cy))) for cx, cy in corners]
+
+    def match_patches(self, frame, homography, indices=None):
+        """Match the ROIs (all, or only `indices`) in their search windows warped out of the unaligned frame (see match_frame)"""
+        if self.recipe is None:
+            raise ValueError("No recipe loaded")
+
+        margin = self.recipe.settings["search_margin"]
+        img_height, img_width = frame.shape[:2]
+        inverse = np.linalg.inv(homography)
+        indices = list(range(len(self.recipe.rois)) if indices is None else indices)
+        if not indices:
+            return []
+
+        # Search windows in reference coordinates, all mapped into the frame in one call
+        windows = {}
+        for index in indices:
+            roi = self.recipe.rois[index]
+            template_h, template_w = roi["template"].shape
+            x = int(round(float(roi["annotation"]['image_x'])))
+            y = int(round(float(roi["annotation"]['image_y'])))
+            windows[index] = (x - margin, y - margin, x + template_w + margin, y + template_h + margin)
+        corners = np.float32([rectangle_corners(*windows[index]) for index in indices]).reshape(-1, 1, 2)
+        frame_corners = dict(zip(indices, cv2.perspectiveTransform(corners, inverse).reshape(-1, 4, 2)))
+
+        # Cascade: linked NG templates are only evaluated where their GOOD template scored below threshold
+        links = self.recipe.cascade_links if self.recipe.settings["cascade"] else {}
+        order = sorted(indices, key=lambda i: i in links)
+        scores = {}
+
+        detections = {}
+        for index in order:
+            roi, window = self.recipe.rois[index], windows[index]
+            if index in links and scores.get(links[index], -1.0) >= self.confidence_threshold:
+                continue
+            x0, y0, x1, y1 = window
+            patch = warp_window(frame, frame_corners[index], (x1 - x0, y1 - y0))
+            if patch is None:
+                continue
+            try:
+                result = cv2.matchTemplate(to_gray(patch), roi["template"], cv2.TM_CCOEFF_NORMED)
+            except cv2.error as e:
+                logger.warning(f"Template matching failed for {roi['name']}: {e}")
+                continue
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            scores[index] = max_val
+            location = (max_loc[0] + x0, max_loc[1] + y0)
+            detections[index] = self._detection(index, max_val, location, img_width, img_height, inverse)
+        return [detection for index, detection in sorted(detections.items())]
+
+    def recheck(self, frame, homography, index, location, margin, aligned_frame=None):
+        """Small-window re-check of one ROI around a known location (reference coordinates)
+
+        Only the window location +/- margin is cut from the aligned frame, or warped out of the raw
+        frame in patch mode. Returns (score, (x, y)) in reference coordinates, score -1 when the window
+        falls outside the frame.
+        """
+        template = self.recipe.rois[index]["template"]
+        template_h, template_w = template.shape
+        x, y = location
+        x0, y0, x1, y1 = x - margin, y - margin, x + template_w + margin, y + template_h + margin
+        if homography is not None and self.recipe.settings["warp_mode"] == "patches":
+            frame_corners = cv2.perspectiveTransform(rectangle_corners(x0, y0, x1, y1).reshape(-1, 1, 2),
+                                                     np.linalg.inv(homography)).reshape(4, 2)
+            patch = warp_window(frame, frame_corners, (x1 - x0, y1 - y0))
+        else:
+            view = aligned_frame if aligned_frame is not None else self.align(frame, homography)
+            frame_h, frame_w = view.shape[:2]
+            x0, y0, x1, y1 = max(0, x0), max(0, y0), min(frame_w, x1), min(frame_h, y1)
+            patch = view[y0:y1, x0:x1]
+        if patch is None or patch.shape[0] < template_h or patch.shape[1] < template_w:
+            return -1.0, location
+        result = cv2.matchTemplate(to_gray(patch), template, cv2.TM_CCOEFF_NORMED)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        return max_val, (max_loc[0] + x0, max_loc[1] + y0)
+
+    def _search(self, indices, context):
+        """Full-frame search of the given ROIs using the recipe's match mode, returns {index: (score, (x, y))}"""
+        if not indices:
+            return {}
+        if self._fft_matcher is not None:
+            # One frame FFT shared by the whole batch
+            return context.fft_match(self._fft_matcher, indices)
+        pooled, handle = [], None
+        if self.match_pool is not None and context.settings["match_mode"] == "full":
+            # Shared-statistics ROIs stay here, the pool matches the others meanwhile
+            pooled = [index for index in indices if index not in self._shared_statistics_rois]
+            indices = [index for index in indices if index in self._shared_statistics_rois]
+            handle = self.match_pool.submit(context.gray, pooled)
+
+        found = {}
+        for index in indices:
+            roi = self.recipe.rois[index]
+            try:
+                found[index] = self._search_roi(index, roi, context)
+            except cv2.error as e:
+                logger.warning(f"Template matching failed for {roi['name']}: {e}")
+        if handle is not None:
+            results = self.match_pool.collect(handle)
+            found.update((index, result) for index, result in zip(pooled, results) if result is not None)
+        return found
+
+    def _search_roi(self, index, roi, context):
+        """Full-frame search of one ROI using the recipe's match mode"""
+        if context.settings["match_mode"] == "pyramid":
+            return pyramid_match(context.pyramid, roi["pyramid"], context.settings["pyramid_candidates"])
+        if self._fft_matcher is not None:
+            return context.fft_match(self._fft_matcher, [index])[index]
+        if index in self._shared_statistics_rois:
+            return shared_statistics_match(context.frame_float, context.statistics, roi["zero_mean"], roi["norm"])
+        result = self.backend.match_template(context.prepared, self._prepared_templates[index])
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    def _detection(self, index, score, location, img_width, img_height, inverse_homography=None):
+        """Build the detection record of one ROI from its best match
+
+        corners is the matched rectangle in the coordinates of the frame being drawn on: mapped back
+        through the inverse homography when matching was done on unwarped frames.
+        """
+        roi = self.recipe.rois[index]
+        annotation = roi["annotation"]
+        x, y = location
+        width = int(annotation['width'])
+        height = int(annotation['height'])
+        in_bounds = 0 <= x < img_width and 0 <= y < img_height and x + width <= img_width and y + height <= img_height
+        corners = rectangle_corners(x, y, x + width, y + height)
+        if inverse_homography is not None:
+            corners = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), inverse_homography).reshape(4, 2)
+        return {
+            "index": index,
+            "name": roi["name"],
+            "folder_type": roi["folder_type"],
+            "label": annotation.get('serial_number', ''),
+            "score": float(score),
+            "x": int(x),
+            "y": int(y),
+            "width": width,
+            "height": height,
+            "detected": score >= self.confidence_threshold and in_bounds,
+            "corners": [(int(round(cx)), int(round(cy))) for cx, cy in corners],
+        }
+
+    def inspect(self, frame):
+        """Align a frame to the recipe reference board and match every ROI"""
+        timings = {}
+        start = time.perf_counter()
+        homography = self.compute_homography(frame)
+        timings["alignment"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        aligned_frame = self.align(frame, homography)
+        timings["warp"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        detections = self.match(aligned_frame)
+        timings["matching"] = time.perf_counter() - start
+
+        logger.info(f"Inspection ({self.backend.name}): {sum(d['detected'] for d in detections)}/{len(detections)} ROIs detected, "
+                    f"alignment {timings['alignment'] * 1000:.1f} ms, matching {timings['matching'] * 1000:.1f} ms")
+        return InspectionResult(aligned_frame, homography, detections, timings)
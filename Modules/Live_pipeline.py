@@ -0,0 +1,112 @@
+import queue
+import logging
+from Modules.Pipeline import Pipeline
+from Modules.Live_session import draw_detection
+
+logger = logging.getLogger(__name__)
+
+"""Frames waiting in front of each live stage; a full alignment queue drops the new frame"""
+LIVE_QUEUE_SIZE = 2
+
+
+class LivePipeline:
+    """Live inspection split into alignment, matching and drawing stages on their own threads
+
+    alignment: frame-change check, homography tracking and the view frame
+    matching:  the session's scheduled ROI slice and tracker re-checks, then the stopping policy
+    drawing:   the tracked boxes on the view frame, collected for the display on the caller's thread
+
+    Every stage keeps per-session state (the change detector reference, the live homography, the
+    session schedule), so each runs a single worker and items go through it in frame order; the
+    stages still overlap, so frame N+1 is aligned while frame N is matched. submit() never blocks:
+    while the alignment queue is full the new frame is dropped, like the frame grabber drops frames
+    nobody took. stop_reason is set by the matching stage once the stopping policy ends the session.
+    """
+    def __init__(self, engine, session, stopping_policy, queue_size=LIVE_QUEUE_SIZE):
+        self.engine = engine
+        self.session = session
+        self.stopping_policy = stopping_policy
+        self.stop_reason = None
+        self._homography = None  # alignment stage
+        self._view = None  # drawing stage: last annotated view, reused on idle frames
+        self.pipeline = Pipeline("live")
+        self.pipeline.add_stage("alignment", self._align, queue_size=queue_size, drop_when_full=True)
+        self.pipeline.add_stage("matching", self._match, after="alignment", queue_size=queue_size)
+        self.drawing = self.pipeline.add_stage("drawing", self._draw, after="matching",
+                                               queue_size=queue_size, collect=True)
+
+    def start(self):
+        self.pipeline.start()
+        return self
+
+    def submit(self, frame, sequence):
+        """Queue a live frame, returns False when it was dropped"""
+        return self.pipeline.submit("alignment", {"frame": frame, "sequence": sequence}, block=False)
+
+    def results(self):
+        """Drawn items finished since the last call, oldest first: frame, sequence, view, new detections"""
+        items = []
+        while True:
+            try:
+                items.append(self.drawing.results.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _align(self, item):
+        session, frame = self.session, item["frame"]
+        session.observe(frame)
+        item["scene"] = session.scene
+        # Unchanged scene that was already fully evaluated: keep the previous homography, results and view
+        item["idle"] = session.idle
+        if not item["idle"]:
+            # Follow board movements; full realignment only runs when tracking is lost
+            self._homography = self.engine.track_homography(frame)
+        item["homography"] = self._homography
+        # Frame to draw on: the aligned frame, or the raw frame when only ROI windows are warped
+        item["view"] = None if item["idle"] else self.engine.view_frame(frame, self._homography)
+        return item
+
+    def _match(self, item):
+        if self.stop_reason:
+            return None
+        session = self.session
+        if item["idle"]:
+            session.replay()
+            item["new"] = []
+        else:
+            item["new"] = session.process(item["frame"], item["homography"], aligned_frame=item["view"],
+                                          scene=item["scene"])
+        item["overlay"] = session.overlay(item["homography"])
+        self.stop_reason = self.stopping_policy.should_stop(session)
+        return item
+
+    def _draw(self, item):
+        view = item["view"]
+        if view is None and self._view is not None:
+            item["view"] = self._view
+            return item
+        if view is None:
+            view = item["frame"].copy()
+        for corners, folder_type, label in item["overlay"]:
+            draw_detection(view, corners, folder_type, label)
+        item["view"] = self._view = view
+        return item
+
+    def close(self):
+        """Stop the stages, keeping the final view
+
+        Frames not aligned yet are dropped; frames already past alignment are matched (or skipped once
+        the session stopped) and drawn, so results() still returns the last annotated view.
+        """
+        self.pipeline.stages["alignment"].discard()
+        self.pipeline.close()
+
+    def final_view(self, frame):
+        """Annotated view of a frame from the session's current overlay, for use once the stages are closed"""
+        view = self.engine.view_frame(frame, self._homography)
+        for corners, folder_type, label in self.session.overlay(self._homography):
+            draw_detection(view, corners, folder_type, label)
+        return view
+
+    def stats(self):
+        return self.pipeline.stats()
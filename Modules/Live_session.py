@@ -0,0 +1,387 @@
+import time
+import logging
+import cv2
+import numpy as np
+from Modules.Recipe_store import link_ng_rois
+from Modules.Frame_change import FrameChangeDetector
+
+logger = logging.getLogger(__name__)
+
+"""Box colour of confirmed detections by folder type (BGR)"""
+DETECTION_COLORS = {"GOOD": (0, 255, 0), "NG": (0, 0, 255)}
+
+"""Weight of the newest measurement in the running matching costs"""
+COST_SMOOTHING = 0.3
+
+"""Shift (pixels, reference coordinates) of a tracked ROI from where it was confirmed that is reported as a move"""
+MOVE_TOLERANCE = 3
+
+
+def draw_detection(frame, corners, folder_type, label):
+    """Draw one detection box and its "(<folder type>) <serial>" caption"""
+    color = DETECTION_COLORS.get(folder_type, (0, 0, 255))
+    corners = np.int32(corners)
+    x, y = corners[0]
+    cv2.polylines(frame, [corners], True, color, 2)
+    cv2.putText(frame, f"({folder_type}) {label}", (int(x), int(y) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+
+class RoiTracker:
+    """Last known box of one confirmed ROI, kept current by small-window re-checks"""
+    def __init__(self, detection, frame, scene):
+        self.detection = dict(detection)
+        self.origin = (detection["x"], detection["y"])  # where the ROI was confirmed
+        self.last_checked = frame
+        self.scene = scene  # scene of the last check
+        self.moved = False
+
+    @property
+    def index(self):
+        return self.detection["index"]
+
+    @property
+    def location(self):
+        return self.detection["x"], self.detection["y"]
+
+    def update(self, score, location, frame, scene):
+        """Record a re-check, returns True when the box moved"""
+        self.last_checked = frame
+        self.scene = scene
+        self.detection["score"] = float(score)
+        if location == self.location:
+            return False
+        self.detection["x"], self.detection["y"] = int(location[0]), int(location[1])
+        return True
+
+    def offset(self):
+        x, y = self.location
+        return max(abs(x - self.origin[0]), abs(y - self.origin[1]))
+
+
+class LiveSession:
+    """Incremental matching state of one live inspection of the engine's current recipe
+
+    An ROI location is a single ROI, keyed by its index in the recipe. With "cascade" enabled the NG
+    ROIs linked to a GOOD ROI (see link_ng_rois) share its location instead, since their evaluation
+    already depends on the GOOD result there. A location is confirmed the first time one of its
+    templates is detected, and its templates then leave the matching set, so each matched frame only
+    searches what is still missing and the per-frame cost shrinks as the session progresses. The last box of
+    each confirmed location is kept in a cached overlay that is redrawn on every frame and only
+    re-projected when the live homography changes.
+
+    Matching is spread over frames: every frame gets a slice of the pending ROIs whose estimated
+    matching time fits "frame_budget_ms" (at least one ROI, 0 = all of them). Slices are taken round
+    robin, so each pending ROI is matched once per round; within a round NG-prone ROIs (NG templates
+    and GOOD templates with an NG template at their location) go first, then the least recently
+    matched. The cost of each ROI is a running mean of its measured matching time.
+
+    Each confirmed location gets a RoiTracker. The budget left after the pending slice (at least one
+    tracker per frame) re-checks the least recently checked trackers with an NCC search of
+    "track_margin" pixels around their last position, which keeps the overlay on the label. A
+    tracker whose score drops below "track_threshold" is demoted: the label was covered or moved
+    away, so its templates go back to the full search. Moves, demotions and re-acquisitions are kept in
+    `events` as (frame, ROI location, "moved" | "lost" | "reacquired").
+
+    With "change_threshold" > 0 every frame first goes through a FrameChangeDetector. While the
+    scene has not changed since every pending ROI was matched and every tracker re-checked on it,
+    the frame is idle: replay() advances the schedule with the previous results instead of matching,
+    and the caller can reuse its previous homography and annotated view. Scenes are numbered, and
+    every evaluation records the scene of the frame it ran on, so observe()/idle may run on one
+    thread (alignment) while process() runs on another (matching) with frames in flight between.
+
+    The session is complete once every loaded ROI location has been confirmed; ROI images without
+    an annotation never make it into the recipe and are not waited for, and neither are ROIs whose
+    template is larger than the live frame (dropped, and logged once, on the first frame). `scores` keeps the latest
+    score of every ROI matched or re-checked, for stopping policies (see Stopping_policy).
+    """
+    def __init__(self, engine):
+        if engine.recipe is None:
+            raise ValueError("No recipe loaded")
+        self.engine = engine
+        self.recipe = engine.recipe
+        settings = self.recipe.settings
+        self.budget = settings["frame_budget_ms"] / 1000.0
+        self.track_margin = settings["track_margin"]
+        self.track_threshold = settings["track_threshold"]
+        self.started = time.perf_counter()
+
+        links = self.recipe.cascade_links if self.recipe.cascade_links is not None else link_ng_rois(self.recipe)
+        grouped = links if settings["cascade"] else {}
+        self._location_of = [grouped.get(index, index) for index in range(len(self.recipe.rois))]
+        self._ng_prone = {index for index, roi in enumerate(self.recipe.rois) if roi["folder_type"] == "NG"}
+        self._ng_prone.update(links.values())
+
+        self.locations = set(self._location_of)
+        self._oversized = None  # ROI indices larger than the frame, set on the first processed frame
+        self.found = set()  # ROI locations (ROI index of the location) confirmed at least once
+        self.trackers = {}  # ROI location -> RoiTracker of the currently confirmed locations
+        self.pending = list(range(len(self.recipe.rois)))
+        self.scores = {}  # ROI index -> latest match or re-check score
+        self.detections = []  # first detection of every confirmed location, in order
+        self.events = []
+
+        # Round-robin schedule
+        self.frames = 0
+        self.rounds = 0
+        self.rounds_without_new = 0
+        self._round_remaining = set(self.pending)
+        self._round_new = 0
+        self._last_matched = {}  # ROI index -> frame it was last matched on
+        self._cost = {}  # ROI index -> running mean matching seconds
+        self._track_cost = None  # running mean seconds of one tracker re-check
+        self.matching_seconds = 0.0
+        self.tracking_seconds = 0.0
+        self.rois_matched = 0
+        self.rechecks = 0
+
+        # Frame-change gating
+        threshold = settings["change_threshold"]
+        self.change_detector = FrameChangeDetector(threshold) if threshold > 0 else None
+        self._changed = True
+        self.scene = 0  # number of the current scene, incremented on every detected change
+        self._evaluated = {}  # ROI index -> scene it was last matched on
+        self.skipped_frames = 0
+
+        self._overlay = None  # (corners, folder type, label) of the tracked detections, None when stale
+        self._overlay_homography = None
+
+    @property
+    def complete(self):
+        return len(self.found) >= len(self.locations)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    # ******************* Scheduling ************************ #
+
+    def _estimated_cost(self, index):
+        cost = self._cost.get(index)
+        if cost is None and self._cost:
+            cost = sum(self._cost.values()) / len(self._cost)
+        return cost
+
+    def schedule(self):
+        """ROI indices to match on the next frame"""
+        order = sorted(self._round_remaining,
+                       key=lambda i: (self._evaluated.get(i) == self.scene, i not in self._ng_prone,
+                                      self._last_matched.get(i, -1), i))
+        if self.budget <= 0:
+            return order
+        batch, spent = [], 0.0
+        for index in order:
+            cost = self._estimated_cost(index)
+            if batch and (cost is None or spent + cost > self.budget):
+                break
+            batch.append(index)
+            if cost is None:
+                break  # nothing measured yet: probe with a single ROI
+            spent += cost
+        return batch
+
+    def _record_cost(self, batch, seconds):
+        per_roi = seconds / len(batch)
+        for index in batch:
+            previous = self._cost.get(index)
+            self._cost[index] = per_roi if previous is None else previous + COST_SMOOTHING * (per_roi - previous)
+        self.matching_seconds += seconds
+        self.rois_matched += len(batch)
+
+    def _end_round(self):
+        self.rounds += 1
+        self.rounds_without_new = 0 if self._round_new else self.rounds_without_new + 1
+        self._round_new = 0
+        self._round_remaining = set(self.pending)
+
+    # ******************* Frame-change gating ************************ #
+
+    def observe(self, frame):
+        """Run the change detector on a new live frame, returns True when the scene changed"""
+        if self.change_detector is None:
+            return True
+        self._changed = self.change_detector.changed(frame)
+        if self._changed:
+            self.scene += 1
+        return self._changed
+
+    @property
+    def idle(self):
+        """True when the last observed frame adds nothing: unchanged scene, already fully evaluated"""
+        if self.change_detector is None or self._changed or not self.frames:
+            return False
+        scene, pending, trackers = self.scene, self.pending, tuple(self.trackers.values())
+        return all(self._evaluated.get(index) == scene for index in pending) and \
+            all(tracker.scene == scene for tracker in trackers)
+
+    def replay(self):
+        """Account for an idle frame: the scheduled slice keeps its previous results"""
+        self.frames += 1
+        self.skipped_frames += 1
+        if not self.pending:
+            return
+        batch = self.schedule()
+        for index in batch:
+            self._last_matched[index] = self.frames
+        self._round_remaining.difference_update(batch)
+        if not self._round_remaining:
+            self._end_round()
+
+    # ******************* Matching ************************ #
+
+    def process(self, frame, homography, aligned_frame=None, scene=None):
+        """Match the scheduled slice of pending ROIs and re-check trackers on one frame
+
+        scene is the scene number observe() gave the frame (the current one by default).
+        Returns the detections confirmed for the first time on this frame.
+        """
+        if scene is None:
+            scene = self.scene
+        if self._oversized is None:
+            self._drop_oversized(frame)
+        self.frames += 1
+        start = time.perf_counter()
+        confirmed = self._match_pending(frame, homography, aligned_frame, scene) if self.pending else []
+        spent = time.perf_counter() - start
+        if self.trackers:
+            self._recheck(frame, homography, aligned_frame, scene, self.budget - spent if self.budget > 0 else None)
+        return confirmed
+
+    def _drop_oversized(self, frame):
+        """Leave out the ROIs the matcher would skip on every frame: templates larger than the frame"""
+        frame_height, frame_width = frame.shape[:2]
+        self._oversized = set()
+        for index, roi in enumerate(self.recipe.rois):
+            roi_height, roi_width = roi["template"].shape
+            if roi_width > frame_width or roi_height > frame_height:
+                self._oversized.add(index)
+                logger.warning(f"ROI {roi['name']} ({roi['folder_type']}) is larger than the frame, "
+                               f"left out of the session")
+        if self._oversized:
+            self.locations = {location for index, location in enumerate(self._location_of)
+                              if index not in self._oversized}
+            self._update_pending()
+
+    def _match_pending(self, frame, homography, aligned_frame, scene):
+        batch = self.schedule()
+        start = time.perf_counter()
+        detections = self.engine.match_frame(frame, homography, aligned_frame=aligned_frame, indices=batch)
+        self._record_cost(batch, time.perf_counter() - start)
+
+        confirmed, tracked = [], False
+        for detection in detections:
+            self.scores[detection["index"]] = detection["score"]
+            logger.debug(f"ROI {detection['name']} ({detection['folder_type']}): confidence={detection['score']:.2f}")
+            location = self._location_of[detection["index"]]
+            if not detection["detected"] or location in self.trackers:
+                continue
+            self.trackers[location] = RoiTracker(detection, self.frames, scene)
+            tracked = True
+            if location in self.found:
+                self._event(location, "reacquired")
+            else:
+                self.found.add(location)
+                self.detections.append(detection)
+                confirmed.append(detection)
+        for index in batch:
+            self._last_matched[index] = self.frames
+        self._evaluated.update((index, scene) for index in batch)
+        self._round_remaining.difference_update(batch)
+        self._round_new += len(confirmed)
+        if tracked:
+            self._update_pending()
+            self._overlay = None
+        if not self._round_remaining:
+            self._end_round()
+        return confirmed
+
+    def _recheck(self, frame, homography, aligned_frame, scene, budget):
+        """Re-check the least recently checked trackers that fit the remaining budget (at least one)"""
+        order = sorted(self.trackers.values(), key=lambda tracker: tracker.last_checked)
+        if budget is not None:
+            count = 1 if not self._track_cost else max(1, int(budget / self._track_cost))
+            order = order[:count]
+
+        start = time.perf_counter()
+        lost = []
+        for tracker in order:
+            score, location = self.engine.recheck(frame, homography, tracker.index, tracker.location,
+                                                  self.track_margin, aligned_frame=aligned_frame)
+            self.scores[tracker.index] = score
+            group = self._location_of[tracker.index]
+            if score < self.track_threshold:
+                lost.append(group)
+                continue
+            if tracker.update(score, location, self.frames, scene):
+                self._overlay = None
+                if not tracker.moved and tracker.offset() > MOVE_TOLERANCE:
+                    tracker.moved = True
+                    self._event(group, "moved")
+        seconds = time.perf_counter() - start
+        per_check = seconds / len(order)
+        self._track_cost = per_check if self._track_cost is None else \
+            self._track_cost + COST_SMOOTHING * (per_check - self._track_cost)
+        self.tracking_seconds += seconds
+        self.rechecks += len(order)
+
+        if lost:
+            for group in lost:
+                del self.trackers[group]
+                self._event(group, "lost")
+            self._update_pending()
+            # Demoted ROIs are searched again in the current round
+            self._round_remaining.update(index for index in self.pending if self._location_of[index] in lost)
+            self._overlay = None
+
+    def _event(self, location, kind):
+        self.events.append((self.frames, location, kind))
+        roi = self.recipe.rois[location]
+        logger.info(f"ROI {roi['name']} ({roi['folder_type']}) {kind} at frame {self.frames}")
+
+    def _update_pending(self):
+        self.pending = [index for index, location in enumerate(self._location_of)
+                        if location not in self.trackers and index not in (self._oversized or ())]
+        self._round_remaining.intersection_update(self.pending)
+
+    def stats(self):
+        kinds = [kind for frame, name, kind in self.events]
+        return {
+            "frames": self.frames,
+            "seconds": self.elapsed,
+            "rounds": self.rounds,
+            "found": len(self.found),
+            "tracked": len(self.trackers),
+            "locations": len(self.locations),
+            "rois_matched": self.rois_matched,
+            "rechecks": self.rechecks,
+            "skipped_frames": self.skipped_frames,
+            "skip_ratio": self.skipped_frames / self.frames if self.frames else 0.0,
+            "moved": kinds.count("moved"),
+            "lost": kinds.count("lost"),
+            "matching_ms_per_frame": self.matching_seconds * 1000 / self.frames if self.frames else 0.0,
+            "tracking_ms_per_frame": self.tracking_seconds * 1000 / self.frames if self.frames else 0.0,
+            "change_detector": self.change_detector.stats() if self.change_detector is not None else None,
+        }
+
+    # ******************* Drawing ************************ #
+
+    def overlay(self, homography):
+        """(corners, folder type, label) of every tracked box on the view frame of the given homography
+
+        The list is rebuilt only when a box changed or, in patch mode, the homography did; callers
+        get a list that is never modified afterwards, so it can be drawn on another thread.
+        """
+        # Boxes on aligned frames do not move; on raw frames (patch mode) they follow the homography
+        if self.recipe.settings["warp_mode"] != "patches":
+            homography = None
+        if self._overlay is None or self._overlay_homography is not homography:
+            self._overlay = [(self.engine.view_corners(tracker.detection, homography),
+                              tracker.detection["folder_type"], tracker.detection["label"])
+                             for tracker in self.trackers.values()]
+            self._overlay_homography = homography
+        return self._overlay
+
+    def draw(self, frame, homography):
+        """Redraw the tracked boxes on the view frame of the given homography"""
+        for corners, folder_type, label in self.overlay(homography):
+            draw_detection(frame, corners, folder_type, label)
+        return frame
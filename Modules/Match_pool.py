@@ -0,0 +1,148 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""Shared memory blocks attached by this worker process: name -> SharedMemory"""
+_worker_blocks = {}
+
+
+def _init_worker(cv_threads):
+    """Limit OpenCV threads in each worker so workers x threads does not oversubscribe the CPU"""
+    cv2.setNumThreads(cv_threads)
+
+
+def _attach(name):
+    """Attach (once per worker) to a shared memory block created by the main process"""
+    block = _worker_blocks.get(name)
+    if block is None:
+        block = shared_memory.SharedMemory(name=name)
+        _worker_blocks[name] = block
+    return block
+
+
+def _detach_except(names):
+    for name in list(_worker_blocks):
+        if name not in names:
+            _worker_blocks.pop(name).close()
+
+
+def _match_jobs(frame_name, frame_shape, atlas_name, jobs):
+    """Worker side: match a chunk of (offset, height, width) template jobs against the shared frame"""
+    _detach_except((frame_name, atlas_name))
+    frame = np.ndarray(frame_shape, dtype=np.uint8, buffer=_attach(frame_name).buf)
+    atlas = _attach(atlas_name).buf
+
+    results = []
+    for offset, template_h, template_w in jobs:
+        template = np.ndarray((template_h, template_w), dtype=np.uint8, buffer=atlas, offset=offset)
+        try:
+            result = cv2.matchTemplate(frame, template, cv2.TM_CCOEFF_NORMED)
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            results.append((max_val, max_loc))
+        except cv2.error as e:
+            results.append(None)
+            logger.warning(f"Template matching failed in worker {os.getpid()}: {e}")
+    return results
+
+
+class MatchPool:
+    """Persistent process pool matching ROI templates against a frame held in shared memory
+
+    The recipe templates are packed once into a shared-memory atlas and every frame is copied once
+    into a shared-memory block, so jobs only carry offsets and shapes; no image is pickled. Results
+    come back in job order.
+    """
+    def __init__(self, workers=None, cv_threads_per_worker=1, chunks_per_worker=2, start_method="spawn"):
+        cpu_count = os.cpu_count() or 1
+        self.cv_threads_per_worker = max(1, cv_threads_per_worker)
+        self.workers = workers or max(1, cpu_count // self.cv_threads_per_worker)
+        self.chunks_per_worker = chunks_per_worker
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(self.cv_threads_per_worker,),
+        )
+        self._atlas = None
+        self._template_table = []  # index -> (offset, height, width)
+        self._frame_block = None
+        logger.info(f"Match pool started: {self.workers} workers x {self.cv_threads_per_worker} OpenCV threads")
+
+    # ******************* Shared memory ************************ #
+
+    def set_templates(self, templates):
+        """Pack the grayscale templates into one shared-memory atlas with an offset table"""
+        self._release_block(self._atlas)
+        total = sum(template.size for template in templates)
+        self._atlas = shared_memory.SharedMemory(create=True, size=max(1, total))
+        self._template_table = []
+        offset = 0
+        for template in templates:
+            template = np.ascontiguousarray(template, dtype=np.uint8)
+            self._atlas.buf[offset:offset + template.size] = template.tobytes()
+            self._template_table.append((offset,) + template.shape)
+            offset += template.size
+
+    def _put_frame(self, frame_gray):
+        """Copy the frame into the shared frame block, reallocating only when the frame size changes"""
+        if self._frame_block is None or self._frame_block.size < frame_gray.size:
+            self._release_block(self._frame_block)
+            self._frame_block = shared_memory.SharedMemory(create=True, size=frame_gray.size)
+        np.ndarray(frame_gray.shape, dtype=np.uint8, buffer=self._frame_block.buf)[:] = frame_gray
+
+    @staticmethod
+    def _release_block(block):
+        if block is not None:
+            block.close()
+            block.unlink()
+
+    # ******************* Matching ************************ #
+
+    def match(self, frame_gray, indices):
+        """Return [(score, (x, y)) or None] for the given template indices, in the same order"""
+        return self.collect(self.submit(frame_gray, indices))
+
+    def submit(self, frame_gray, indices):
+        """Start matching the given template indices, returns the handle collect() waits on
+
+        The caller can do other work in between; the frame is copied, so it may change meanwhile.
+        """
+        if self._atlas is None:
+            raise ValueError("set_templates must be called before matching")
+        jobs = [self._template_table[index] for index in indices]
+        if not jobs:
+            return [], 0, 0
+
+        frame_gray = np.ascontiguousarray(frame_gray, dtype=np.uint8)
+        self._put_frame(frame_gray)
+
+        # A few chunks per worker keeps IPC low while still balancing uneven template sizes
+        chunk_count = min(len(jobs), self.workers * self.chunks_per_worker)
+        chunks = [jobs[i::chunk_count] for i in range(chunk_count)]
+        futures = [self._executor.submit(_match_jobs, self._frame_block.name, frame_gray.shape, self._atlas.name, chunk)
+                   for chunk in chunks]
+        return futures, chunk_count, len(jobs)
+
+    @staticmethod
+    def collect(handle):
+        """Wait for the results of submit(), in the order of its indices"""
+        futures, chunk_count, job_count = handle
+        # Chunks are strided, put every result back at its job position
+        results = [None] * job_count
+        for chunk_index, future in enumerate(futures):
+            for position, result in enumerate(future.result()):
+                results[chunk_index + position * chunk_count] = result
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._release_block(self._atlas)
+        self._release_block(self._frame_block)
+        self._atlas = None
+        self._frame_block = None
@@ -0,0 +1,182 @@
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """One pipeline stage: a bounded input queue served by `workers` threads running `function`
+
+    function(item) returns the item handed to the downstream stages, or None to end it there.
+    submit() blocks while the queue is full, so a slow stage holds back the stages feeding it
+    (backpressure) instead of letting work pile up; with drop_when_full the item is discarded and
+    counted instead, for producers such as live frames where a newer item replaces an old one.
+    With collect=True the stage also puts its results on `results` for a consumer outside the
+    pipeline (e.g. the Tk thread); when nobody keeps up, the oldest results are dropped.
+    """
+    def __init__(self, name, function, workers=1, queue_size=4, drop_when_full=False, collect=False):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.drop_when_full = drop_when_full
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size) if collect else None
+        self.outputs = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0
+        self.max_depth = 0
+        self.wait_seconds = 0.0
+        self.service_seconds = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, item, block=True, timeout=None):
+        """Queue an item, returns False when it was dropped (drop_when_full) or timed out"""
+        try:
+            self.queue.put((time.perf_counter(), item), block=block and not self.drop_when_full, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def _work(self):
+        while True:
+            queued_at, item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                break
+            started = time.perf_counter()
+            with self._lock:
+                self.busy += 1
+            try:
+                result = self.function(item)
+            except Exception as e:
+                result = None
+                logger.exception(f"Pipeline stage {self.name} failed: {e}")
+                with self._lock:
+                    self.errors += 1
+            finished = time.perf_counter()
+            with self._lock:
+                self.busy -= 1
+                self.processed += 1
+                self.wait_seconds += started - queued_at
+                self.service_seconds += finished - started
+                self.max_latency = max(self.max_latency, finished - queued_at)
+            if result is not None:
+                for output in self.outputs:
+                    output.submit(result)
+                if self.results is not None:
+                    self._collect(result)
+            self.queue.task_done()
+
+    def _collect(self, result):
+        """Keep the newest results: a full results queue loses its oldest entry rather than blocking the stage"""
+        while True:
+            try:
+                self.results.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self.results.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def discard(self):
+        """Drop every queued item that no worker has picked up yet"""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.queue.task_done()
+            with self._lock:
+                self.dropped += 1
+
+    def close(self):
+        """Let the workers finish the queued items, then stop them"""
+        for _ in self._threads:
+            self.queue.put((time.perf_counter(), _STOP))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            processed = self.processed
+            return {
+                "workers": self.workers,
+                "depth": self.queue.qsize(),
+                "max_depth": self.max_depth,
+                "busy": self.busy,
+                "submitted": self.submitted,
+                "processed": processed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "wait_ms": self.wait_seconds * 1000 / processed if processed else 0.0,
+                "service_ms": self.service_seconds * 1000 / processed if processed else 0.0,
+                "max_latency_ms": self.max_latency * 1000,
+            }
+
+
+class Pipeline:
+    """Stages connected by bounded queues, each stage with its own worker threads
+
+    Stages are added in order, each one after the stages that feed it, and started together.
+    close() shuts them down in that order so every item already accepted is passed on and finished;
+    stats() gives the queue depth, throughput and latency of every stage.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.started = False
+
+    def add_stage(self, name, function, after=(), workers=1, queue_size=4, drop_when_full=False, collect=False):
+        if name in self.stages:
+            raise ValueError(f"Pipeline {self.name} already has a stage {name!r}")
+        stage = Stage(name, function, workers, queue_size, drop_when_full, collect)
+        for upstream in ([after] if isinstance(after, str) else after):
+            self.stages[upstream].outputs.append(stage)
+        self.stages[name] = stage
+        if self.started:
+            stage.start()
+        return stage
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            for stage in self.stages.values():
+                stage.start()
+        return self
+
+    def submit(self, name, item, block=True, timeout=None):
+        return self.stages[name].submit(item, block, timeout)
+
+    def close(self, discard=False):
+        """Stop every stage; with discard, items still waiting in the queues are dropped instead of processed"""
+        for stage in self.stages.values():
+            if discard:
+                stage.discard()
+            stage.close()
+        self.started = False
+        logger.info(f"Pipeline {self.name} closed: {self.stats()}")
+
+    def stats(self):
+        return {name: stage.stats() for name, stage in self.stages.items()}
@@ -0,0 +1,463 @@
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from Modules.Reference_features import REFERENCE_FEATURES_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+"""Default locations and settings shared with the UI"""
+SHARPEYE_DATA = "/home/nvidia/SHARPEYE_DATA"
+FOLDER_TYPES = ["GOOD", "NG"]
+MB_POSITIONS = ["TOP VIEW", "BOTTOM VIEW"]
+
+"""Per-recipe matching settings, overridden by recipe_settings.json in the GOOD profiling folder"""
+RECIPE_SETTINGS_FILE = "recipe_settings.json"
+DEFAULT_RECIPE_SETTINGS = {
+    "match_mode": "full",  # "full", "pyramid" or "fft"
+    "pyramid_levels": 2,  # number of pyrDown steps for the coarse search
+    "pyramid_candidates": 3,  # coarse peaks refined at full resolution
+    "fft_batch_size": 8,  # templates correlated per inverse FFT batch
+    "shared_statistics": True,  # CPU full mode: integral images once per frame, numerator-only matching per ROI
+    "shared_statistics_min_bucket": 2,  # templates of one size needed before their window statistics are shared
+    "local_search": False,  # search around the profiled ROI position first
+    "search_margin": 40,  # pixels added around the profiled ROI for the local search
+    "cascade": False,  # NG templates only evaluated, in their own window, where the overlapping GOOD template fails
+    "warp_mode": "frame",  # live view: "frame" warps every frame, "patches" only warps each ROI search window
+    "reference_shortlist": 3,  # reference boards kept by the thumbnail index for ORB matching (0 = all)
+    "feature_matcher": "bf_crosscheck",  # "bf_crosscheck", "knn_bf" (2-NN + ratio test) or "lsh" (FLANN LSH + ratio test)
+    "feature_ratio": 0.8,  # Lowe ratio for the kNN matchers
+    "homography_check_threshold": 0.8,  # low-resolution ECC score needed to reuse the cached homography
+    "alignment_scale": 1.0,  # ORB alignment on images resized by this factor, homography rescaled to full resolution
+    "alignment_refine": False,  # refine the rescaled homography with full-resolution ECC
+    "alignment_refine_iterations": 30,
+    "homography_tracking": True,  # live view: track the homography with optical flow, realign only when lost
+    "realign_interval": 10,  # live frames to wait before retrying a failed realignment
+    "frame_budget_ms": 15.0,  # live view: template matching time spent per frame, ROIs are spread over frames
+    "track_margin": 8,  # live view: pixels searched around a confirmed ROI's last position when re-checking it
+    "track_threshold": 0.7,  # live view: re-check score below which a confirmed ROI goes back to full search
+    "change_threshold": 12,  # live view: gray levels a thumbnail cell must change by to re-evaluate a frame (0 = off)
+    "stopping_policy": "stable_scores",  # live view: "stable_scores" or "fixed" (no new detection for 30 rounds)
+    "stable_frames": 30,  # stable_scores: frames without a score change before the session ends
+    "score_tolerance": 0.05,  # stable_scores: score change that still counts as stable
+    "session_max_frames": 300,  # live frames after which a session always ends
+    "session_budget_s": 10.0,  # seconds after which a session always ends (0 = no time budget)
+}
+
+"""Memory budget of the in-process recipe cache"""
+RECIPE_CACHE_BYTES = 512 * 1024 * 1024
+
+"""Compiled recipe packs: <data_root>/Recipe_packs/<TP>_<P/N>/<position>.pack"""
+RECIPE_PACK_FOLDER = "Recipe_packs"
+RECIPE_PACK_MAGIC = b"SEPACK01"
+RECIPE_PACK_HEADER = struct.Struct("<8sQ")  # magic, manifest length
+RECIPE_PACK_ALIGNMENT = 64
+
+
+def to_gray(image):
+    """Convert a BGR/BGRA image to grayscale, leave grayscale images untouched"""
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class Recipe:
+    """All ROI templates, annotations and reference boards profiled for one TP / P/N / MB position"""
+    def __init__(self, tp, part_number, position):
+        self.tp = tp
+        self.part_number = part_number
+        self.position = position
+        self.rois = []  # list of dicts: name, folder_type, annotation, template
+        self.expected_rois = set()  # every ROI PNG found in the profiling folders
+        self.board_images = []  # paths of the GOOD reference board images
+        self.settings = dict(DEFAULT_RECIPE_SETTINGS)
+        self.fingerprint = None  # recipe_fingerprint() of the profiling folders it was read from
+        self.reference_features = {}  # alignment scale -> {board image path -> ReferenceFeatures, or None if unreadable}
+        self.reference_index = None  # ReferenceIndex over the reference board thumbnails
+        self.cascade_links = None  # NG ROI index -> index of the GOOD ROI at the same location
+
+    def __len__(self):
+        return len(self.rois)
+
+
+def validate_recipe_key(tp, part_number, position):
+    for var_name, var_value in [("tp", tp), ("part_number", part_number), ("position", position)]:
+        if not isinstance(var_value, str):
+            logger.error(f"{var_name} is not a string: {var_value} (type: {type(var_value)})")
+            raise ValueError(f"{var_name} must be a string, got {type(var_value)}: {var_value}")
+
+
+# ***************************************************** PROFILING FOLDERS ************************************************************* #
+
+def recipe_folder(data_root, folder_type, tp, part_number, position):
+    """Return the profiling folder of a recipe (GOOD or NG)"""
+    base_folder = os.path.join(data_root, "Profiling_data" if folder_type == "GOOD" else "Profiling_data_NG", folder_type)
+    folder = os.path.join(base_folder, f"{tp}_{part_number}", position)
+    if not os.path.exists(folder):
+        # Older stations stored the recipes as <P/N>_<TP>
+        legacy_folder = os.path.join(base_folder, f"{part_number}_{tp}", position)
+        if os.path.exists(legacy_folder):
+            return legacy_folder
+    return folder
+
+
+def recipe_fingerprint(tp, part_number, position, data_root=SHARPEYE_DATA):
+    """Cheap content fingerprint of a recipe: names, sizes and mtimes of its profiling files (no file is read)"""
+    entries = []
+    for folder_type in FOLDER_TYPES:
+        roi_folder = recipe_folder(data_root, folder_type, tp, part_number, position)
+        for folder in (roi_folder, os.path.join(roi_folder, "Board_image")):
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        # Feature files are derived from the boards and written lazily, they do not change the recipe
+                        if entry.is_file() and not entry.name.endswith(REFERENCE_FEATURES_SUFFIX):
+                            stat = entry.stat()
+                            entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                entries.append((folder, -1, -1))
+    return hashlib.sha1(json.dumps(sorted(entries)).encode("utf-8")).hexdigest()
+
+
+def load_recipe_from_folders(tp, part_number, position, data_root=SHARPEYE_DATA):
+    """Read every ROI PNG and its annotation JSON for the GOOD and NG profiles of a recipe"""
+    validate_recipe_key(tp, part_number, position)
+
+    recipe = Recipe(tp, part_number, position)
+    recipe.fingerprint = recipe_fingerprint(tp, part_number, position, data_root)
+
+    for folder_type in FOLDER_TYPES:
+        roi_folder = recipe_folder(data_root, folder_type, tp, part_number, position)
+        logger.info(f"Accessing profiling folder ({folder_type}): {roi_folder}")
+
+        if not os.path.exists(roi_folder):
+            if folder_type == "NG":
+                logger.warning("Folder (NG) not found, skipping NG processing")
+                continue
+            logger.error(f"Folder ({folder_type}) not found at {roi_folder}")
+            raise FileNotFoundError(f"Profiling folder ({folder_type}) not found at {roi_folder}")
+
+        json_files = sorted(f for f in os.listdir(roi_folder) if f.lower().endswith('.json') and f != RECIPE_SETTINGS_FILE)
+        if not json_files:
+            if folder_type == "NG":
+                logger.warning(f"No JSON files found in {roi_folder} (NG)")
+                continue
+            logger.error(f"No JSON files found in {roi_folder}")
+            raise FileNotFoundError(f"No JSON files found in {roi_folder}")
+
+        # Index annotations by their ROI image name
+        annotations = {}
+        for json_file in json_files:
+            json_path = os.path.join(roi_folder, json_file)
+            try:
+                with open(json_path, 'r') as f:
+                    for anno in json.load(f):
+                        annotations.setdefault(anno.get('ROI_image_index'), anno)
+            except Exception as e:
+                logger.error(f"Failed to load JSON {json_path}: {e}")
+
+        for roi_filename in sorted(os.listdir(roi_folder)):
+            if not roi_filename.lower().endswith('.png'):
+                continue
+            recipe.expected_rois.add(roi_filename)
+
+            matched_annotation = annotations.get(roi_filename)
+            if not matched_annotation:
+                logger.warning(f"No annotation found for ROI: {roi_filename} ({folder_type})")
+                continue
+
+            roi_img = cv2.imread(os.path.join(roi_folder, roi_filename), cv2.IMREAD_UNCHANGED)
+            if roi_img is None:
+                logger.warning(f"Could not load ROI image ({folder_type}): {roi_filename}")
+                continue
+
+            recipe.rois.append({
+                "name": roi_filename,
+                "folder_type": folder_type,
+                "annotation": matched_annotation,
+                "template": to_gray(roi_img),
+            })
+
+        if folder_type == "GOOD":
+            recipe.settings.update(load_recipe_settings(roi_folder))
+
+            board_folder = os.path.join(roi_folder, "Board_image")
+            if os.path.exists(board_folder):
+                recipe.board_images = [
+                    os.path.join(board_folder, f) for f in sorted(os.listdir(board_folder)) if f.lower().endswith('.png')
+                ]
+
+    logger.info(f"Loaded recipe {tp}_{part_number}/{position}: {len(recipe.rois)} ROI-annotation pairs, "
+                f"{len(recipe.expected_rois)} ROI images, {len(recipe.board_images)} reference boards")
+    return recipe
+
+
+def load_recipe_settings(folder):
+    """Read the optional recipe_settings.json of a profiling folder"""
+    settings_path = os.path.join(folder, RECIPE_SETTINGS_FILE)
+    if not os.path.exists(settings_path):
+        return {}
+    try:
+        with open(settings_path, 'r') as f:
+            settings = json.load(f)
+        logger.info(f"Loaded recipe settings from {settings_path}: {settings}")
+        return settings
+    except Exception as e:
+        logger.error(f"Failed to load recipe settings {settings_path}: {e}")
+        return {}
+
+
+def annotation_rectangle(annotation):
+    x, y = float(annotation['image_x']), float(annotation['image_y'])
+    return x, y, x + float(annotation['width']), y + float(annotation['height'])
+
+
+def link_ng_rois(recipe):
+    """Link every NG ROI to the GOOD ROI whose annotated rectangle overlaps it most (unlinked when none overlaps)"""
+    good_rois = [(index, annotation_rectangle(roi["annotation"]))
+                 for index, roi in enumerate(recipe.rois) if roi["folder_type"] == "GOOD"]
+    links = {}
+    for index, roi in enumerate(recipe.rois):
+        if roi["folder_type"] != "NG":
+            continue
+        x0, y0, x1, y1 = annotation_rectangle(roi["annotation"])
+        best_overlap, best_index = 0.0, None
+        for good_index, (gx0, gy0, gx1, gy1) in good_rois:
+            overlap = max(0.0, min(x1, gx1) - max(x0, gx0)) * max(0.0, min(y1, gy1) - max(y0, gy0))
+            if overlap > best_overlap:
+                best_overlap, best_index = overlap, good_index
+        if best_index is not None:
+            links[index] = best_index
+    return links
+
+
+# ***************************************************** COMPILED PACKS ************************************************************* #
+#
+# A pack is one file: a fixed header (magic, manifest length), a JSON manifest (ROI names, annotations,
+# offset table into the atlas, reference boards, settings, source fingerprint), padding to a 64-byte
+# boundary and a contiguous uint8 atlas of every grayscale template. Loading parses the manifest and
+# memory-maps the atlas, so templates are views into the page cache and nothing is decoded.
+
+def recipe_pack_path(data_root, tp, part_number, position):
+    return os.path.join(data_root, RECIPE_PACK_FOLDER, f"{tp}_{part_number}", f"{position}.pack")
+
+
+def write_recipe_pack(recipe, pack_path):
+    """Write a loaded recipe as a single pack file (atomically replaces an existing pack)"""
+    rois = []
+    offset = 0
+    for roi in recipe.rois:
+        template_h, template_w = roi["template"].shape[:2]
+        rois.append({
+            "name": roi["name"],
+            "folder_type": roi["folder_type"],
+            "annotation": roi["annotation"],
+            "offset": offset,
+            "shape": [template_h, template_w],
+        })
+        offset += template_h * template_w
+
+    manifest = json.dumps({
+        "tp": recipe.tp,
+        "part_number": recipe.part_number,
+        "position": recipe.position,
+        "fingerprint": recipe.fingerprint,
+        "settings": recipe.settings,
+        "board_images": recipe.board_images,
+        "expected_rois": sorted(recipe.expected_rois),
+        "atlas_size": offset,
+        "rois": rois,
+    }).encode("utf-8")
+    header_size = RECIPE_PACK_HEADER.size + len(manifest)
+    padding = -header_size % RECIPE_PACK_ALIGNMENT
+
+    os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+    temp_path = f"{pack_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(RECIPE_PACK_HEADER.pack(RECIPE_PACK_MAGIC, len(manifest)))
+        f.write(manifest)
+        f.write(b"\0" * padding)
+        for roi in recipe.rois:
+            f.write(np.ascontiguousarray(roi["template"], dtype=np.uint8).tobytes())
+    os.replace(temp_path, pack_path)
+    logger.info(f"Compiled recipe pack {pack_path}: {len(rois)} ROIs, {offset / 1024:.0f} KiB atlas")
+
+
+def read_recipe_pack(pack_path):
+    """Open a pack: parse the manifest and memory-map the template atlas, returns a Recipe"""
+    with open(pack_path, 'rb') as f:
+        magic, manifest_size = RECIPE_PACK_HEADER.unpack(f.read(RECIPE_PACK_HEADER.size))
+        if magic != RECIPE_PACK_MAGIC:
+            raise ValueError(f"Not a recipe pack: {pack_path}")
+        manifest = json.loads(f.read(manifest_size).decode("utf-8"))
+    header_size = RECIPE_PACK_HEADER.size + manifest_size
+    atlas_offset = header_size + (-header_size % RECIPE_PACK_ALIGNMENT)
+
+    atlas = None
+    if manifest["atlas_size"]:
+        atlas = np.memmap(pack_path, dtype=np.uint8, mode='r', offset=atlas_offset, shape=(manifest["atlas_size"],))
+
+    recipe = Recipe(manifest["tp"], manifest["part_number"], manifest["position"])
+    recipe.fingerprint = manifest["fingerprint"]
+    recipe.settings.update(manifest["settings"])
+    recipe.board_images = manifest["board_images"]
+    recipe.expected_rois = set(manifest["expected_rois"])
+    for roi in manifest["rois"]:
+        template_h, template_w = roi["shape"]
+        offset = roi["offset"]
+        recipe.rois.append({
+            "name": roi["name"],
+            "folder_type": roi["folder_type"],
+            "annotation": roi["annotation"],
+            "template": atlas[offset:offset + template_h * template_w].reshape(template_h, template_w),
+        })
+    return recipe
+
+
+def compile_recipe(tp, part_number, position, data_root=SHARPEYE_DATA):
+    """Read a recipe from its profiling folders and write its pack, returns the loaded recipe"""
+    recipe = load_recipe_from_folders(tp, part_number, position, data_root=data_root)
+    write_recipe_pack(recipe, recipe_pack_path(data_root, tp, part_number, position))
+    return recipe
+
+
+def load_recipe(tp, part_number, position, data_root=SHARPEYE_DATA, compile_missing=True):
+    """Load a recipe from its pack when the pack matches the profiling folders, otherwise from the folders
+
+    A missing or stale pack is (re)compiled from the folders when compile_missing is set, so the next
+    load is a memory-mapped open instead of one PNG decode and one JSON parse per ROI.
+    """
+    validate_recipe_key(tp, part_number, position)
+    pack_path = recipe_pack_path(data_root, tp, part_number, position)
+    if os.path.exists(pack_path):
+        try:
+            recipe = read_recipe_pack(pack_path)
+            if recipe.fingerprint == recipe_fingerprint(tp, part_number, position, data_root):
+                logger.info(f"Loaded recipe pack {pack_path}: {len(recipe.rois)} ROIs")
+                return recipe
+            logger.info(f"Recipe pack {pack_path} is out of date, reloading the profiling folders")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read recipe pack {pack_path}: {e}")
+
+    recipe = load_recipe_from_folders(tp, part_number, position, data_root=data_root)
+    if compile_missing:
+        try:
+            write_recipe_pack(recipe, pack_path)
+        except OSError as e:
+            logger.warning(f"Could not write recipe pack {pack_path}: {e}")
+    return recipe
+
+
+# ***************************************************** RECIPE CACHE ************************************************************* #
+
+def recipe_nbytes(recipe):
+    """Approximate memory held by a recipe: templates plus the derived data the engine attached to it"""
+    total = 0
+    for roi in recipe.rois:
+        total += roi["template"].nbytes
+        total += sum(level.nbytes for level in roi.get("pyramid", [])[1:])  # level 0 is the template itself
+        if "zero_mean" in roi:
+            total += roi["zero_mean"].nbytes
+    for features in [features for scaled in list(recipe.reference_features.values()) for features in list(scaled.values())]:
+        if features is not None:
+            total += features.thumbnail.nbytes
+            if features.descriptors is not None:
+                total += features.points.nbytes + features.descriptors.nbytes
+    return total
+
+
+class RecipeCache:
+    """LRU cache of loaded recipes keyed by (tp, part_number, position), validated by the recipe fingerprint
+
+    Cached recipes keep whatever the engine derived from them (pyramids, zero-mean templates), so a
+    cache hit skips both the disk load and the preparation. Sizes are re-measured on every access
+    because derived data is attached after the recipe is cached; least recently used recipes are
+    evicted while the total is over budget.
+    """
+    def __init__(self, max_bytes=RECIPE_CACHE_BYTES, data_root=SHARPEYE_DATA):
+        self.max_bytes = max_bytes
+        self.data_root = data_root
+        self._entries = OrderedDict()  # (tp, part_number, position) -> [recipe, nbytes]
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tp, part_number, position):
+        """Return the cached recipe if its profiling files are unchanged, otherwise load and cache it"""
+        validate_recipe_key(tp, part_number, position)
+        key = (tp, part_number, position)
+        fingerprint = recipe_fingerprint(tp, part_number, position, self.data_root)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0].fingerprint == fingerprint:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                entry[1] = recipe_nbytes(entry[0])
+                self._evict()
+                return entry[0]
+            self.misses += 1
+
+        recipe = load_recipe(tp, part_number, position, data_root=self.data_root)
+        self.put(recipe)
+        return recipe
+
+    def put(self, recipe):
+        with self._lock:
+            key = (recipe.tp, recipe.part_number, recipe.position)
+            self._entries[key] = [recipe, recipe_nbytes(recipe)]
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        # The most recent entry always stays, even if it alone is over budget
+        while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+            key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.info(f"Recipe cache evicted {key[0]}_{key[1]}/{key[2]}")
+
+    def invalidate(self, tp=None, part_number=None):
+        """Drop every cached recipe, or only the positions of one TP / P/N"""
+        with self._lock:
+            for key in list(self._entries):
+                if tp is None or key[:2] == (tp, part_number):
+                    del self._entries[key]
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile a profiled recipe into a single pack file")
+    parser.add_argument("tp")
+    parser.add_argument("part_number")
+    parser.add_argument("positions", nargs="+", help='MB positions, e.g. "TOP VIEW"')
+    parser.add_argument("--data-root", default=SHARPEYE_DATA)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for position in args.positions:
+        compile_recipe(args.tp, args.part_number, position, data_root=args.data_root)
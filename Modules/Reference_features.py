@@ -0,0 +1,83 @@
+import os
+import struct
+import logging
+from collections import namedtuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""ORB features of a reference board are stored next to it: Board_image/<TP>_<P/N>_<n>.orb
+(<TP>_<P/N>_<n>_s<scale>.orb for features extracted from a downscaled board)"""
+REFERENCE_FEATURES_SUFFIX = ".orb"
+REFERENCE_FEATURES_MAGIC = b"SEORB002"
+# magic, image size, image mtime (ns), ORB feature budget, image height, image width, keypoints, descriptor bytes,
+# thumbnail height, thumbnail width
+REFERENCE_FEATURES_HEADER = struct.Struct("<8sQqIIIIIII")
+
+"""Features of one reference board: image (height, width), (N, 2) float32 keypoints, (N, 32) uint8 descriptors, uint8 thumbnail"""
+ReferenceFeatures = namedtuple("ReferenceFeatures", ["shape", "points", "descriptors", "thumbnail"])
+
+
+def reference_features_path(image_path, scale=1.0):
+    base = os.path.splitext(image_path)[0]
+    if scale != 1.0:
+        base = f"{base}_s{scale:.2f}"
+    return base + REFERENCE_FEATURES_SUFFIX
+
+
+def save_reference_features(image_path, features, orb_features, scale=1.0):
+    """Write the keypoint coordinates, descriptors and thumbnail of a board image to its .orb file
+
+    The image size and mtime are recorded so the file is ignored once the image is replaced.
+    """
+    stat = os.stat(image_path)
+    descriptors = features.descriptors
+    count = 0 if descriptors is None else len(descriptors)
+    descriptor_size = 0 if descriptors is None else descriptors.shape[1]
+    thumbnail_h, thumbnail_w = features.thumbnail.shape
+    path = reference_features_path(image_path, scale)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(REFERENCE_FEATURES_HEADER.pack(REFERENCE_FEATURES_MAGIC, stat.st_size, stat.st_mtime_ns, orb_features,
+                                               features.shape[0], features.shape[1], count, descriptor_size,
+                                               thumbnail_h, thumbnail_w))
+        if count:
+            f.write(np.ascontiguousarray(features.points, dtype=np.float32).tobytes())
+            f.write(np.ascontiguousarray(descriptors, dtype=np.uint8).tobytes())
+        f.write(np.ascontiguousarray(features.thumbnail, dtype=np.uint8).tobytes())
+    os.replace(temp_path, path)
+    logger.info(f"Saved {count} reference features to {path}")
+    return path
+
+
+def load_reference_features(image_path, orb_features, scale=1.0):
+    """Return the ReferenceFeatures stored in the .orb file of a board image, or None if missing or stale"""
+    path = reference_features_path(image_path, scale)
+    try:
+        stat = os.stat(image_path)
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        magic, size, mtime_ns, features, height, width, count, descriptor_size, thumbnail_h, thumbnail_w = \
+            REFERENCE_FEATURES_HEADER.unpack_from(data)
+    except struct.error:
+        logger.warning(f"Corrupt reference features file {path}")
+        return None
+    if magic != REFERENCE_FEATURES_MAGIC or (size, mtime_ns, features) != (stat.st_size, stat.st_mtime_ns, orb_features):
+        logger.info(f"Reference features {path} are out of date")
+        return None
+
+    offset = REFERENCE_FEATURES_HEADER.size
+    points, descriptors = None, None
+    if count:
+        points = np.frombuffer(data, dtype=np.float32, count=count * 2, offset=offset).reshape(count, 2)
+        offset += points.nbytes
+        descriptors = np.frombuffer(data, dtype=np.uint8, count=count * descriptor_size,
+                                    offset=offset).reshape(count, descriptor_size)
+        offset += descriptors.nbytes
+    thumbnail = np.frombuffer(data, dtype=np.uint8, count=thumbnail_h * thumbnail_w,
+                              offset=offset).reshape(thumbnail_h, thumbnail_w)
+    return ReferenceFeatures((height, width), points, descriptors, thumbnail)
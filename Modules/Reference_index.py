@@ -0,0 +1,53 @@
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""Global board descriptor: a blurred, area-downscaled grayscale thumbnail (width, height)"""
+THUMBNAIL_SIZE = (40, 30)
+
+
+def board_thumbnail(gray, size=THUMBNAIL_SIZE):
+    """Tiny uint8 thumbnail of a board image; area averaging plus a light blur keeps it stable under small shifts"""
+    width, height = size
+    small = cv2.resize(gray, (width * 2, height * 2), interpolation=cv2.INTER_AREA)
+    return cv2.resize(cv2.GaussianBlur(small, (0, 0), 1.0), size, interpolation=cv2.INTER_AREA)
+
+
+def thumbnail_vector(thumbnail):
+    """Zero-mean, unit-norm float32 vector of a thumbnail: dot products are correlation coefficients"""
+    vector = thumbnail.astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class ReferenceIndex:
+    """Short-lists the reference boards most similar to a frame before the expensive ORB matching
+
+    Each board is reduced to one global descriptor (its normalized thumbnail); the frame is compared
+    with every board in one matrix-vector product and only the best few go through ORB + RANSAC.
+    """
+    def __init__(self, thumbnails, keys=None):
+        thumbnails = list(thumbnails)
+        self.keys = list(keys) if keys is not None else list(range(len(thumbnails)))
+        self.size = (thumbnails[0].shape[1], thumbnails[0].shape[0]) if thumbnails else THUMBNAIL_SIZE
+        self._vectors = (np.stack([thumbnail_vector(thumbnail) for thumbnail in thumbnails])
+                         if thumbnails else np.zeros((0, self.size[0] * self.size[1]), np.float32))
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def similarities(self, frame_gray):
+        return self._vectors @ thumbnail_vector(board_thumbnail(frame_gray, self.size))
+
+    def shortlist(self, frame_gray, count):
+        """Keys of the `count` boards most similar to the frame, best first"""
+        if not len(self):
+            return []
+        if count <= 0 or count >= len(self):
+            count = len(self)
+        similarities = self.similarities(frame_gray)
+        best = np.argpartition(-similarities, count - 1)[:count] if count < len(self) else np.arange(len(self))
+        return [self.keys[index] for index in best[np.argsort(-similarities[best])]]
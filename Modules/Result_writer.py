@@ -0,0 +1,152 @@
+import os
+import logging
+import pyodbc
+import cv2
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image as ExcelImage
+from PIL import Image as PILImage
+from Modules.Pipeline import Pipeline
+
+logger = logging.getLogger(__name__)
+
+"""SQL Server the inspection results are inserted into (TBL_PER_LOC)"""
+DB_DRIVER = '{ODBC Driver 18 for SQL Server}'
+DB_SERVER = '192.168.1.152,1433\\SQLEXPRESS'
+DB_DATABASE = 'SharpeyeWeb'
+DB_USERNAME = "CBE_QAS"
+DB_PASSWORD = "cre100"
+DB_TRUST_CERTIFICATE = 'Yes'
+DB_CONNECTION_TIMEOUT = '30'
+
+RESULT_IMAGE_PATH = "/home/nvidia/SHARPEYE_DATA/Result_images"
+RESULT_EXCEL_PATH = "/home/nvidia/SHARPEYE_DATA/Excel_data"
+
+"""Worker threads and queue size (boards waiting) of each result stage"""
+RESULT_STAGES = {
+    "db_insert": {"workers": 1, "queue_size": 8},
+    "png_save": {"workers": 1, "queue_size": 8},
+    "excel_export": {"workers": 1, "queue_size": 8},
+}
+
+EXCEL_HEADERS = ["Serial_number", "Model", "Part_number", "Item_detected", "Status", "MB_position", "Date_saved"]
+
+
+class ResultWriter:
+    """Persists finished inspections in the background: DB insert, and PNG save followed by the Excel export
+
+    A job is one inspected board: a dict with "tp", "part_number", "detections" (the
+    (label, tp, part_number, roi_filename, status, mb_position) rows), "view" (the last annotated
+    frame, not modified afterwards) and "datetime_saved", plus the inspected board's "serial" when known
+    (it prefixes the file names, so boards of the same TP / P/N saved in the same second never collide).
+    The DB insert and the PNG save run in parallel; the Excel export needs the saved PNG for its
+    thumbnail, so it follows the PNG stage.
+    submit() returns as soon as the job is queued, so a slow SQL insert or Excel write does not hold
+    back the next board; it only blocks when a stage already has queue_size boards waiting.
+
+    notify(kind, title, message) is called from the worker threads to report to the operator; the
+    UI passes a callback that hands the message box over to the Tk thread.
+    """
+    def __init__(self, notify=None, stages=RESULT_STAGES, image_path=RESULT_IMAGE_PATH, excel_path=RESULT_EXCEL_PATH):
+        self.notify = notify
+        self.image_path = image_path
+        self.excel_path = excel_path
+        self.pipeline = Pipeline("results")
+        self.pipeline.add_stage("db_insert", self._insert, **stages["db_insert"])
+        self.pipeline.add_stage("png_save", self._save_png, **stages["png_save"])
+        self.pipeline.add_stage("excel_export", self._export_excel, after="png_save", **stages["excel_export"])
+        self.pipeline.start()
+
+    def submit(self, job):
+        """Queue a finished board for the DB insert, PNG save and Excel export"""
+        self.pipeline.submit("db_insert", job)
+        self.pipeline.submit("png_save", job)
+
+    def _notify(self, kind, title, message):
+        if self.notify is not None:
+            self.notify(kind, title, message)
+
+    def _insert(self, job):
+        detections = job["detections"]
+        try:
+            conn = pyodbc.connect(
+                f'DRIVER={DB_DRIVER};SERVER={DB_SERVER};DATABASE={DB_DATABASE};UID={DB_USERNAME};PWD={DB_PASSWORD};'
+                f'TrustServerCertificate={DB_TRUST_CERTIFICATE};Connection timeout={DB_CONNECTION_TIMEOUT};'
+            )
+            cursor = conn.cursor()
+            for label, tp_val, part_number, roi_filename, detection_status, mb_pos in detections:
+                cursor.execute("""
+                    INSERT INTO TBL_PER_LOC (Serial_number, Model, Part_number, Item_detected, Status, MB_position, Date_saved)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (label, tp_val, part_number, roi_filename, detection_status, mb_pos, job["datetime_saved"]))
+            conn.commit()
+            cursor.close()
+            conn.close()
+            self._notify("info", "Info", "Saved Data Successfully!")
+            logger.info(f"Saved {len(detections)} detection results to DB{self._for_serial(job)}.")
+        except Exception as e:
+            logger.error(f"Failed to save to DB: {e}")
+        return None
+
+    @staticmethod
+    def _file_stem(job):
+        serial = f"{job['serial']}_" if job.get("serial") else ""
+        return f"{serial}{job['tp']}_{job['part_number']}"
+
+    @staticmethod
+    def _for_serial(job):
+        return f" for serial {job['serial']}" if job.get("serial") else ""
+
+    def _save_png(self, job):
+        os.makedirs(self.image_path, exist_ok=True)
+        output_path = f"{self.image_path}/{self._file_stem(job)}_{job['datetime_saved']}.png"
+        if not cv2.imwrite(output_path, job["view"]):
+            logger.error(f"Failed to save annotated frame to {output_path}")
+            return None
+        logger.info(f"Saved final annotated frame to {output_path}")
+        return dict(job, image_path=output_path)
+
+    def _export_excel(self, job):
+        os.makedirs(self.excel_path, exist_ok=True)
+        # One thumbnail per board, so exports of consecutive boards never share a temporary file
+        thumbnail_path = f"{os.path.splitext(job['image_path'])[0]}_thumb.png"
+        try:
+            wb = Workbook()
+            ws = wb.active
+            ws.title = "Detection Results"
+            ws.append(EXCEL_HEADERS)
+            for col in range(1, 8):
+                ws.column_dimensions[chr(64 + col)].width = 30
+
+            # Resize last annotated image for Excel
+            pil_img = PILImage.open(job["image_path"])
+            pil_img.thumbnail((100, 100), PILImage.LANCZOS)
+            pil_img.save(thumbnail_path, format="PNG")
+
+            for idx, row in enumerate(job["detections"], start=2):
+                for col, value in enumerate(row, start=1):
+                    ws.cell(row=idx, column=col).value = value
+                ws.cell(row=idx, column=7).value = job["datetime_saved"]
+                ws.add_image(ExcelImage(thumbnail_path), f"H{idx}")
+                ws.row_dimensions[idx].height = 80
+
+            excel_path = f"{self.excel_path}/{self._file_stem(job)}_Results_{job['datetime_saved']}.xlsx"
+            wb.save(excel_path)
+            wb.close()
+            logger.info(f"Saved to Excel: {excel_path}")
+
+            # Optional FTP upload (uncomment if needed)
+            # def save_to_ftp(...): ...  # Paste the function here if using
+            # save_to_ftp(excel_path, "192.168.1.152", "share", "share", "/josh/Excel_data_SE")
+        except Exception as e:
+            logger.error(f"Failed to save to Excel: {e}")
+        finally:
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+        return None
+
+    def close(self):
+        """Finish every queued board, then stop the workers"""
+        self.pipeline.close()
+
+    def stats(self):
+        return self.pipeline.stats()
@@ -5,6 +5,7 @@ from tkinter import messagebox
 import subprocess
 import time
 import re
+from Modules.Frame_grabber import FrameGrabber
 
 class CameraDisplay:
     def __init__(self, root, canvas, screen_width, screen_height):
@@ -16,7 +17,8 @@ class CameraDisplay:
         self.running = False
         self.is_annotating = False
         self.current_frame = None
-        self.cap = None
+        self.grabber = None  # FrameGrabber owning the VideoCapture, shared with the live inspection loop
+        self._frame_sequence = 0
 
         # GStreamer pipeline
         self.pipeline = (
@@ -32,10 +34,12 @@ class CameraDisplay:
 
     # Rest of the class methods (initialize_capture, display_frame, etc.) remain unchanged
     def initialize_capture(self):
-        if self.cap is not None:
-            self.cap.release()
-        self.cap = cv2.VideoCapture(self.pipeline, cv2.CAP_GSTREAMER)
-        if not self.cap.isOpened():
+        if self.grabber is not None:
+            self.grabber.stop()
+        self.grabber = FrameGrabber(self.pipeline, cv2.CAP_GSTREAMER)
+        self._frame_sequence = 0
+        if not self.grabber.start():
+            self.grabber = None
             error_msg = (
                 f"Error: Could not open device {self.DEVICE_PATH}. "
                 "Device may be busy or pipeline is incorrect.\n"
@@ -98,20 +102,36 @@ class CameraDisplay:
     def update_video(self):
         if not self.running or self.is_annotating:
             return
-        ret, frame = self.cap.read()
-        if not ret:
+        if not self.grabber.running:
             print("Error: Failed to capture frame.")
             self.hide_video()
             return
-        self.current_frame = frame
-        self.display_frame(frame)
+        # Only the newest frame is shown; frames that arrived in between are skipped by the grabber
+        frame, sequence = self.grabber.read(after=self._frame_sequence, timeout=0.0)
+        if frame is not None:
+            self._frame_sequence = sequence
+            self.current_frame = frame
+            self.display_frame(frame)
         self.root.after(33, self.update_video)
 
+    def ensure_capture(self):
+        """Return the running frame grabber, (re)opening the capture if needed, or None"""
+        if self.grabber is None or not self.grabber.running:
+            if not self.initialize_capture():
+                return None
+        return self.grabber
+
+    def release_capture(self):
+        """Stop the grabber opened by ensure_capture(), unless the video display is showing it"""
+        if not self.running and self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
+
     def hide_video(self):
         self.running = False
-        if self.cap is not None:
-            self.cap.release()
-            self.cap = None
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
         self.canvas.delete("all")
         print("Video live viewing is hidden.")
 
@@ -122,5 +142,5 @@ class CameraDisplay:
             self.update_video()
 
     def __del__(self):
-        if hasattr(self, 'cap') and self.cap is not None:
-            self.cap.release()
\ No newline at end of file
+        if getattr(self, 'grabber', None) is not None:
+            self.grabber.stop()
\ No newline at end of file
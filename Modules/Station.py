@@ -0,0 +1,190 @@
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime
+import cv2
+from PIL import Image
+from Modules.Pipeline import Pipeline
+from Modules.Inspection_engine import InspectionEngine
+from Modules.Live_session import draw_detection
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_IMAGES_PATH = "/home/nvidia/SHARPEYE_DATA/Captured_images"
+
+"""Worker threads and queue size (boards waiting) of each station stage"""
+STATION_STAGES = {
+    "capture": {"workers": 1, "queue_size": 1},
+    "decode": {"workers": 1, "queue_size": 2},
+    "inspection": {"workers": 1, "queue_size": 2},
+}
+
+
+class InspectionStation:
+    """Pipelined station mode: capture -> decode -> inspection, then the ResultWriter
+
+    Each board is a dict created by submit() with its serial, TP, P/N and MB position; every stage
+    adds to that same dict (photo path, decoded frame, result), so the result is always persisted
+    under the serial it was captured for, whatever the other boards in flight are doing.
+
+    The camera photographs whatever lies under it, so only one board may wait for or be in its
+    capture: submit() refuses the next board until the previous photo is taken (`capturing`), which
+    is when the operator can swap boards. From then on the board is decoded, inspected and saved
+    while the next one is already being captured.
+
+    The station has its own engine, used only by the inspection stage: its current recipe and
+    prepared templates are swapped there, never under the UI's engine, and the homographies of the
+    DSLR photos are cached apart from those of the live camera. Photos are resized to the size of
+    the recipe's reference boards first, since profiling saves boards and ROIs at the canvas-resized
+    scale of the captured image and every annotation is in that scale.
+
+    on_event(board, event) is called from the worker threads ("captured", "inspected", "failed").
+    """
+    def __init__(self, camera, result_writer, engine=None, on_event=None, output_dir=CAPTURED_IMAGES_PATH,
+                 stages=STATION_STAGES):
+        self.camera = camera
+        self.engine = engine if engine is not None else InspectionEngine(station=f"{socket.gethostname()}_station")
+        self.result_writer = result_writer
+        self.on_event = on_event
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._board_sizes = {}  # reference board image path -> (width, height)
+        self.capturing = None  # serial of the board waiting for or in capture
+        self.in_flight = 0  # boards submitted and not yet handed to the result writer
+        self.boards = 0
+        self.failures = 0
+        self._started = None
+        self.pipeline = Pipeline("station")
+        self.pipeline.add_stage("capture", self._capture, **stages["capture"])
+        self.pipeline.add_stage("decode", self._decode, after="capture", **stages["decode"])
+        self.pipeline.add_stage("inspection", self._inspect, after="decode", **stages["inspection"])
+        self.pipeline.start()
+
+    @property
+    def busy(self):
+        return self.in_flight > 0
+
+    def submit(self, serial, tp, part_number, position):
+        """Queue a board for capture, returns False while the previous board is still being captured"""
+        with self._lock:
+            if self.capturing is not None:
+                logger.warning(f"Board {serial} refused: board {self.capturing} is still being captured")
+                return False
+            self.capturing = serial
+            self.in_flight += 1
+            if self._started is None:
+                self._started = time.perf_counter()
+        board = {"serial": serial, "tp": tp, "part_number": part_number, "position": position,
+                 "submitted": time.perf_counter()}
+        # The recipe is loaded and prepared while the photo is taken
+        self.engine.prefetch(tp, part_number, [position])
+        self.pipeline.submit("capture", board)
+        logger.info(f"Board {serial} ({tp} {part_number}, {position}) queued for capture")
+        return True
+
+    def _event(self, board, event):
+        if self.on_event is not None:
+            self.on_event(board, event)
+
+    def _fail(self, board, reason):
+        logger.error(f"Board {board['serial']}: {reason}")
+        board["error"] = reason
+        with self._lock:
+            self.in_flight -= 1
+            self.failures += 1
+        self._event(board, "failed")
+        return None
+
+    def _capture(self, board):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # The serial in the file name ties the photo to its board, not the newest file in the folder
+        output_file = os.path.join(self.output_dir, f"{board['serial']}_{timestamp}.jpg")
+        try:
+            board["image_path"] = self.camera.capture_to(output_file)
+        finally:
+            with self._lock:
+                self.capturing = None
+        if board["image_path"] is None:
+            return self._fail(board, "capture failed")
+        board["captured"] = time.perf_counter()
+        self._event(board, "captured")
+        return board
+
+    def _decode(self, board):
+        board["frame"] = cv2.imread(board["image_path"])
+        if board["frame"] is None:
+            return self._fail(board, f"could not decode {board['image_path']}")
+        return board
+
+    def _profile_size(self, recipe):
+        """(width, height) the recipe was profiled at: the size of its first reference board image"""
+        if not recipe.board_images:
+            return None
+        path = recipe.board_images[0]
+        if path not in self._board_sizes:
+            with Image.open(path) as image:
+                self._board_sizes[path] = image.size
+        return self._board_sizes[path]
+
+    def _inspect(self, board):
+        try:
+            recipe = self.engine.load_recipe(board["tp"], board["part_number"], board["position"])
+            frame = board.pop("frame")
+            size = self._profile_size(recipe)
+            if size is None:
+                logger.warning(f"Board {board['serial']}: no reference board, inspecting the photo at full resolution")
+            elif (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            result = self.engine.inspect(frame)
+        except Exception as e:
+            return self._fail(board, f"inspection failed: {e}")
+
+        try:
+            view = result.aligned_frame.copy()
+            detections = [detection for detection in result.detections if detection["detected"]]
+            for detection in detections:
+                draw_detection(view, detection["corners"], detection["folder_type"], detection["label"])
+            # Rows are saved under the board's serial, the detection label is only drawn
+            rows = [(board["serial"], board["tp"], board["part_number"], detection["name"], detection["folder_type"],
+                     board["position"]) for detection in detections]
+            board["detected"] = len(detections)
+            board["rois"] = len(result.detections)
+            if rows:
+                self.result_writer.submit({
+                    "serial": board["serial"],
+                    "tp": board["tp"],
+                    "part_number": board["part_number"],
+                    "detections": rows,
+                    "view": view,
+                    "datetime_saved": datetime.now().strftime("%Y-%m-%d_%H:%M:%S"),
+                })
+            else:
+                logger.info(f"Board {board['serial']}: no detections")
+        except Exception as e:
+            return self._fail(board, f"saving the results failed: {e}")
+        board["inspected"] = time.perf_counter()
+        with self._lock:
+            self.in_flight -= 1
+            self.boards += 1
+        logger.info(f"Board {board['serial']}: {board['detected']}/{board['rois']} ROIs detected, "
+                    f"capture {(board['captured'] - board['submitted']) * 1000:.0f} ms, "
+                    f"total {(board['inspected'] - board['submitted']) * 1000:.0f} ms")
+        self._event(board, "inspected")
+        return None
+
+    def close(self):
+        """Finish the boards in flight, then stop the workers and the station's engine"""
+        self.pipeline.close()
+        self.engine.close()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "boards": self.boards,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "boards_per_hour": self.boards * 3600 / elapsed if elapsed else 0.0,
+            "stages": self.pipeline.stats(),
+        }
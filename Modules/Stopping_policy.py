@@ -0,0 +1,88 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""Stopping policies selectable with the "stopping_policy" recipe setting"""
+STOPPING_POLICIES = ["fixed", "stable_scores"]
+
+
+class StoppingPolicy:
+    """Decides when a live session has seen enough; should_stop() returns why it should end, or None
+
+    Every policy ends the session once every loaded ROI location is confirmed, after max_frames
+    frames or after max_seconds (0 = no time budget); subclasses add their own criterion in
+    _should_stop(). should_stop() is called once per live frame.
+    """
+    def __init__(self, max_frames=300, max_seconds=0.0):
+        self.max_frames = max_frames
+        self.max_seconds = max_seconds
+
+    def should_stop(self, session):
+        if session.complete:
+            return f"all {len(session.locations)} ROI locations detected"
+        if session.frames >= self.max_frames:
+            return f"max frames ({self.max_frames}) reached"
+        if self.max_seconds > 0 and session.elapsed >= self.max_seconds:
+            return f"time budget ({self.max_seconds:.1f} s) spent"
+        return self._should_stop(session)
+
+    def _should_stop(self, session):
+        return None
+
+
+class FixedStoppingPolicy(StoppingPolicy):
+    """The original rule: stop after no_new_rounds matching rounds without a new detection"""
+    def __init__(self, no_new_rounds=30, **kwargs):
+        super().__init__(**kwargs)
+        self.no_new_rounds = no_new_rounds
+
+    def _should_stop(self, session):
+        if session.rounds_without_new >= self.no_new_rounds:
+            return f"no new detection for {session.rounds_without_new} rounds"
+        return None
+
+
+class StableScoresPolicy(StoppingPolicy):
+    """Stop once the per-ROI scores have been stable for stable_frames frames
+
+    Scores are compared with the snapshot taken at the last change, so a slow drift still counts
+    as a change. Any new detection, loss, or ROI scored for the first time starts the count again,
+    and nothing is counted before every pending ROI was matched once (the first full round).
+    """
+    def __init__(self, stable_frames=30, score_tolerance=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.stable_frames = stable_frames
+        self.score_tolerance = score_tolerance
+        self._snapshot = None
+        self._tracked = None
+        self.stable = 0  # frames since the last score change
+
+    def _changed(self, session):
+        scores = session.scores
+        if self._snapshot is None or self._tracked != set(session.trackers) or scores.keys() != self._snapshot.keys():
+            return True
+        return any(abs(score - self._snapshot[index]) > self.score_tolerance for index, score in scores.items())
+
+    def _should_stop(self, session):
+        if session.rounds < 1:
+            return None
+        if self._changed(session):
+            self._snapshot = dict(session.scores)
+            self._tracked = set(session.trackers)
+            self.stable = 0
+            return None
+        self.stable += 1
+        if self.stable >= self.stable_frames:
+            return f"ROI scores stable for {self.stable} frames"
+        return None
+
+
+def create_stopping_policy(settings):
+    """Stopping policy of a recipe from its "stopping_policy" settings"""
+    name = settings["stopping_policy"]
+    limits = dict(max_frames=settings["session_max_frames"], max_seconds=settings["session_budget_s"])
+    if name == "fixed":
+        return FixedStoppingPolicy(**limits)
+    if name == "stable_scores":
+        return StableScoresPolicy(settings["stable_frames"], settings["score_tolerance"], **limits)
+    raise ValueError(f"Unknown stopping policy {name!r}, expected one of {STOPPING_POLICIES}")
@@ -0,0 +1,171 @@
+import logging
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""Smallest template side (in pixels) kept on a pyramid level"""
+MIN_PYRAMID_TEMPLATE_SIDE = 8
+
+"""Flat windows (no texture) have no defined correlation, treat them as no match"""
+FLAT_WINDOW_EPSILON = 1e-3
+
+
+# ******************* Shared frame statistics ************************ #
+
+def zero_mean_template(template):
+    """Return the float32 zero-mean template and its L2 norm (the template side of TM_CCOEFF_NORMED)"""
+    zero_mean = template.astype(np.float32) - np.float32(template.mean())
+    return zero_mean, float(np.sqrt(np.sum(zero_mean.astype(np.float64) ** 2)))
+
+
+class FrameStatistics:
+    """Integral images of one frame, built once and reused for the window statistics of every template size
+
+    The TM_CCOEFF_NORMED denominator only depends on the frame and the template size:
+    sqrt(sum(I^2) - sum(I)^2 / N) over each window. Templates of the same size share one map, so
+    callers should visit templates grouped by size; only the last few maps are kept in memory.
+    """
+    def __init__(self, frame_gray, max_cached_sizes=4):
+        self.shape = frame_gray.shape[:2]
+        self.sum, self.sq_sum = cv2.integral2(frame_gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        self.max_cached_sizes = max_cached_sizes
+        self._denominators = OrderedDict()
+
+    def window_sums(self, template_shape):
+        """Sum and squared sum of every valid window of the given (height, width)"""
+        template_h, template_w = template_shape[:2]
+        valid_h, valid_w = self.shape[0] - template_h + 1, self.shape[1] - template_w + 1
+        sums = []
+        for integral in (self.sum, self.sq_sum):
+            sums.append(cv2.add(cv2.subtract(integral[template_h:template_h + valid_h, template_w:template_w + valid_w],
+                                             integral[:valid_h, template_w:template_w + valid_w]),
+                                cv2.subtract(integral[:valid_h, :valid_w],
+                                             integral[template_h:template_h + valid_h, :valid_w])))
+        return sums
+
+    def denominator(self, template_shape):
+        """sqrt(sum(I^2) - sum(I)^2 / N) over every valid window of the given template size"""
+        key = tuple(template_shape[:2])
+        denominator = self._denominators.get(key)
+        if denominator is not None:
+            self._denominators.move_to_end(key)
+            return denominator
+
+        window_sum, window_sq_sum = self.window_sums(key)
+        variance = cv2.subtract(window_sq_sum, cv2.multiply(window_sum, window_sum, scale=1.0 / (key[0] * key[1])))
+        denominator = cv2.sqrt(np.maximum(variance, 0).astype(np.float32))
+        self._denominators[key] = denominator
+        while len(self._denominators) > self.max_cached_sizes:
+            self._denominators.popitem(last=False)
+        return denominator
+
+
+def normalize_ccoeff(numerator, denominator, template_norm):
+    """Combine a zero-mean cross-correlation with the cached window statistics into TM_CCOEFF_NORMED scores"""
+    scale = denominator * np.float32(template_norm)
+    flat = scale < FLAT_WINDOW_EPSILON * max(template_norm, 1.0)
+    scores = numerator / np.where(flat, np.float32(1.0), scale)
+    scores[flat] = 0
+    return np.clip(scores, -1.0, 1.0, out=scores)
+
+
+def shared_statistics_match(frame_float, statistics, zero_mean, template_norm):
+    """TM_CCOEFF_NORMED from a numerator-only correlation (TM_CCORR) plus the shared frame statistics"""
+    numerator = cv2.matchTemplate(frame_float, zero_mean, cv2.TM_CCORR)
+    scores = normalize_ccoeff(numerator, statistics.denominator(zero_mean.shape), template_norm)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(scores)
+    return max_val, max_loc
+
+
+# ******************* Search-window (localized) matching ************************ #
+
+def local_match(frame_gray, template, annotation, margin):
+    """Match a template only around its profiled position (image_x / image_y) plus a margin"""
+    template_h, template_w = template.shape[:2]
+    x = int(round(float(annotation['image_x'])))
+    y = int(round(float(annotation['image_y'])))
+    return match_in_window(frame_gray, template, x - margin, y - margin,
+                           x + template_w + margin, y + template_h + margin)
+
+
+# ******************* Pyramid (coarse-to-fine) matching ************************ #
+
+def pyramid_levels_for(template_shape, max_levels):
+    """Number of pyramid levels a template can go down before it gets too small to match"""
+    height, width = template_shape[:2]
+    levels = 0
+    while levels < max_levels and min(height, width) >> (levels + 1) >= MIN_PYRAMID_TEMPLATE_SIDE:
+        levels += 1
+    return levels
+
+
+def build_pyramid(gray, levels):
+    """Return [full resolution, 1/2, 1/4, ...] copies of a grayscale image"""
+    pyramid = [gray]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def top_peaks(result, count, suppress_size):
+    """Return up to `count` (score, (x, y)) peaks of a match result with non-maximum suppression"""
+    result = result.copy()
+    suppress_w, suppress_h = suppress_size
+    peaks = []
+    for _ in range(count):
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        if peaks and max_val <= -1:
+            break
+        peaks.append((max_val, max_loc))
+        x, y = max_loc
+        result[max(0, y - suppress_h):y + suppress_h + 1, max(0, x - suppress_w):x + suppress_w + 1] = -1
+    return peaks
+
+
+def match_in_window(frame_gray, template, x0, y0, x1, y1):
+    """Match a template inside frame_gray[y0:y1, x0:x1] and return (score, (x, y)) in frame coordinates"""
+    template_h, template_w = template.shape[:2]
+    frame_h, frame_w = frame_gray.shape[:2]
+
+    # Grow the window if it is smaller than the template and keep it inside the frame
+    x0 = max(0, min(x0, frame_w - template_w))
+    y0 = max(0, min(y0, frame_h - template_h))
+    x1 = min(frame_w, max(x1, x0 + template_w))
+    y1 = min(frame_h, max(y1, y0 + template_h))
+
+    result = cv2.matchTemplate(frame_gray[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+    return max_val, (max_loc[0] + x0, max_loc[1] + y0)
+
+
+def pyramid_match(frame_pyramid, template_pyramid, candidates=3):
+    """Find candidate peaks on the coarsest level, then refine small windows around them at full resolution"""
+    level = min(len(template_pyramid), len(frame_pyramid)) - 1
+    frame_gray = frame_pyramid[0]
+    template = template_pyramid[0]
+
+    if level == 0:
+        result = cv2.matchTemplate(frame_gray, template, cv2.TM_CCOEFF_NORMED)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    coarse_template = template_pyramid[level]
+    coarse_result = cv2.matchTemplate(frame_pyramid[level], coarse_template, cv2.TM_CCOEFF_NORMED)
+    coarse_h, coarse_w = coarse_template.shape[:2]
+    peaks = top_peaks(coarse_result, candidates, (max(1, coarse_w // 2), max(1, coarse_h // 2)))
+
+    # A coarse pixel covers 2**level full resolution pixels, pyrDown blurring adds roughly as much again
+    scale = 1 << level
+    margin = 2 * scale
+    template_h, template_w = template.shape[:2]
+
+    best_val, best_loc = -1.0, (0, 0)
+    for coarse_val, (cx, cy) in peaks:
+        x, y = cx * scale, cy * scale
+        val, loc = match_in_window(frame_gray, template, x - margin, y - margin,
+                                   x + template_w + margin, y + template_h + margin)
+        if val > best_val:
+            best_val, best_loc = val, loc
+    return best_val, best_loc
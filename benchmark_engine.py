@@ -0,0 +1,378 @@
+import os
+import argparse
+import tempfile
+import time
+import cv2
+import numpy as np
+from Modules.Fft_matching import FftBatchMatcher
+from Modules.Reference_index import ReferenceIndex, board_thumbnail
+from Modules.Inspection_engine import InspectionEngine
+from Modules.Feature_matching import FEATURE_MATCHERS, FeatureMatcher, match_descriptors
+from Modules.Recipe_store import Recipe
+from Modules.Alignment import corner_error, homography_from_matches
+from Modules.Live_session import LiveSession
+from Modules.Stopping_policy import STOPPING_POLICIES, create_stopping_policy
+
+"""Benchmarks for the inspection engine, run headless: python benchmark_engine.py <benchmark> [options]"""
+
+
+def synthetic_board(width=1920, height=1080, seed=0):
+    """Textured grayscale board with label-like blocks, stands in for a captured mainboard"""
+    rng = np.random.default_rng(seed)
+    board = cv2.GaussianBlur(rng.integers(0, 255, (height, width), dtype=np.uint8), (0, 0), 3)
+    for i in range(80):
+        x, y = int(rng.integers(0, width - 120)), int(rng.integers(0, height - 80))
+        w, h = int(rng.integers(20, 120)), int(rng.integers(20, 80))
+        cv2.rectangle(board, (x, y), (x + w, y + h), int(rng.integers(0, 255)), -1)
+        cv2.putText(board, f"L{i}", (x, y + h // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 255, 2)
+    return board
+
+
+def crop_templates(board, size, count, seed=1):
+    rng = np.random.default_rng(seed)
+    height, width = board.shape
+    template_w, template_h = size
+    templates = []
+    for _ in range(count):
+        x, y = int(rng.integers(0, width - template_w)), int(rng.integers(0, height - template_h))
+        templates.append(board[y:y + template_h, x:x + template_w].copy())
+    return templates
+
+
+# ******************* FFT batched matching vs cv2.matchTemplate ************************ #
+
+def bench_fft(args):
+    board = synthetic_board(args.width, args.height)
+    print(f"Frame {args.width}x{args.height}, cv2 threads: {cv2.getNumThreads()}")
+    print(f"{'template':>10} {'count':>6} {'cv2 ms':>10} {'fft cold ms':>12} {'fft warm ms':>12} {'speedup':>8} {'max |diff|':>11} {'same peak':>10}")
+
+    for size in args.sizes:
+        template_w, template_h = (int(v) for v in size.split("x"))
+        for count in args.counts:
+            templates = crop_templates(board, (template_w, template_h), count)
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                reference = [cv2.matchTemplate(board, template, cv2.TM_CCOEFF_NORMED) for template in templates]
+            cv2_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+            matcher = FftBatchMatcher(templates, batch_size=args.batch_size)
+            start = time.perf_counter()
+            matcher.set_frame(board)
+            maps = dict(matcher.correlation_maps(range(count)))
+            cold_ms = (time.perf_counter() - start) * 1000
+
+            # Template spectra are cached after the first frame, as in a live session
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                matcher.set_frame(board)
+                results = matcher.match()
+            warm_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+            # Compare scores where the window has texture (local std above 1 gray level), flat windows are ill-conditioned for both
+            textured = matcher.window_denominator((template_h, template_w)) > np.sqrt(template_w * template_h)
+            max_diff = max(float(np.abs(maps[i] - reference[i])[textured].max()) for i in range(count))
+            same_peak = all(results[i][1] == cv2.minMaxLoc(reference[i])[3] for i in range(count))
+            print(f"{size:>10} {count:>6} {cv2_ms:>10.1f} {cold_ms:>12.1f} {warm_ms:>12.1f} {cv2_ms / warm_ms:>7.2f}x {max_diff:>11.2e} {str(same_peak):>10}")
+
+
+# ******************* Reference board short-listing ************************ #
+
+def perturb(board, seed):
+    """Same board as captured again: small shift, brightness change and sensor noise"""
+    rng = np.random.default_rng(seed)
+    shift = np.float32([[1, 0, rng.uniform(-8, 8)], [0, 1, rng.uniform(-8, 8)]])
+    moved = cv2.warpAffine(board, shift, (board.shape[1], board.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+    noisy = moved.astype(np.float32) * rng.uniform(0.8, 1.2) + rng.normal(0, 6, board.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def bench_reference_index(args):
+    print(f"Boards {args.width}x{args.height}, short-list {args.shortlist}, {args.queries} queries per bank")
+    print(f"{'boards':>7} {'thumbs ms':>10} {'index ms':>9} {'select us':>10} {'top-1':>6} {'top-k':>6} {'ORB all ms':>11} {'ORB top-k ms':>13}")
+
+    orb = cv2.ORB_create(nfeatures=5000)
+    boards = [synthetic_board(args.width, args.height, seed=seed) for seed in range(max(args.banks))]
+    for bank in args.banks:
+        start = time.perf_counter()
+        thumbnails = [board_thumbnail(board) for board in boards[:bank]]
+        thumbs_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        index = ReferenceIndex(thumbnails)
+        index_ms = (time.perf_counter() - start) * 1000
+
+        rng = np.random.default_rng(bank)
+        targets = rng.integers(0, bank, args.queries)
+        queries = [perturb(boards[target], seed) for seed, target in enumerate(targets)]
+        select_s, top1, topk = 0.0, 0, 0
+        for target, query in zip(targets, queries):
+            start = time.perf_counter()
+            shortlist = index.shortlist(query, args.shortlist)
+            select_s += time.perf_counter() - start
+            top1 += shortlist[0] == target
+            topk += target in shortlist
+
+        # ORB matching cost per board, measured on a few boards and scaled to the bank
+        query_descriptors = orb.detectAndCompute(queries[0], None)[1]
+        sample = [orb.detectAndCompute(board, None)[1] for board in boards[:min(bank, 5)]]
+        start = time.perf_counter()
+        for descriptors in sample:
+            match_descriptors(descriptors, query_descriptors)
+        per_board_ms = (time.perf_counter() - start) * 1000 / len(sample)
+
+        print(f"{bank:>7} {thumbs_ms:>10.1f} {index_ms:>9.2f} {select_s * 1e6 / args.queries:>10.0f} "
+              f"{top1 / args.queries:>6.0%} {topk / args.queries:>6.0%} {per_board_ms * bank:>11.1f} "
+              f"{per_board_ms * min(bank, args.shortlist):>13.1f}")
+
+
+# ******************* Reduced-resolution alignment ************************ #
+
+def random_homography(width, height, rng, shift=20, corner_jitter=12):
+    """Board-to-frame homography of a board re-seated in the jig: small shift plus slight perspective"""
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    offset = rng.uniform(-shift, shift, 2)
+    moved = corners + offset + rng.uniform(-corner_jitter, corner_jitter, corners.shape)
+    return cv2.getPerspectiveTransform(corners, moved.astype(np.float32))
+
+
+def bench_alignment(args):
+    board = synthetic_board(args.width, args.height)
+    rng = np.random.default_rng(0)
+    test_set = []
+    for seed in range(args.frames):
+        board_to_frame = random_homography(args.width, args.height, rng)
+        frame = cv2.warpPerspective(board, board_to_frame, (args.width, args.height), borderMode=cv2.BORDER_REPLICATE)
+        noisy = np.clip(frame + rng.normal(0, 4, frame.shape), 0, 255).astype(np.uint8)
+        test_set.append((noisy, np.linalg.inv(board_to_frame)))
+
+    with tempfile.TemporaryDirectory() as data_root:
+        board_path = os.path.join(data_root, "board.png")
+        cv2.imwrite(board_path, board)
+        engine = InspectionEngine(data_root=data_root, num_threads=args.threads)
+        recipe = Recipe("BENCH", "BENCH", "TOP VIEW")
+        recipe.board_images = [board_path]
+        engine.set_recipe(recipe)
+
+        print(f"Frames {args.width}x{args.height}, {args.frames} test frames, error = mean corner distance in pixels")
+        print(f"{'scale':>6} {'refine':>7} {'ms / frame':>11} {'vs truth px':>12} {'max px':>8} {'vs full-res px':>15}")
+        full_resolution = None
+        for scale in args.scales:
+            for refine in ([False, True] if args.refine else [False]):
+                recipe.settings.update({"alignment_scale": scale, "alignment_refine": refine})
+                engine.reference_features(recipe)  # reference features are extracted once per scale, as in production
+
+                elapsed, homographies = 0.0, []
+                for frame, _ in test_set:
+                    start = time.perf_counter()
+                    homographies.append(engine.compute_homography(frame, use_cache=False))
+                    elapsed += time.perf_counter() - start
+                if full_resolution is None:
+                    full_resolution = homographies
+
+                errors = [corner_error(h, truth, board.shape) if h is not None else float("inf")
+                          for h, (_, truth) in zip(homographies, test_set)]
+                vs_full = [corner_error(h, f, board.shape) if h is not None and f is not None else float("inf")
+                           for h, f in zip(homographies, full_resolution)]
+                print(f"{scale:>6.2f} {str(refine):>7} {elapsed * 1000 / len(test_set):>11.1f} {np.mean(errors):>12.2f} "
+                      f"{np.max(errors):>8.2f} {np.mean(vs_full):>15.2f}")
+        engine.close()
+
+
+# ******************* Descriptor matchers ************************ #
+
+def bench_matcher(args):
+    board = synthetic_board(args.width, args.height)
+    orb = cv2.ORB_create(nfeatures=args.features)
+    reference_points, reference_descriptors = orb.detectAndCompute(board, None)
+    reference_points = np.float32([kp.pt for kp in reference_points])
+
+    rng = np.random.default_rng(0)
+    test_set = []
+    for _ in range(args.frames):
+        board_to_frame = random_homography(args.width, args.height, rng)
+        frame = cv2.warpPerspective(board, board_to_frame, (args.width, args.height), borderMode=cv2.BORDER_REPLICATE)
+        frame = np.clip(frame + rng.normal(0, 4, frame.shape), 0, 255).astype(np.uint8)
+        keypoints, descriptors = orb.detectAndCompute(frame, None)
+        test_set.append((np.float32([kp.pt for kp in keypoints]), descriptors, np.linalg.inv(board_to_frame)))
+
+    print(f"{len(reference_descriptors)} reference x ~{len(test_set[0][1])} frame descriptors, {args.frames} frames, "
+          f"{args.boards} candidate boards per frame (error = mean corner distance in pixels)")
+    print(f"{'matcher':>14} {'index ms':>9} {'match ms':>9} {'select ms':>10} {'matches':>8} {'inliers %':>10} {'error px':>9} {'max px':>8}")
+    for method in args.matchers:
+        matcher = FeatureMatcher(method, ratio=args.ratio)
+        index_s, match_s, counts, inlier_ratios, errors = 0.0, 0.0, [], [], []
+        for frame_points, frame_descriptors, truth in test_set:
+            start = time.perf_counter()
+            matcher.set_frame(frame_descriptors)
+            index_s += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.boards):  # reference selection matches every short-listed board against the frame
+                matches = matcher.match(reference_descriptors)
+            match_s += (time.perf_counter() - start) / args.boards
+
+            homography = homography_from_matches(reference_points, frame_points, matches)
+            counts.append(len(matches))
+            if homography is None:
+                errors.append(float("inf"))
+                continue
+            projected = cv2.perspectiveTransform(np.float32([frame_points[m.trainIdx] for m in matches]).reshape(-1, 1, 2), homography)
+            residuals = np.linalg.norm(projected.reshape(-1, 2) - reference_points[[m.queryIdx for m in matches]], axis=1)
+            inlier_ratios.append(float(np.mean(residuals < 5.0)))
+            errors.append(corner_error(homography, truth, board.shape))
+
+        frames = len(test_set)
+        print(f"{method:>14} {index_s * 1000 / frames:>9.1f} {match_s * 1000 / frames:>9.1f} "
+              f"{(index_s + match_s * args.boards) * 1000 / frames:>10.1f} {np.mean(counts):>8.1f} "
+              f"{np.mean(inlier_ratios) if inlier_ratios else 0:>10.0%} {np.mean(errors):>9.2f} {np.max(errors):>8.2f}")
+
+
+# ******************* Live session length ************************ #
+
+def synthetic_recipe(board, good, ng_linked, ng_unlinked, unannotated, seed):
+    """Recipe of a board: GOOD labels, NG variants at some of them, NG templates elsewhere and ROI images without annotation"""
+    rng = np.random.default_rng(seed)
+    height, width = board.shape
+    recipe = Recipe("BENCH", "BENCH", "TOP VIEW")
+    positions = [(int(rng.integers(0, width - 100)), int(rng.integers(0, height - 60))) for _ in range(good + ng_unlinked)]
+    for i, (x, y) in enumerate(positions):
+        folder_type = "GOOD" if i < good else "NG"
+        template = board[y:y + 60, x:x + 100].copy()
+        if folder_type == "NG":
+            template = cv2.GaussianBlur(rng.integers(0, 255, template.shape, dtype=np.uint8), (0, 0), 3)  # defect never on a good board
+        annotation = {"image_x": x, "image_y": y, "width": 100, "height": 60, "serial_number": f"S{i}"}
+        recipe.rois.append({"name": f"{folder_type}_{i}.png", "folder_type": folder_type, "annotation": annotation, "template": template})
+    for i in range(ng_linked):
+        roi = recipe.rois[i]
+        template = roi["template"].copy()
+        template[20:40, :] = 0  # missing / damaged label
+        recipe.rois.append({"name": f"NG_{i}.png", "folder_type": "NG", "annotation": roi["annotation"], "template": template})
+    recipe.expected_rois = {roi["name"] for roi in recipe.rois} | {f"unannotated_{i}.png" for i in range(unannotated)}
+    return recipe
+
+
+def legacy_session(engine, recipe, frames, homography):
+    """The live loop before incremental sessions: every ROI matched every 5th frame, done when every ROI PNG was seen"""
+    detected, no_new, frame_count = set(), 0, 0
+    while frame_count < 300:
+        frame = frames[frame_count % len(frames)]
+        frame_count += 1
+        if frame_count % 5 == 0:
+            new = 0
+            for detection in engine.match_frame(frame, homography):
+                if detection["detected"] and detection["name"] not in detected:
+                    detected.add(detection["name"])
+                    new += 1
+            no_new = 0 if new else no_new + 1
+        if len(detected) >= len(recipe.expected_rois) or no_new >= 30:
+            break
+    return frame_count, detected
+
+
+def live_session(engine, recipe, frames, homography):
+    session = LiveSession(engine)
+    policy = create_stopping_policy(recipe.settings)
+    while True:
+        frame = frames[session.frames % len(frames)]
+        session.observe(frame)
+        if session.idle:
+            session.replay()
+        else:
+            session.process(frame, homography)
+        if policy.should_stop(session):
+            return session.frames, {recipe.rois[location]["name"] for location in session.found}
+
+
+def bench_session(args):
+    print(f"{args.boards} good boards, {args.rois} GOOD labels (+{args.ng_linked} linked / {args.ng_unlinked} unlinked NG templates, "
+          f"{args.unannotated} unannotated ROI images), session length at {args.fps:g} fps")
+    print(f"{'policy':>26} {'frames':>7} {'seconds':>8} {'compute ms':>11} {'GOOD found':>11}")
+    homography = np.eye(3)
+    with tempfile.TemporaryDirectory() as data_root:
+        engine = InspectionEngine(data_root=data_root, use_cuda=False)
+        variants = [("before (every 5th, PNGs)", None)] + [(f"after ({name})", name) for name in args.policies]
+        results = {label: [] for label, _ in variants}
+        for seed in range(args.boards):
+            board = synthetic_board(args.width, args.height, seed=seed)
+            rng = np.random.default_rng(seed)
+            frames = [np.clip(board + rng.normal(0, 3, board.shape), 0, 255).astype(np.uint8) for _ in range(8)]
+            recipe = synthetic_recipe(board, args.rois, args.ng_linked, args.ng_unlinked, args.unannotated, seed)
+            recipe.settings.update({"warp_mode": "patches", "stable_frames": args.stable_frames})
+            engine.set_recipe(recipe)
+            good_labels = {roi["name"] for roi in recipe.rois if roi["folder_type"] == "GOOD"}
+            for label, policy in variants:
+                start = time.perf_counter()
+                if policy is None:
+                    frame_count, found = legacy_session(engine, recipe, frames, homography)
+                else:
+                    recipe.settings["stopping_policy"] = policy
+                    frame_count, found = live_session(engine, recipe, frames, homography)
+                results[label].append((frame_count, time.perf_counter() - start, len(found & good_labels)))
+        engine.close()
+
+    for label, runs in results.items():
+        frame_counts, seconds, found = zip(*runs)
+        print(f"{label:>26} {np.mean(frame_counts):>7.1f} {np.mean(frame_counts) / args.fps:>8.2f} "
+              f"{np.mean(seconds) * 1000:>11.1f} {np.mean(found):>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspection engine benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    fft_parser = subparsers.add_parser("fft", help="FFT batched matching vs per-template cv2.matchTemplate")
+    fft_parser.add_argument("--width", type=int, default=1920)
+    fft_parser.add_argument("--height", type=int, default=1080)
+    fft_parser.add_argument("--sizes", nargs="+", default=["32x24", "64x48", "128x96", "256x192", "480x320"])
+    fft_parser.add_argument("--counts", nargs="+", type=int, default=[8, 32])
+    fft_parser.add_argument("--batch-size", type=int, default=8)
+    fft_parser.add_argument("--repeat", type=int, default=3)
+    fft_parser.set_defaults(func=bench_fft)
+
+    index_parser = subparsers.add_parser("reference_index", help="Thumbnail index short-listing of reference boards")
+    index_parser.add_argument("--width", type=int, default=960)
+    index_parser.add_argument("--height", type=int, default=540)
+    index_parser.add_argument("--banks", nargs="+", type=int, default=[10, 100, 1000])
+    index_parser.add_argument("--shortlist", type=int, default=3)
+    index_parser.add_argument("--queries", type=int, default=50)
+    index_parser.set_defaults(func=bench_reference_index)
+
+    alignment_parser = subparsers.add_parser("alignment", help="Reduced-resolution ORB alignment accuracy vs speed")
+    alignment_parser.add_argument("--width", type=int, default=1920)
+    alignment_parser.add_argument("--height", type=int, default=1080)
+    alignment_parser.add_argument("--frames", type=int, default=10)
+    alignment_parser.add_argument("--scales", nargs="+", type=float, default=[1.0, 0.5, 0.25])
+    alignment_parser.add_argument("--refine", action="store_true", help="also measure the full-resolution ECC refinement")
+    alignment_parser.add_argument("--threads", type=int, default=None)
+    alignment_parser.set_defaults(func=bench_alignment)
+
+    matcher_parser = subparsers.add_parser("matcher", help="BF cross-check vs kNN ratio-test descriptor matching")
+    matcher_parser.add_argument("--width", type=int, default=1920)
+    matcher_parser.add_argument("--height", type=int, default=1080)
+    matcher_parser.add_argument("--features", type=int, default=5000)
+    matcher_parser.add_argument("--frames", type=int, default=5)
+    matcher_parser.add_argument("--boards", type=int, default=3, help="candidate boards matched per frame")
+    matcher_parser.add_argument("--ratio", type=float, default=0.8)
+    matcher_parser.add_argument("--matchers", nargs="+", default=FEATURE_MATCHERS)
+    matcher_parser.set_defaults(func=bench_matcher)
+
+    session_parser = subparsers.add_parser("session", help="Live session length on good boards per stopping policy")
+    session_parser.add_argument("--width", type=int, default=1920)
+    session_parser.add_argument("--height", type=int, default=1080)
+    session_parser.add_argument("--boards", type=int, default=5)
+    session_parser.add_argument("--rois", type=int, default=30, help="GOOD labels per board")
+    session_parser.add_argument("--ng-linked", type=int, default=10, help="NG templates at a GOOD label")
+    session_parser.add_argument("--ng-unlinked", type=int, default=3, help="NG templates that never match a good board")
+    session_parser.add_argument("--unannotated", type=int, default=2, help="ROI images without annotation")
+    session_parser.add_argument("--stable-frames", type=int, default=30)
+    session_parser.add_argument("--fps", type=float, default=30.0)
+    session_parser.add_argument("--policies", nargs="+", default=STOPPING_POLICIES)
+    session_parser.set_defaults(func=bench_session)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()